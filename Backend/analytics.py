@@ -0,0 +1,339 @@
+import argparse
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+import numpy as np
+
+import exams
+import scan
+
+# Item flags: difficulty is the share of sheets answering correctly,
+# discrimination the item-rest point-biserial correlation
+TOO_HARD = 0.2
+TOO_EASY = 0.95
+WEAK_DISCRIMINATION = 0.15
+
+# Aggregate arrays of ItemStats, in the order they are stored
+STATE_FIELDS = (
+    "sheets", "correct", "score_with", "score_sum", "score_sq", "choices",
+    "blank", "multi", "confidence", "fill", "filled", "histogram",
+)
+
+
+class ItemStats:
+    """
+    Running item analysis of one exam: every graded sheet is folded into
+    fixed-size sums, so memory does not grow with the number of sheets and
+    the statistics can be read at any point. Sheets can be added one at a
+    time or as (sheets, questions) batches; two ItemStats merge by adding.
+    """
+
+    def __init__(self, questions, choices):
+        self.questions = questions
+        self.choices_per_question = choices
+        self.sheets = 0
+        self.correct = np.zeros(questions, np.int64)
+        # Sum of total scores over the sheets that got each question right
+        self.score_with = np.zeros(questions, np.float64)
+        self.score_sum = 0.0
+        self.score_sq = 0.0
+        self.choices = np.zeros((questions, choices), np.int64)
+        self.blank = np.zeros(questions, np.int64)
+        self.multi = np.zeros(questions, np.int64)
+        self.confidence = np.zeros(questions, np.float64)
+        self.fill = np.zeros((questions, choices), np.float64)
+        self.filled = 0
+        self.histogram = np.zeros(questions + 1, np.int64)
+
+    def add(self, grading, picks, blank=None, multi=None, confidence=None, fill=None):
+        """
+        Fold in graded sheets. Every argument is per question, either (q,)
+        for one sheet or (sheets, q) for a batch; blank and multi are
+        boolean masks and fill the raw (sheets, q, choices) fill matrices.
+        """
+        grading = np.atleast_2d(np.asarray(grading, np.int64))
+        picks = np.atleast_2d(np.asarray(picks, np.intp))
+        n, q = grading.shape
+        blank = np.zeros((n, q), bool) if blank is None else np.atleast_2d(np.asarray(blank, bool))
+        totals = grading.sum(axis=1)
+
+        self.sheets += n
+        self.correct += grading.sum(axis=0)
+        self.score_with += totals @ grading
+        self.score_sum += float(totals.sum())
+        self.score_sq += float((totals.astype(np.float64) ** 2).sum())
+        self.histogram += np.bincount(totals, minlength=q + 1)
+
+        # Blank questions have no real pick, so they only count as blank
+        cells = np.arange(q) * self.choices_per_question + picks
+        self.choices += np.bincount(
+            cells[~blank], minlength=q * self.choices_per_question
+        ).reshape(q, self.choices_per_question)
+        self.blank += blank.sum(axis=0)
+        if multi is not None:
+            self.multi += np.atleast_2d(np.asarray(multi, bool)).sum(axis=0)
+        if confidence is not None:
+            self.confidence += np.atleast_2d(np.asarray(confidence, np.float64)).sum(axis=0)
+        if fill is not None:
+            fill = np.asarray(fill, np.float64).reshape(-1, q, self.choices_per_question)
+            self.fill += fill.sum(axis=0)
+            self.filled += len(fill)
+
+    def add_result(self, result, fill=None):
+        """Fold in one scan result dict (as returned by grade_measurement)"""
+        q = len(result["grading"])
+        self.add(
+            result["grading"],
+            result["picks"],
+            _mask(result.get("blank", []), q),
+            _mask(result.get("multi", []), q),
+            result.get("confidence"),
+            fill,
+        )
+
+    def merge(self, other):
+        for field in STATE_FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        return self
+
+    def summary(self, key=None):
+        """Exam-level statistics and one entry per question"""
+        n = self.sheets
+        if not n:
+            return {"sheets": 0, "items": []}
+        k = self.questions
+        p = self.correct / n
+        mean = self.score_sum / n
+        variance = max(self.score_sq / n - mean ** 2, 0.0)
+
+        # Item-rest correlation from the running sums: x is the item (0/1),
+        # y the score on the other questions
+        rest_mean = mean - p
+        rest_var = (self.score_sq - 2 * self.score_with + self.correct) / n - rest_mean ** 2
+        covariance = (self.score_with - self.correct) / n - p * rest_mean
+        spread = np.sqrt(np.clip(p * (1 - p) * rest_var, 0, None))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            discrimination = np.where(spread > 0, covariance / spread, np.nan)
+
+        # KR-20 reliability of the whole test
+        reliability = None
+        if k > 1 and variance > 0:
+            reliability = k / (k - 1) * (1 - float((p * (1 - p)).sum()) / variance)
+
+        items = []
+        for i in range(k):
+            item = {
+                "question": i + 1,
+                "difficulty": round(float(p[i]), 4),
+                "discrimination": None if np.isnan(discrimination[i]) else round(float(discrimination[i]), 4),
+                "choices": self.choices[i].tolist(),
+                "blank": int(self.blank[i]),
+                "multi": int(self.multi[i]),
+                "confidence": round(float(self.confidence[i] / n), 4),
+            }
+            if self.filled:
+                item["fill"] = np.round(self.fill[i] / self.filled, 4).tolist()
+            if key is not None:
+                item["key"] = int(key[i])
+            item["flags"] = item_flags(item)
+            items.append(item)
+
+        return {
+            "sheets": n,
+            "mean": round(mean, 4),
+            "std": round(float(np.sqrt(variance)), 4),
+            "reliability": None if reliability is None else round(reliability, 4),
+            "histogram": self.histogram.tolist(),
+            "items": items,
+        }
+
+    def state(self):
+        return {field: np.asarray(getattr(self, field)) for field in STATE_FIELDS}
+
+    @classmethod
+    def from_state(cls, state):
+        questions, choices = state["choices"].shape
+        stats = cls(questions, choices)
+        for field in STATE_FIELDS:
+            value = state[field]
+            setattr(stats, field, value.item() if value.ndim == 0 else value.copy())
+        return stats
+
+
+def _mask(numbers, questions):
+    """Boolean mask from a list of 1-based question numbers"""
+    mask = np.zeros(questions, bool)
+    mask[np.asarray(numbers, np.intp) - 1] = True
+    return mask
+
+
+def item_flags(item):
+    """Review hints for one summarized question"""
+    flags = []
+    if item["difficulty"] < TOO_HARD:
+        flags.append("hard")
+    elif item["difficulty"] > TOO_EASY:
+        flags.append("easy")
+    r = item["discrimination"]
+    if r is not None and r < 0:
+        flags.append("negative_discrimination")
+    elif r is not None and r < WEAK_DISCRIMINATION:
+        flags.append("weak_discrimination")
+    if "key" in item:
+        counts = item["choices"]
+        if max(counts) > counts[item["key"]]:
+            # A distractor drew more picks than the key: possibly a wrong key
+            flags.append("distractor_beats_key")
+    return flags
+
+
+# Per-exam aggregates live next to the exam as <id>.stats.npz, shared by all
+# workers and updated under an exclusive lock
+
+def _stats_path(exam):
+    return os.path.join(exams.EXAM_DIR, exam.id + ".stats.npz")
+
+
+@contextmanager
+def _locked(exam):
+    with open(os.path.join(exams.EXAM_DIR, exam.id + ".stats.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _load(exam):
+    """Stored stats of an exam, or None when missing or built for another key"""
+    try:
+        with np.load(_stats_path(exam), allow_pickle=False) as data:
+            if not np.array_equal(data["key"], exam.key):
+                return None
+            return ItemStats.from_state(data)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def _save(exam, stats):
+    fd, tmp = tempfile.mkstemp(dir=exams.EXAM_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, key=exam.key, **stats.state())
+        os.replace(tmp, _stats_path(exam))
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def rebuild(exam):
+    """Item stats of an exam recomputed from its stored fill matrices, one at a time"""
+    stats = ItemStats(exam.questions, exam.layout.choices)
+    for _, measured in exam.submissions.items():
+        try:
+            result = scan.grade_measurement(measured, exam.questions, exam.key, exam.layout)
+        except scan.ScanError:
+            continue
+        stats.add_result(result, measured["fill"][: exam.questions])
+    return stats
+
+
+def _current(exam):
+    # The key changed since the stats were stored: start over from the
+    # stored sheets so every item is graded against the same key
+    return _load(exam) or rebuild(exam)
+
+
+def submit(exam, submission, result, measured):
+    """
+    Keep a graded sheet's measurement with its exam and, the first time the
+    sheet is seen, fold it into the exam's stats. The check, the record and
+    the store happen under the exam's lock, so a photo graded by two
+    workers at once is counted once.
+    """
+    with _locked(exam):
+        if exam.submissions.has(submission):
+            return
+        # Loaded (or rebuilt) before the sheet is stored, so a rebuild
+        # cannot count it as well
+        stats = _current(exam)
+        stats.add_result(result, measured["fill"][: exam.questions])
+        _save(exam, stats)
+        exam.submissions.put(submission, measured)
+
+
+def regrade(exam):
+    """
+    Results of every stored sheet of an exam graded against its current
+    key, from the stored fill matrices; the stats are rebuilt in the same
+    pass and replaced under the lock, so no sheet recorded meanwhile is lost
+    """
+    results = []
+    with _locked(exam):
+        stats = ItemStats(exam.questions, exam.layout.choices)
+        for submission, measured in exam.submissions.items():
+            try:
+                result = scan.grade_measurement(measured, exam.questions, exam.key, exam.layout)
+                stats.add_result(result, measured["fill"][: exam.questions])
+            except scan.ScanError as e:
+                result = scan.error_result(e)
+            results.append(dict(result, submission=submission))
+        _save(exam, stats)
+    return results
+
+
+def exam_summary(exam):
+    """Current item analysis of an exam"""
+    with _locked(exam):
+        stats = _load(exam)
+        if stats is None:
+            stats = rebuild(exam)
+            _save(exam, stats)
+    return {"exam": exam.id, **stats.summary(exam.key)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Item analysis over graded results (JSON lines from batch.py or ingest.py)"
+    )
+    parser.add_argument("results", nargs="?", default="-", help="JSON lines file, - for stdin")
+    parser.add_argument("--answers", help="answer key as a JSON array or @file.json, to mark the key column")
+    args = parser.parse_args()
+
+    key = None
+    if args.answers:
+        if args.answers.startswith("@"):
+            with open(args.answers[1:]) as f:
+                key = json.load(f)
+        else:
+            key = json.loads(args.answers)
+
+    stats = None
+    skipped = 0
+    stream = sys.stdin if args.results == "-" else open(args.results)
+    with stream:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            result = json.loads(line)
+            if "grading" not in result:
+                skipped += 1
+                continue
+            if stats is None:
+                questions = len(result["grading"])
+                choices = scan.get_layout(result.get("layout")).choices
+                stats = ItemStats(questions, choices)
+            stats.add_result(result)
+
+    summary = stats.summary(key) if stats else {"sheets": 0, "items": []}
+    print(json.dumps({**summary, "skipped": skipped}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+MANIFEST_EXTENSIONS = (".txt", ".lst", ".manifest")
+
+
+def collect_paths(source):
+    """Expand a directory, glob pattern or manifest file into a list of image paths"""
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    if os.path.isfile(source) and source.lower().endswith(MANIFEST_EXTENSIONS):
+        # One path per line, relative paths resolved against the manifest's folder
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            lines = [line.strip() for line in f]
+        return [
+            line if os.path.isabs(line) else os.path.join(base, line)
+            for line in lines
+            if line and not line.startswith("#")
+        ]
+    return sorted(glob.glob(source, recursive=True))
+
+
+def load_answers(value):
+    """Answer key given inline as a JSON array or as @path to a JSON file"""
+    if value.startswith("@"):
+        with open(value[1:]) as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def init_worker():
+    # Import once per pool process instead of once per sheet
+    global scan, rigs
+    import scan
+    import rigs
+
+
+def grade_path(path, no_questions, ans, keep_image, rig_id=None, layout_name=None):
+    started = time.perf_counter()
+    try:
+        # A calibrated rig brings its layout; load_rig and get_layout keep
+        # theirs per process
+        rig = rigs.load_rig(rig_id) if rig_id else None
+        sheet_layout = rig.layout if rig else scan.get_layout(layout_name)
+        img = scan.read_image(path, sheet_layout)
+        result = scan.grade_image(img, no_questions, ans, sheet_layout, render=keep_image, rig=rig)
+    except Exception as e:
+        result = scan.error_result(e)
+    return {"path": path, **result, "seconds": round(time.perf_counter() - started, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade a folder of answer sheets against one key")
+    parser.add_argument("source", help="directory, glob pattern or manifest file (one path per line)")
+    parser.add_argument("answers", help="answer key as a JSON array, or @file.json")
+    parser.add_argument("--questions", type=int, help="number of questions (defaults to the key length)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="process pool size")
+    parser.add_argument("--ordered", action="store_true", help="emit results in input order instead of completion order")
+    parser.add_argument("--images", action="store_true", help="include the annotated base64 image in each line")
+    parser.add_argument("--layout", help="sheet layout name")
+    parser.add_argument("--rig", help="calibrated rig id (see rigs.py) the sheets were scanned on")
+    args = parser.parse_args()
+
+    import scan
+    import rigs
+
+    ans = load_answers(args.answers)
+    no_questions = args.questions or len(ans)
+    try:
+        if args.rig:
+            sheet_layout = rigs.load_rig(args.rig).layout
+            if args.layout and args.layout != sheet_layout.name:
+                raise scan.ScanError(f"Rig {args.rig} is calibrated for layout {sheet_layout.name}, not {args.layout}")
+        else:
+            sheet_layout = scan.get_layout(args.layout)
+        ans = scan.parse_answers(no_questions, ans, sheet_layout)
+    except Exception as e:
+        print(json.dumps(scan.error_result(e)))
+        sys.exit(1)
+
+    paths = collect_paths(args.source)
+    if not paths:
+        print(json.dumps({"error": f"No images found for {args.source}"}))
+        sys.exit(1)
+
+    started = time.perf_counter()
+    graded = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        futures = [
+            executor.submit(grade_path, path, no_questions, ans, args.images, args.rig, args.layout)
+            for path in paths
+        ]
+        for future in (futures if args.ordered else as_completed(futures)):
+            result = future.result()
+            if "error" in result:
+                failed += 1
+            else:
+                graded += 1
+            print(json.dumps(result), flush=True)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "sheets": len(paths),
+        "graded": graded,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "sheets_per_sec": round(len(paths) / elapsed, 2) if elapsed else None,
+    }
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
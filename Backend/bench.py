@@ -0,0 +1,176 @@
+"""
+Accuracy and latency benchmark of the grading pipeline the server runs
+(scan.py, in its "sample" and "warp" scoring modes) over a synth.py corpus.
+
+process.py and omr_grading.py are not covered: they are standalone scripts
+that grade on import, with their own fixed sheet geometries (a 10-question
+and a 20x5 grid) that synth.py corpora do not produce.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+# Stages timed for every sheet, in pipeline order
+STAGES = ("read", "decode", "quality", "register", "measure", "grade")
+
+# A run regresses against a baseline when a stage's p50 grows by more than
+# LATENCY_TOLERANCE, or accuracy drops by more than ACCURACY_TOLERANCE
+LATENCY_TOLERANCE = 0.15
+ACCURACY_TOLERANCE = 0.005
+
+
+def load_truth(corpus):
+    """Truth records of a synth.py corpus directory"""
+    with open(os.path.join(corpus, "truth.jsonl")) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=float)
+    if not values.size:
+        return {}
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3), "mean": round(values.mean(), 3)}
+
+
+def run_sheet(scan, registration, path, record, mode):
+    """Grade one corpus sheet stage by stage; returns (stage times in ms, per-question hits, error)"""
+    sheet_layout = scan.get_layout(record["layout"])
+    marks = np.array(record["answers"])
+    key = np.where(marks < 0, 0, marks)
+    times = {}
+
+    def timed(stage, fn, *args):
+        started = time.perf_counter()
+        value = fn(*args)
+        times[stage] = (time.perf_counter() - started) * 1000
+        return value
+
+    try:
+        data = timed("read", lambda: open(path, "rb").read())
+        gray = timed("decode", scan.decode_image, data, sheet_layout, True)
+        timed("quality", scan.check_quality, gray)
+        corners, method = timed("register", registration.register, gray, sheet_layout)
+        if corners is None:
+            raise scan.ScanError("No answer sheet detected")
+        measured = timed(
+            "measure", scan.measure_sheet, gray, sheet_layout, mode, False, (corners, method)
+        )
+        result = timed("grade", scan.grade_measurement, measured, len(marks), key, sheet_layout)
+    except Exception as e:
+        return times, np.zeros(len(marks), bool), str(e)
+
+    # A question is read correctly when its mark is picked, or when a blank
+    # question is flagged blank
+    picks = np.array(result["picks"])
+    blank = np.zeros(len(marks), bool)
+    blank[np.array(result["blank"], dtype=int) - 1] = True
+    hits = np.where(marks < 0, blank, (picks == marks) & ~blank)
+    return times, hits, None
+
+
+def run_pipeline(corpus, records, mode):
+    """Benchmark one scoring mode over the corpus in a fresh process"""
+    import registration
+    import scan
+
+    stage_times = {stage: [] for stage in STAGES}
+    totals = []
+    hits_by_question = {}
+    errors = {}
+    sheets = 0
+    started = time.perf_counter()
+    for record in records:
+        times, hits, error = run_sheet(scan, registration, os.path.join(corpus, record["file"]), record, mode)
+        sheets += 1
+        for stage, ms in times.items():
+            stage_times[stage].append(ms)
+        totals.append(sum(times.values()))
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+        for q, hit in enumerate(hits):
+            hits_by_question.setdefault(q, []).append(bool(hit))
+    elapsed = time.perf_counter() - started
+
+    per_question = [float(np.mean(hits_by_question[q])) for q in sorted(hits_by_question)]
+    all_hits = [hit for q in hits_by_question.values() for hit in q]
+    return {
+        "mode": mode,
+        "sheets": sheets,
+        "sheets_per_sec": round(sheets / elapsed, 2) if elapsed else None,
+        "latency_ms": {stage: percentiles(values) for stage, values in stage_times.items() if values},
+        "total_ms": percentiles(totals),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "accuracy": round(float(np.mean(all_hits)), 5) if all_hits else None,
+        "question_accuracy": [round(a, 4) for a in per_question],
+        "errors": errors,
+    }
+
+
+def compare(current, baseline):
+    """Regression messages of a run against a baseline run"""
+    problems = []
+    previous = {run["mode"]: run for run in baseline["runs"]}
+    for run in current["runs"]:
+        before = previous.get(run["mode"])
+        if before is None:
+            continue
+        for stage, stats in run["latency_ms"].items():
+            old = before["latency_ms"].get(stage, {}).get("p50")
+            if old and stats["p50"] > old * (1 + LATENCY_TOLERANCE) and stats["p50"] - old > 0.5:
+                problems.append(f"{run['mode']}: {stage} p50 {old:.2f} -> {stats['p50']:.2f} ms")
+        if before["accuracy"] is not None and run["accuracy"] is not None:
+            if run["accuracy"] < before["accuracy"] - ACCURACY_TOLERANCE:
+                problems.append(f"{run['mode']}: accuracy {before['accuracy']:.4f} -> {run['accuracy']:.4f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and latency benchmark over a synth.py corpus")
+    parser.add_argument("corpus", help="corpus directory written by synth.py")
+    parser.add_argument("--modes", default="sample,warp", help="comma separated scoring modes to run")
+    parser.add_argument("--out", help="where to save the results JSON (default bench-results/<time>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to check for regressions")
+    args = parser.parse_args()
+
+    records = load_truth(args.corpus)
+    runs = []
+    # Each mode runs in its own process so peak memory is its own
+    for mode in args.modes.split(","):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            run = pool.submit(run_pipeline, args.corpus, records, mode).result()
+        runs.append(run)
+        latency = run["total_ms"]
+        print(
+            f"{mode}: {run['sheets']} sheets, {run['sheets_per_sec']} sheets/s, "
+            f"total p50 {latency.get('p50')} ms p95 {latency.get('p95')} ms p99 {latency.get('p99')} ms, "
+            f"accuracy {run['accuracy']}, peak RSS {run['peak_rss_mb']} MB, errors {sum(run['errors'].values())}",
+            file=sys.stderr,
+        )
+
+    report = {"corpus": os.path.abspath(args.corpus), "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": runs}
+    out = args.out or os.path.join("bench-results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {out}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(report, json.load(f))
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class Buffers:
+    """
+    Named scratch arrays reused from sheet to sheet by a long-lived process.
+    An array is only reallocated when the shape or dtype asked for changes,
+    so with a fixed layout the hot path stops allocating full frames after
+    the first sheet and RSS stays flat. An array handed out is only valid
+    until the same name is asked for again; never keep or return one.
+    """
+
+    def __init__(self):
+        self.arrays = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        shape = tuple(int(n) for n in shape)
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self.arrays[name] = np.empty(shape, dtype)
+            self.allocations += 1
+        return array
+
+    def zeros(self, name, shape, dtype=np.uint8):
+        array = self.get(name, shape, dtype)
+        array.fill(0)
+        return array
+
+    def stats(self):
+        return {
+            "buffers": len(self.arrays),
+            "bytes": sum(array.nbytes for array in self.arrays.values()),
+            "allocations": self.allocations,
+        }
+
+
+# Scratch space of this process. Grading is single-threaded per process
+# (pool workers, batch.py processes), so one set of buffers is enough.
+scratch = Buffers()
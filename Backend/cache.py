@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+# Entries kept in process, and on disk when a shared directory is configured
+DEFAULT_ENTRIES = 256
+DEFAULT_DISK_ENTRIES = 10000
+
+
+def content_key(data, *parts):
+    """Cache key of image bytes plus whatever else the entry depends on"""
+    digest = hashlib.sha256(data)
+    for part in parts:
+        digest.update(b"\0" + str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class MeasurementCache:
+    """
+    Per-image measurements (scan.measure_sheet results) keyed by content hash.
+
+    A bounded LRU lives in the process; with a directory set, entries are
+    also written there as .npz files so every worker sharing the directory
+    sees them. The on-disk store is trimmed to max_disk_entries, least
+    recently used first (a disk hit touches its file); with max_disk_entries
+    None it is never trimmed, for stores that must keep every entry. Only
+    measurements
+    are cached, never grades: a different answer key re-grades the same
+    cached fill matrix.
+    """
+
+    def __init__(self, max_entries=DEFAULT_ENTRIES, directory=None, max_disk_entries=DEFAULT_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        entry = self._load(key) if self.directory else None
+        if entry is not None:
+            self.disk_hits += 1
+            self._touch(key)
+            self._remember(key, entry)
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        if self.directory:
+            self._store(key, entry)
+
+    def has(self, key):
+        """Whether an entry is stored, without loading it"""
+        return key in self.entries or bool(self.directory) and os.path.exists(self._path(key))
+
+    def items(self):
+        """(key, entry) of every on-disk entry, loaded one at a time"""
+        if not self.directory:
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".npz"):
+                entry = self._load(name[:-4])
+                if entry is not None:
+                    yield name[:-4], entry
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _touch(self, key):
+        # trim() goes by mtime, so a read must count as a use
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _load(self, key):
+        try:
+            with np.load(self._path(key), allow_pickle=False) as data:
+                return {
+                    "fill": data["fill"],
+                    "escalated": data["escalated"],
+                    "corners": data["corners"],
+                    "registration": str(data["registration"]),
+                    "quality": json.loads(str(data["quality"])),
+                }
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+    def _store(self, key, entry):
+        # Write to a temporary file and rename, so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    fill=entry["fill"],
+                    escalated=entry["escalated"],
+                    corners=entry["corners"],
+                    registration=np.str_(entry["registration"]),
+                    quality=np.str_(json.dumps(entry["quality"])),
+                )
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.disk_writes += 1
+        # Trimming lists the directory, so only do it every so often
+        if self.max_disk_entries is not None and self.disk_writes % 64 == 0:
+            self.trim()
+
+    def trim(self):
+        """Delete the least recently used on-disk entries beyond max_disk_entries"""
+        if self.max_disk_entries is None:
+            return
+        files = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".npz"):
+                    files.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            # Another worker may be trimming the same directory
+            return
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort()
+        for _, path in files[: len(files) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
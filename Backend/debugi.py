@@ -12,6 +12,8 @@ def stackImages(imgArray, scale, lables=[]):
     if rowsAvailable:
         for x in range(0, rows):
             for y in range(0, cols):
+                if imgArray[x][y].shape[:2] != imgArray[0][0].shape[:2]:
+                    imgArray[x][y] = cv2.resize(imgArray[x][y], (width, height))
                 imgArray[x][y] = cv2.resize(imgArray[x][y], (0, 0), None, scale, scale)
                 if len(imgArray[x][y].shape) == 2:
                     imgArray[x][y] = cv2.cvtColor(imgArray[x][y], cv2.COLOR_GRAY2BGR)
@@ -0,0 +1,149 @@
+import struct
+
+import cv2
+import numpy as np
+
+# JPEG decode can scale down by 2/4/8 inside libjpeg (DCT scaling), which is
+# far cheaper than decoding the full 12 MP frame and resizing afterwards.
+REDUCED_FLAGS = {
+    (1, True): cv2.IMREAD_GRAYSCALE,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    (1, False): cv2.IMREAD_COLOR,
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# SOF markers carrying the frame size (C4, C8 and CC are DHT/JPG/DAC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _exif_orientation(segment):
+    """Orientation tag (0x0112) from an APP1 Exif segment, or 1"""
+    if segment[:6] != b"Exif\x00\x00":
+        return 1
+    tiff = segment[6:]
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return 1
+    endian = "<" if tiff[:2] == b"II" else ">"
+    (ifd,) = struct.unpack(endian + "I", tiff[4:8])
+    if ifd + 2 > len(tiff):
+        return 1
+    (count,) = struct.unpack(endian + "H", tiff[ifd:ifd + 2])
+    for i in range(count):
+        entry = ifd + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, _, _ = struct.unpack(endian + "HHI", tiff[entry:entry + 8])
+        if tag == 0x0112:
+            (value,) = struct.unpack(endian + "H", tiff[entry + 8:entry + 10])
+            return value if 1 <= value <= 8 else 1
+    return 1
+
+
+def image_info(data):
+    """
+    (width, height, exif_orientation) read from the JPEG/PNG header without
+    decoding any pixels, or None for other formats or a malformed header.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        width, height = struct.unpack(">II", data[16:24])
+        return width, height, 1
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    orientation = 1
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+        segment = data[pos + 4:pos + 2 + length]
+        if marker == 0xE1:
+            orientation = _exif_orientation(segment)
+        elif marker in SOF_MARKERS and len(segment) >= 5:
+            height, width = struct.unpack(">HH", segment[1:5])
+            return width, height, orientation
+        elif marker == 0xDA:  # start of scan, no frame header found
+            return None
+        pos += 2 + length
+    return None
+
+
+def reduction_factor(width, height, target):
+    """Largest JPEG scale-down (8, 4, 2 or 1) that keeps the long side >= target"""
+    longest = max(width, height)
+    for factor in (8, 4, 2):
+        if longest // factor >= target:
+            return factor
+    return 1
+
+
+def apply_orientation(img, orientation):
+    """Rotate/flip a decoded image so it is upright per its EXIF orientation"""
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+def fit(img, target):
+    """Resize so the longest side is exactly target, keeping the aspect ratio"""
+    height, width = img.shape[:2]
+    scale = target / float(max(width, height))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if size == (width, height):
+        return img
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(img, size, interpolation=interpolation)
+
+
+def decode(data, target=None, gray=False):
+    """
+    Decode image bytes at the smallest JPEG scale that still covers target
+    pixels on the long side, upright and in the original aspect ratio, then
+    fit it to target. With target None the full image is decoded.
+    """
+    info = image_info(data)
+    factor = 1
+    orientation = 1
+    if info is not None:
+        width, height, orientation = info
+        if target:
+            factor = reduction_factor(width, height, target)
+
+    # Orientation is applied here so the result doesn't depend on whether the
+    # OpenCV build honours EXIF for reduced decodes
+    flags = REDUCED_FLAGS[(factor, gray)] | cv2.IMREAD_IGNORE_ORIENTATION
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if img is None:
+        return None
+    img = apply_orientation(img, orientation)
+    return fit(img, target) if target else img
+
+
+def read(path, target=None, gray=False):
+    """decode() for an image file on disk"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return decode(data, target, gray)
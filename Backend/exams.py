@@ -0,0 +1,55 @@
+import json
+import os
+import re
+
+import numpy as np
+
+import layout
+from cache import MeasurementCache
+
+# Registered exams: <id>.json written by the server, and <id>/ holding the
+# fill matrices of every sheet graded for the exam
+EXAM_DIR = os.environ.get("GRADER_EXAM_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "exams")
+EXAM_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class Exam:
+    """An exam compiled for grading: its layout and its key as a read-only array"""
+
+    def __init__(self, spec):
+        self.id = spec["id"]
+        self.title = spec.get("title")
+        self.layout = layout.load_layout(spec.get("layout"))
+        self.questions = int(spec["questions"])
+        if not 0 < self.questions <= self.layout.questions:
+            raise ValueError(f"Exam {self.id}: question count must be between 1 and {self.layout.questions}")
+        self.key = np.array(spec["answers"], dtype=np.intp)
+        if self.key.shape != (self.questions,) or self.key.min() < 0 or self.key.max() >= self.layout.choices:
+            raise ValueError(f"Exam {self.id}: invalid answer key")
+        self.key.setflags(write=False)
+        # The fill matrix of every sheet graded for the exam. Regrades and
+        # the item stats are built from them, so they are never evicted.
+        self.submissions = MeasurementCache(0, os.path.join(EXAM_DIR, self.id), None)
+
+
+# Compiled exams by id, with the mtime of the file they were compiled from
+_compiled = {}
+
+
+def load_exam(exam_id):
+    """
+    Compiled exam for an id, recompiled only when its file changed (e.g. the
+    key was corrected)
+    """
+    if not isinstance(exam_id, str) or not EXAM_ID.match(exam_id):
+        raise ValueError(f"Invalid exam id: {exam_id}")
+    path = os.path.join(EXAM_DIR, exam_id + ".json")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise ValueError(f"Unknown exam: {exam_id}")
+
+    cached = _compiled.get(exam_id)
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            cached = _compiled[exam_id] = (mtime, Exam(json.load(f)))
+    return cached[1]
@@ -0,0 +1,148 @@
+const crypto = require("crypto");
+const fs = require("fs");
+const path = require("path");
+
+const IMAGE_ID = /^[0-9a-f]{64}$/;
+const IMAGE_TYPE = /^[a-z]{1,8}$/;
+
+// Content-addressed, byte-bounded store for rendered result images, kept on
+// disk as <sha256>.<type> so the URLs handed out (and saved in job results
+// and the app's history) survive restarts. The id doubles as a strong ETag
+// and responses can be cached forever. Reads touch the file's mtime, so
+// the least recently used images are evicted once maxBytes is exceeded,
+// across restarts too. Writes and removals run in the background: a new
+// image is served from memory until its file is in place.
+class ImageStore {
+  constructor(dir, maxBytes = 1024 * 1024 * 1024) {
+    this.dir = dir;
+    this.maxBytes = maxBytes;
+    this.bytes = 0;
+    // id -> { type, size, buffer?, written? }, least recently used first;
+    // buffer and written are only set while the file is being written
+    this.images = new Map();
+    // Writes and removals in flight
+    this.pending = new Set();
+
+    fs.mkdirSync(dir, { recursive: true });
+    const found = [];
+    for (const name of fs.readdirSync(dir)) {
+      // Skips the temporary files of writes cut short
+      const [id, type, ...rest] = name.split(".");
+      if (rest.length || !IMAGE_ID.test(id) || !IMAGE_TYPE.test(type || "")) {
+        continue;
+      }
+      const stat = fs.statSync(path.join(dir, name));
+      found.push({ id, type, size: stat.size, used: stat.mtimeMs });
+    }
+    found.sort((a, b) => a.used - b.used);
+    for (const { id, type, size } of found) this.add(id, type, size);
+    this.evict();
+  }
+
+  file(id, type) {
+    return path.join(this.dir, `${id}.${type}`);
+  }
+
+  add(id, type, size) {
+    this.images.set(id, { type, size });
+    this.bytes += size;
+  }
+
+  evict() {
+    while (this.bytes > this.maxBytes && this.images.size > 1) {
+      const [oldest, entry] = this.images.entries().next().value;
+      this.images.delete(oldest);
+      this.bytes -= entry.size;
+      // Wait out a write still in flight so it can't land after the removal
+      // and skip the removal if the image was stored again meanwhile
+      const removal = Promise.resolve(entry.written).then(() => {
+        if (this.images.has(oldest)) return;
+        return fs.promises.rm(this.file(oldest, entry.type), { force: true });
+      });
+      this.track(removal);
+    }
+  }
+
+  track(promise) {
+    const tracked = promise.catch(() => {}).finally(() => {
+      this.pending.delete(tracked);
+    });
+    this.pending.add(tracked);
+    return tracked;
+  }
+
+  // Store an image and return its id right away; the file is written in
+  // the background through a temporary file
+  put(buffer, type = "jpg") {
+    if (!IMAGE_TYPE.test(type)) throw new Error(`Invalid image type: ${type}`);
+    const id = crypto.createHash("sha256").update(buffer).digest("hex");
+    if (this.has(id)) return id;
+    const file = this.file(id, type);
+    const tmp = `${file}.${process.pid}.${crypto.randomUUID()}.tmp`;
+    this.add(id, type, buffer.length);
+    const entry = this.images.get(id);
+    entry.buffer = buffer;
+    const write = fs.promises
+      .writeFile(tmp, buffer)
+      .then(() => fs.promises.rename(tmp, file))
+      .then(
+        () => {
+          delete entry.buffer;
+          delete entry.written;
+        },
+        () => {
+          // Not persisted: forget it rather than serve it only until restart
+          fs.promises.rm(tmp, { force: true }).catch(() => {});
+          if (this.images.get(id) === entry) {
+            this.images.delete(id);
+            this.bytes -= entry.size;
+          }
+        }
+      );
+    entry.written = this.track(write);
+    this.evict();
+    return id;
+  }
+
+  // Resolves once every write and removal started so far has finished
+  flush() {
+    return Promise.all(this.pending);
+  }
+
+  // Whether an image is stored; marks it as most recently used
+  has(id) {
+    const entry = this.images.get(id);
+    if (!entry) return false;
+    this.images.delete(id);
+    this.images.set(id, entry);
+    if (entry.written) return true;
+    const now = new Date();
+    fs.utimes(this.file(id, entry.type), now, now, () => {});
+    return true;
+  }
+
+  // Send a stored image with immutable caching headers, honouring
+  // If-None-Match so clients that already have it get a 304.
+  send(req, res, id) {
+    if (!IMAGE_ID.test(id) || !this.has(id)) {
+      return res.status(404).json({ error: "Image not found or expired" });
+    }
+    const entry = this.images.get(id);
+    const etag = `"${id}"`;
+    res.set("ETag", etag);
+    res.set("Cache-Control", "public, max-age=31536000, immutable");
+    if (req.headers["if-none-match"] === etag) return res.status(304).end();
+    if (entry.buffer) return res.type(entry.type).send(entry.buffer);
+    fs.readFile(this.file(id, entry.type), (err, buffer) => {
+      if (err) {
+        // Removed behind the store's back
+        this.images.delete(id);
+        this.bytes -= entry.size;
+        return res.status(404).json({ error: "Image not found or expired" });
+      }
+      res.type(entry.type).send(buffer);
+    });
+  }
+}
+
+module.exports = { ImageStore };
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+import decode
+import registration
+import scan
+
+try:
+    import fitz  # PyMuPDF, only needed for PDF input
+except ImportError:
+    fitz = None
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+# Pages are decoded PAGE_SCALE times the layout's working size so that two
+# sheets side by side still get about the resolution one sheet needs
+PAGE_SCALE = 2
+
+
+def page_count(path):
+    """Number of pages in a PDF, multi-page TIFF or (one-page) image"""
+    lower = path.lower()
+    if lower.endswith(".pdf"):
+        if fitz is None:
+            raise scan.ScanError("PDF input needs PyMuPDF (pip install pymupdf)")
+        with fitz.open(path) as doc:
+            return doc.page_count
+    if lower.endswith(TIFF_EXTENSIONS):
+        return cv2.imcount(path)
+    return 1
+
+
+def _pdf_pages(path, pages, target):
+    with fitz.open(path) as doc:
+        for index in pages:
+            page = doc.load_page(index)
+            zoom = target / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+            img = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.stride)
+            yield index, img[:, : pix.width]
+
+
+def _tiff_pages(path, pages, target):
+    for index in pages:
+        # One page per call, so only the current page is ever in memory
+        ok, mats = cv2.imreadmulti(path, index, 1, flags=cv2.IMREAD_GRAYSCALE)
+        yield index, decode.fit(mats[0], target) if ok and mats else None
+
+
+def iter_pages(path, pages=None, target=None):
+    """
+    Lazily yield (page index, grayscale page) for a PDF, multi-page TIFF or
+    plain image, each page decoded only when it is reached and fitted to
+    target pixels on the long side. pages is an optional iterable of
+    0-based page indexes; a page that can't be decoded yields None.
+    """
+    count = page_count(path)
+    pages = range(count) if pages is None else [p for p in pages if 0 <= p < count]
+    lower = path.lower()
+    if lower.endswith(".pdf"):
+        yield from _pdf_pages(path, pages, target)
+    elif lower.endswith(TIFF_EXTENSIONS):
+        yield from _tiff_pages(path, pages, target)
+    elif 0 in pages:
+        yield 0, decode.read(path, target, gray=True)
+
+
+def grade_page(page, no_questions, ans, sheet_layout):
+    """Grade every sheet found on one page, yielding one result per sheet"""
+    scan.check_quality(page)
+    sheets = registration.locate_sheets(page)
+    if not sheets:
+        raise scan.ScanError("No answer sheet detected. Please ensure the image contains a clear, well-lit answer sheet with visible borders.")
+    for corners in sheets:
+        try:
+            measured = scan.measure_sheet(page, sheet_layout, check=False, registered=(corners, "contour"))
+            yield scan.grade_measurement(measured, no_questions, ans, sheet_layout)
+        except Exception as e:
+            yield scan.error_result(e)
+
+
+def grade_document(path, no_questions, ans, sheet_layout=None, pages=None):
+    """
+    Grade a whole document page by page with constant memory, yielding a
+    result per sheet as soon as it is graded. Every result carries its 1-based
+    "page" and "sheet" number; a page that fails as a whole yields one error
+    result with "sheet" None.
+    """
+    sheet_layout = sheet_layout or scan.get_layout()
+    target = sheet_layout.source_size * PAGE_SCALE
+    for index, page in iter_pages(path, pages, target):
+        try:
+            if page is None:
+                raise scan.ScanError("Could not read page")
+            for number, result in enumerate(grade_page(page, no_questions, ans, sheet_layout), 1):
+                yield {"page": index + 1, "sheet": number, **result}
+        except Exception as e:
+            yield {"page": index + 1, "sheet": None, **scan.error_result(e)}
+
+
+def parse_pages(value):
+    """0-based page indexes from a 1-based spec like "1-3,7" """
+    pages = []
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        pages.extend(range(int(first) - 1, int(last or first)))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade every sheet of a multi-page PDF/TIFF or image")
+    parser.add_argument("source", help="PDF, TIFF or image file")
+    parser.add_argument("answers", help="answer key as a JSON array, or @file.json")
+    parser.add_argument("--questions", type=int, help="number of questions (defaults to the key length)")
+    parser.add_argument("--layout", help="sheet layout name")
+    parser.add_argument("--pages", help="1-based pages to grade, e.g. 1-3,7")
+    args = parser.parse_args()
+
+    if args.answers.startswith("@"):
+        with open(args.answers[1:]) as f:
+            ans = json.load(f)
+    else:
+        ans = json.loads(args.answers)
+    try:
+        sheet_layout = scan.get_layout(args.layout)
+        ans = scan.parse_answers(args.questions or len(ans), ans, sheet_layout)
+        if not os.path.isfile(args.source):
+            raise scan.ScanError(f"No such file: {args.source}")
+        results = grade_document(
+            args.source, len(ans), ans, sheet_layout, parse_pages(args.pages) if args.pages else None
+        )
+        for result in results:
+            print(json.dumps(result), flush=True)
+    except Exception as e:
+        print(json.dumps(scan.error_result(e)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+const { EventEmitter } = require("events");
+const crypto = require("crypto");
+const fs = require("fs");
+const path = require("path");
+
+// Grading jobs persisted in a directory, so queued work survives a restart:
+// <id>.json holds a job's status, header and result, <id>.bin its upload
+// until the job finishes. Results are kept for `retentionMs` after the job
+// ends. Only ids and timestamps are held in memory.
+class JobQueue extends EventEmitter {
+  constructor(run, options = {}) {
+    super();
+    this.setMaxListeners(0); // one listener per open event stream
+    this.run = run;
+    this.options = {
+      dir: "jobs",
+      concurrency: 4,
+      maxPending: 500,
+      retentionMs: 24 * 60 * 60 * 1000,
+    };
+    for (const [key, value] of Object.entries(options)) {
+      if (value !== undefined) this.options[key] = value;
+    }
+
+    fs.mkdirSync(this.options.dir, { recursive: true });
+    // id -> { status, created, updated }
+    this.jobs = new Map();
+    const interrupted = new Set();
+    for (const name of fs.readdirSync(this.options.dir)) {
+      if (!name.endsWith(".json")) continue;
+      const job = this.read(name.slice(0, -5));
+      if (!job) continue;
+      // Jobs that were running when the server stopped start over, ahead
+      // of the jobs that were waiting behind them
+      if (job.status === "running") {
+        job.status = "queued";
+        this.write(job);
+        interrupted.add(job.id);
+      }
+      this.remember(job);
+    }
+    this.pending = [...this.jobs]
+      .filter(([, job]) => job.status === "queued")
+      .sort(
+        ([idA, a], [idB, b]) =>
+          interrupted.has(idB) - interrupted.has(idA) || a.created - b.created
+      )
+      .map(([id]) => id);
+    this.running = 0;
+    // Jobs turned away by a full worker pool, waiting out its Retry-After,
+    // with their timers
+    this.deferred = new Map();
+    // Moving average of job run time, for Retry-After estimates
+    this.avgMs = 1000;
+
+    this.purgeTimer = setInterval(() => this.purge(), 60 * 60 * 1000);
+    this.purgeTimer.unref();
+    this.schedule();
+  }
+
+  file(id, ext) {
+    return path.join(this.options.dir, id + ext);
+  }
+
+  // Write through a temporary file so a crash never leaves half a job
+  save(file, data) {
+    const tmp = `${file}.${process.pid}.tmp`;
+    fs.writeFileSync(tmp, data);
+    fs.renameSync(tmp, file);
+  }
+
+  read(id) {
+    try {
+      return JSON.parse(fs.readFileSync(this.file(id, ".json"), "utf8"));
+    } catch (err) {
+      return null;
+    }
+  }
+
+  write(job) {
+    this.save(this.file(job.id, ".json"), JSON.stringify(job));
+    this.remember(job);
+  }
+
+  remember(job) {
+    const { status, created, updated } = job;
+    this.jobs.set(job.id, { status, created, updated });
+  }
+
+  // Persist a job and queue it. Throws a QUEUE_FULL error carrying
+  // retryAfter (seconds) when the backlog is at its limit.
+  submit(header, body) {
+    if (this.pending.length + this.deferred.size >= this.options.maxPending) {
+      const error = new Error("Job queue is full");
+      error.code = "QUEUE_FULL";
+      error.retryAfter = this.retryAfter();
+      throw error;
+    }
+    const id = crypto.randomUUID();
+    const now = Date.now();
+    this.save(this.file(id, ".bin"), body);
+    this.write({ id, status: "queued", header, created: now, updated: now });
+    this.pending.push(id);
+    this.schedule();
+    return this.get(id);
+  }
+
+  get(id) {
+    if (!this.jobs.has(id)) return null;
+    const job = this.read(id);
+    if (!job) return null;
+    return {
+      id: job.id,
+      status: job.status,
+      position:
+        job.status === "queued"
+          ? this.pending.indexOf(job.id) + 1 || undefined
+          : undefined,
+      result: job.result,
+      created: job.created,
+      updated: job.updated,
+    };
+  }
+
+  // Seconds until the backlog has drained enough to accept another job
+  retryAfter() {
+    const waves = Math.ceil(
+      (this.pending.length + this.deferred.size) / this.options.concurrency
+    );
+    return Math.max(1, Math.ceil((waves * this.avgMs) / 1000));
+  }
+
+  stats() {
+    return {
+      queued: this.pending.length + this.deferred.size,
+      running: this.running,
+      concurrency: this.options.concurrency,
+    };
+  }
+
+  schedule() {
+    while (this.running < this.options.concurrency && this.pending.length) {
+      this.start(this.pending.shift());
+    }
+  }
+
+  start(id) {
+    const job = this.read(id);
+    if (!job) return;
+    let image;
+    try {
+      image = fs.readFileSync(this.file(id, ".bin"));
+    } catch (err) {
+      this.finish(job, "failed", {
+        error: "Processing failed",
+        details: "Upload is missing",
+      });
+      return;
+    }
+    this.running++;
+    const started = Date.now();
+    job.status = "running";
+    job.updated = started;
+    this.write(job);
+    this.emit("update", this.get(id));
+
+    this.run(job.header, image)
+      .then(
+        (result) => this.finish(job, result.error ? "failed" : "done", result),
+        (err) => {
+          if (err.code === "QUEUE_FULL") {
+            return this.defer(job, err.retryAfter);
+          }
+          this.finish(job, "failed", {
+            error: "Processing failed",
+            details: err.details || err.message,
+          });
+        }
+      )
+      .finally(() => {
+        // A deferred job never ran and says nothing about run time
+        if (job.status !== "queued") {
+          this.avgMs = 0.8 * this.avgMs + 0.2 * (Date.now() - started);
+        }
+        this.running--;
+        this.schedule();
+      });
+  }
+
+  // The worker pool was full: the job was never run, so it goes back to the
+  // head of the queue once the pool's Retry-After has passed
+  defer(job, retryAfter) {
+    job.status = "queued";
+    job.updated = Date.now();
+    this.write(job);
+    const timer = setTimeout(() => {
+      this.deferred.delete(job.id);
+      this.pending.unshift(job.id);
+      this.schedule();
+    }, (retryAfter || 1) * 1000);
+    this.deferred.set(job.id, timer);
+    this.emit("update", this.get(job.id));
+  }
+
+  finish(job, status, result) {
+    job.status = status;
+    job.result = result;
+    job.updated = Date.now();
+    this.write(job);
+    fs.rmSync(this.file(job.id, ".bin"), { force: true });
+    this.emit("update", this.get(job.id));
+  }
+
+  purge() {
+    const before = Date.now() - this.options.retentionMs;
+    for (const [id, job] of this.jobs) {
+      const ended = job.status === "done" || job.status === "failed";
+      if (ended && job.updated < before) {
+        fs.rmSync(this.file(id, ".json"), { force: true });
+        this.jobs.delete(id);
+      }
+    }
+  }
+
+  close() {
+    clearInterval(this.purgeTimer);
+    for (const timer of this.deferred.values()) clearTimeout(timer);
+  }
+}
+
+module.exports = { JobQueue };
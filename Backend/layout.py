@@ -0,0 +1,150 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+LAYOUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts")
+DEFAULT_LAYOUT = "standard"
+DEFAULT_CELL_PX = 35
+DEFAULT_SOURCE_SCALE = 1.5
+# JPEG quality clients are asked to upload at; lower settings start to cost
+# accuracy on blurred, noisy photos at source_size
+DEFAULT_CAPTURE_QUALITY = 70
+
+
+class Layout:
+    """
+    A sheet design compiled into index tables.
+
+    The sheet is a grid of rows x cols equal cells. Each block is a column of
+    questions starting at (row, col): question k of the block sits on grid
+    row `row + k` and its choices take `choices` consecutive grid columns
+    from `col`. Questions are numbered through the blocks in order.
+    """
+
+    def __init__(self, spec):
+        self.name = spec["name"]
+        self.grid_rows = int(spec["grid"]["rows"])
+        self.grid_cols = int(spec["grid"]["cols"])
+        self.choices = int(spec["choices"])
+        self.questions = int(spec["questions"])
+        # Pixels per grid cell the bubbles need to be scored reliably
+        self.cell_px = int(spec.get("cell_px", DEFAULT_CELL_PX))
+        # Photos are decoded a bit larger than the warp so the sheet, which
+        # never fills the whole frame, still has cell_px pixels per cell
+        self.source_scale = float(spec.get("source_scale", DEFAULT_SOURCE_SCALE))
+        self.capture_quality = int(spec.get("capture_quality", DEFAULT_CAPTURE_QUALITY))
+        # Optional fiducials: {"dictionary": "DICT_4X4_50", "ids": [tl, tr, bl, br],
+        # "offset": cells between each grid corner and its marker centre,
+        # "size": marker side in cells, needed to recover a missing marker}
+        self.markers = spec.get("markers")
+        if self.markers is not None and len(self.markers.get("ids", [])) != 4:
+            raise ValueError(f"Layout {self.name}: markers need four ids (TL, TR, BL, BR)")
+
+        rows, cols = [], []
+        for block in spec["blocks"]:
+            for k in range(int(block["rows"])):
+                rows.append(int(block["row"]) + k)
+                cols.append(int(block["col"]))
+        if len(rows) < self.questions:
+            raise ValueError(f"Layout {self.name}: blocks hold {len(rows)} questions, need {self.questions}")
+
+        # Grid row and first choice column of every question
+        self.rows = np.array(rows[: self.questions], dtype=np.intp)
+        self.cols = np.array(cols[: self.questions], dtype=np.intp)
+        if self.rows.max() >= self.grid_rows or (self.cols + self.choices).max() > self.grid_cols:
+            raise ValueError(f"Layout {self.name}: blocks fall outside the {self.grid_rows}x{self.grid_cols} grid")
+
+        # (row, col) of every question x choice cell, and its flat index in the grid
+        self.cell_rows = np.repeat(self.rows[:, None], self.choices, axis=1)
+        self.cell_cols = self.cols[:, None] + np.arange(self.choices)
+        self.cell_index = self.cell_rows * self.grid_cols + self.cell_cols
+        for table in (self.rows, self.cols, self.cell_rows, self.cell_cols, self.cell_index):
+            table.setflags(write=False)
+
+        self._centers = {}
+        self._samples = {}
+
+    @property
+    def warp_size(self):
+        """(width, height) the sheet is warped to for scoring"""
+        return self.grid_cols * self.cell_px, self.grid_rows * self.cell_px
+
+    @property
+    def min_size(self):
+        """Long side, in pixels, of the warped sheet"""
+        return max(self.warp_size)
+
+    @property
+    def source_size(self):
+        """Long side, in pixels, a photo is decoded and resized to before registration"""
+        return int(round(self.min_size * self.source_scale))
+
+    def capture_profile(self):
+        """
+        What an upload for this layout needs: photos are fitted to
+        source_size on the long side and graded in grayscale, so anything
+        larger or in colour is only decoded to be thrown away
+        """
+        return {
+            "layout": self.name,
+            "long_side": self.source_size,
+            "grayscale": True,
+            "jpeg_quality": self.capture_quality,
+        }
+
+    def cell_size(self, width, height):
+        """Cell width and height in pixels for a sheet warped to width x height"""
+        return width // self.grid_cols, height // self.grid_rows
+
+    def centers(self, width, height):
+        """
+        Pixel centre of every question x choice cell as an int array of shape
+        (questions, choices, 2), cached per warp size.
+        """
+        key = (width, height)
+        if key not in self._centers:
+            cell_w, cell_h = self.cell_size(width, height)
+            xy = np.empty((self.questions, self.choices, 2), dtype=np.int32)
+            xy[..., 0] = ((self.cell_cols + 0.5) * cell_w).astype(np.int32)
+            xy[..., 1] = ((self.cell_rows + 0.5) * cell_h).astype(np.int32)
+            xy.setflags(write=False)
+            self._centers[key] = xy
+        return self._centers[key]
+
+    def sample_points(self, samples):
+        """
+        Warp-space sample positions for every bubble cell, laid out as a
+        mosaic of shape (questions * samples, choices * samples, 2): the
+        samples x samples block at (q, c) covers cell (q, c) of the warped
+        sheet. Cached per sample count.
+        """
+        if samples not in self._samples:
+            width, height = self.warp_size
+            cell_w, cell_h = self.cell_size(width, height)
+            offsets = (np.arange(samples) + 0.5) / samples
+            ys = (self.rows[:, None] + offsets).ravel() * cell_h
+            xs = (self.cols[:, None] + offsets).ravel() * cell_w
+            # Column c of a question's block starts `c` cells right of its first choice
+            xs = xs.reshape(self.questions, 1, samples) + (np.arange(self.choices) * cell_w)[None, :, None]
+            xs = xs.reshape(self.questions, self.choices * samples)
+            xs = np.repeat(xs, samples, axis=0)
+            ys = np.broadcast_to(ys[:, None], xs.shape)
+            points = np.stack((xs, ys), axis=-1).astype(np.float32)
+            points.setflags(write=False)
+            self._samples[samples] = points
+        return self._samples[samples]
+
+
+@lru_cache(maxsize=None)
+def load_layout(name=None):
+    """Load and compile layouts/<name>.json once per process"""
+    name = name or DEFAULT_LAYOUT
+    if os.path.basename(name) != name:
+        raise ValueError(f"Invalid layout name: {name}")
+    path = os.path.join(LAYOUT_DIR, name + ".json")
+    if not os.path.isfile(path):
+        raise ValueError(f"Unknown layout: {name}")
+    with open(path) as f:
+        return Layout(json.load(f))
@@ -0,0 +1,478 @@
+// End-to-end load test for the grading server. Replays a corpus of sheet
+// photos (a synth.py directory with truth.jsonl, or any directory of images
+// plus --questions/--answers) against /process-image, or /jobs with
+// --async, stepping through concurrency levels (closed loop) or arrival
+// rates (open loop). Every step reports latency percentiles, error and
+// timeout rates, throughput, and CPU / memory of the server and each
+// Python worker read from /proc. The saturation point is the last step
+// before throughput stops growing while latency climbs, or errors appear.
+// A corpus is replayed over and over, so a server started here runs with
+// the workers' measurement cache off (--cache keeps it) to time real work.
+//
+//   node loadtest.js --corpus ../corpus --start --mode pool --workers 4
+//   node loadtest.js --corpus ../corpus --url http://host:3000 --rate 5,10,20
+const { spawn, execSync } = require("child_process");
+const fs = require("fs");
+const path = require("path");
+const { performance } = require("perf_hooks");
+
+const DEFAULTS = {
+  url: "http://127.0.0.1:3000",
+  concurrency: "1,2,4,8,16,32",
+  rate: null,
+  duration: 20,
+  timeout: 60000,
+  render: "none",
+  mode: "pool",
+  port: 3100,
+};
+
+// A step is past saturation when it adds less than this share of throughput
+// while p95 latency grows by more than LATENCY_GROWTH, or when more than
+// ERROR_LIMIT of its requests fail
+const THROUGHPUT_GAIN = 0.1;
+const LATENCY_GROWTH = 0.5;
+const ERROR_LIMIT = 0.01;
+// Stepping stops once a step fails this badly
+const ABORT_ERROR_RATE = 0.5;
+
+function parseArgs(argv) {
+  const args = { ...DEFAULTS };
+  for (let i = 0; i < argv.length; i++) {
+    const name = argv[i].replace(/^--/, "");
+    const flag = ["start", "async", "cache", "help"].includes(name);
+    args[name] = flag ? true : argv[++i];
+  }
+  return args;
+}
+
+function usage() {
+  console.log(`usage: node loadtest.js --corpus DIR [options]
+  --url URL            server to test (default ${DEFAULTS.url})
+  --start              start server.js here instead (on --port, default ${DEFAULTS.port})
+  --mode pool|spawn    GRADER_MODE of the started server
+  --workers N          GRADER_WORKERS of the started server
+  --cache              keep the started server's measurement cache on
+  --pid PID            server process to sample when not started here
+  --concurrency LIST   closed-loop steps, e.g. 1,2,4,8 (default ${DEFAULTS.concurrency})
+  --rate LIST          open-loop arrival rates in requests/s instead
+  --duration S         seconds per step (default ${DEFAULTS.duration})
+  --timeout MS         per-request timeout (default ${DEFAULTS.timeout})
+  --render MODE        render field sent with each upload (default ${DEFAULTS.render})
+  --async              submit to /jobs and poll for the result
+  --questions N --answers JSON   key for a corpus without truth.jsonl
+  --out FILE           write the full report as JSON`);
+}
+
+// Upload fields per image, read into memory up front so disk reads never
+// show up in the latencies
+function loadCorpus(dir, args) {
+  const truth = path.join(dir, "truth.jsonl");
+  let entries;
+  if (fs.existsSync(truth)) {
+    entries = fs
+      .readFileSync(truth, "utf8")
+      .split("\n")
+      .filter(Boolean)
+      .map((line) => {
+        const record = JSON.parse(line);
+        return {
+          file: record.file,
+          layout: record.layout,
+          // Blank questions (-1) still need a key entry
+          answers: record.answers.map((a) => Math.max(a, 0)),
+        };
+      });
+  } else {
+    if (!args.answers) throw new Error("--answers is needed without truth.jsonl");
+    const answers = JSON.parse(args.answers);
+    entries = fs
+      .readdirSync(dir)
+      .filter((file) => /\.(jpe?g|png)$/i.test(file))
+      .map((file) => ({ file, layout: args.layout, answers }));
+  }
+  if (!entries.length) throw new Error(`No images in ${dir}`);
+  return entries.map((entry) => ({
+    ...entry,
+    image: fs.readFileSync(path.join(dir, entry.file)),
+  }));
+}
+
+function uploadForm(entry, render) {
+  const form = new FormData();
+  form.append("image", new Blob([entry.image], { type: "image/jpeg" }), entry.file);
+  form.append("questions", String(entry.answers.length));
+  form.append("answers", JSON.stringify(entry.answers));
+  if (entry.layout) form.append("layout", entry.layout);
+  form.append("render", render);
+  return form;
+}
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// One upload, classified as ok, rejected (graded with an error, e.g. a
+// blurry photo), busy (429), http (other non-2xx), timeout or network
+async function sendOne(base, entry, args) {
+  const started = performance.now();
+  const deadline = AbortSignal.timeout(Number(args.timeout));
+  let outcome;
+  try {
+    let response = await fetch(`${base}${args.async ? "/jobs" : "/process-image"}`, {
+      method: "POST",
+      body: uploadForm(entry, args.render),
+      signal: deadline,
+    });
+    let body = await response.json().catch(() => ({}));
+    if (args.async && response.status === 202) {
+      while (body.status === "queued" || body.status === "running") {
+        await sleep(100);
+        response = await fetch(`${base}/jobs/${body.id}`, { signal: deadline });
+        body = await response.json();
+      }
+      body = body.result || body;
+    }
+    if (response.status === 429) outcome = "busy";
+    else if (!response.ok) outcome = "http";
+    else outcome = body.error ? "rejected" : "ok";
+  } catch (err) {
+    outcome = err.name === "TimeoutError" || err.name === "AbortError" ? "timeout" : "network";
+  }
+  return { outcome, ms: performance.now() - started };
+}
+
+function percentile(sorted, p) {
+  if (!sorted.length) return null;
+  const index = Math.min(sorted.length - 1, Math.ceil((p / 100) * sorted.length) - 1);
+  return Math.round(sorted[Math.max(index, 0)] * 10) / 10;
+}
+
+function summarize(load, samples, seconds, resources) {
+  const counts = { ok: 0, rejected: 0, busy: 0, http: 0, timeout: 0, network: 0 };
+  for (const sample of samples) counts[sample.outcome]++;
+  // Latency of everything the server actually answered
+  const answered = samples
+    .filter((s) => s.outcome === "ok" || s.outcome === "rejected")
+    .map((s) => s.ms)
+    .sort((a, b) => a - b);
+  const failed = counts.busy + counts.http + counts.timeout + counts.network;
+  return {
+    load,
+    requests: samples.length,
+    counts,
+    throughput: Math.round(((counts.ok + counts.rejected) / seconds) * 100) / 100,
+    errorRate: samples.length ? Math.round((failed / samples.length) * 10000) / 10000 : 0,
+    timeoutRate: samples.length ? Math.round((counts.timeout / samples.length) * 10000) / 10000 : 0,
+    latencyMs: {
+      p50: percentile(answered, 50),
+      p95: percentile(answered, 95),
+      p99: percentile(answered, 99),
+      max: percentile(answered, 100),
+    },
+    resources,
+  };
+}
+
+// Closed loop: `concurrency` clients, each sending its next upload as soon
+// as the previous one is answered
+async function closedLoop(base, corpus, args, concurrency, seconds) {
+  const samples = [];
+  const stopAt = performance.now() + seconds * 1000;
+  let next = 0;
+  const client = async () => {
+    while (performance.now() < stopAt) {
+      samples.push(await sendOne(base, corpus[next++ % corpus.length], args));
+    }
+  };
+  await Promise.all(Array.from({ length: concurrency }, client));
+  return samples;
+}
+
+// Open loop: uploads arrive at a fixed rate whether or not earlier ones
+// have been answered, as independent phones would
+async function openLoop(base, corpus, args, rate, seconds) {
+  const total = Math.max(1, Math.round(rate * seconds));
+  const started = performance.now();
+  const pending = [];
+  for (let i = 0; i < total; i++) {
+    const due = started + (i * 1000) / rate;
+    const wait = due - performance.now();
+    if (wait > 0) await sleep(wait);
+    pending.push(sendOne(base, corpus[i % corpus.length], args));
+  }
+  return Promise.all(pending);
+}
+
+// Per-process CPU and memory of a process tree, sampled from /proc
+class ResourceSampler {
+  constructor(pid) {
+    this.pid = pid;
+    this.ticks = clockTicks();
+    this.previous = new Map();
+    this.series = new Map();
+  }
+
+  static available(pid) {
+    return Boolean(pid) && fs.existsSync(`/proc/${pid}/stat`);
+  }
+
+  start(intervalMs = 1000) {
+    this.previous = this.read();
+    this.lastAt = performance.now();
+    this.series = new Map();
+    this.timer = setInterval(() => this.sample(), intervalMs);
+  }
+
+  sample() {
+    const now = performance.now();
+    const current = this.read();
+    const seconds = (now - this.lastAt) / 1000;
+    for (const [pid, proc] of current) {
+      const before = this.previous.get(pid);
+      if (!before) continue;
+      const cpu = ((proc.cpuTicks - before.cpuTicks) / this.ticks / seconds) * 100;
+      const entry = this.series.get(pid) || { name: proc.name, cpu: [], rssMb: [] };
+      entry.cpu.push(cpu);
+      entry.rssMb.push(proc.rssMb);
+      this.series.set(pid, entry);
+    }
+    this.previous = current;
+    this.lastAt = now;
+  }
+
+  stop() {
+    clearInterval(this.timer);
+    this.sample();
+    const processes = [...this.series.entries()].map(([pid, entry]) => ({
+      pid,
+      name: entry.name,
+      role: pid === this.pid ? "server" : "worker",
+      cpuPercent: round(mean(entry.cpu)),
+      cpuPercentMax: round(Math.max(...entry.cpu)),
+      rssMb: round(Math.max(...entry.rssMb)),
+    }));
+    const workers = processes.filter((p) => p.role === "worker");
+    return {
+      server: processes.find((p) => p.role === "server") || null,
+      workers: {
+        // Short-lived spawn-mode workers often live less than one sample
+        seen: workers.length,
+        cpuPercent: round(mean(workers.map((w) => w.cpuPercent))),
+        rssMb: round(mean(workers.map((w) => w.rssMb))),
+        rssMbMax: workers.length ? Math.max(...workers.map((w) => w.rssMb)) : null,
+      },
+      processes,
+    };
+  }
+
+  // pid -> { name, cpuTicks, rssMb } for the server and all its descendants
+  read() {
+    const stats = new Map();
+    for (const entry of fs.readdirSync("/proc")) {
+      if (!/^\d+$/.test(entry)) continue;
+      const stat = readStat(Number(entry));
+      if (stat) stats.set(stat.pid, stat);
+    }
+    const tree = new Map();
+    const include = (pid) => {
+      const stat = stats.get(pid);
+      if (!stat) return;
+      tree.set(pid, stat);
+      for (const child of stats.values()) {
+        if (child.ppid === pid && !tree.has(child.pid)) include(child.pid);
+      }
+    };
+    include(this.pid);
+    return tree;
+  }
+}
+
+function readStat(pid) {
+  try {
+    const text = fs.readFileSync(`/proc/${pid}/stat`, "utf8");
+    // The command name may contain spaces; fields resume after its ")"
+    const close = text.lastIndexOf(")");
+    const fields = text.slice(close + 2).split(" ");
+    return {
+      pid,
+      name: text.slice(text.indexOf("(") + 1, close),
+      ppid: Number(fields[1]),
+      cpuTicks: Number(fields[11]) + Number(fields[12]),
+      rssMb: (Number(fields[21]) * 4096) / (1024 * 1024),
+    };
+  } catch (err) {
+    return null; // exited between listing and reading
+  }
+}
+
+function clockTicks() {
+  try {
+    return Number(execSync("getconf CLK_TCK").toString()) || 100;
+  } catch (err) {
+    return 100;
+  }
+}
+
+const mean = (values) =>
+  values.length ? values.reduce((a, b) => a + b, 0) / values.length : null;
+const round = (value) => (value === null ? null : Math.round(value * 10) / 10);
+
+// The last step before the server stopped scaling, or null if every step
+// still scaled
+function saturation(steps) {
+  for (let i = 0; i < steps.length; i++) {
+    const step = steps[i];
+    const previous = steps[i - 1];
+    let reason = null;
+    if (step.errorRate > ERROR_LIMIT) {
+      reason = `error rate ${(step.errorRate * 100).toFixed(1)}%`;
+    } else if (
+      previous &&
+      step.throughput < previous.throughput * (1 + THROUGHPUT_GAIN) &&
+      step.latencyMs.p95 > previous.latencyMs.p95 * (1 + LATENCY_GROWTH)
+    ) {
+      reason = `throughput flat (${previous.throughput} -> ${step.throughput}/s) while p95 rose ${previous.latencyMs.p95} -> ${step.latencyMs.p95} ms`;
+    }
+    if (reason) {
+      return {
+        load: previous ? previous.load : null,
+        throughput: previous ? previous.throughput : null,
+        saturatedAt: step.load,
+        reason,
+      };
+    }
+  }
+  return null;
+}
+
+async function startServer(args) {
+  const env = {
+    ...process.env,
+    PORT: String(args.port),
+    GRADER_MODE: args.mode,
+    METRICS_PORT: "0",
+  };
+  if (!args.cache) {
+    env.GRADER_CACHE_SIZE = "0";
+    delete env.GRADER_CACHE_DIR;
+  }
+  if (args.workers) env.GRADER_WORKERS = String(args.workers);
+  const server = spawn(process.execPath, [path.join(__dirname, "server.js")], {
+    cwd: __dirname,
+    env,
+    stdio: ["ignore", "ignore", "inherit"],
+  });
+  const base = `http://127.0.0.1:${args.port}`;
+  for (let i = 0; i < 100; i++) {
+    if (server.exitCode !== null) throw new Error("server.js exited during start-up");
+    try {
+      if ((await fetch(`${base}/layouts`)).ok) break;
+    } catch (err) {
+      // not listening yet
+    }
+    await sleep(200);
+  }
+  // Give pooled workers time to import OpenCV before the first step
+  await sleep(2000);
+  return { server, base };
+}
+
+function printStep(step, unit) {
+  const { p50, p95, p99 } = step.latencyMs;
+  const workers = step.resources ? step.resources.workers : null;
+  const server = step.resources ? step.resources.server : null;
+  console.log(
+    [
+      `${String(step.load).padStart(5)} ${unit}`,
+      `${String(step.requests).padStart(6)} req`,
+      `${String(step.throughput).padStart(7)}/s`,
+      `p50 ${p50} p95 ${p95} p99 ${p99} ms`,
+      `errors ${(step.errorRate * 100).toFixed(1)}% (timeouts ${(step.timeoutRate * 100).toFixed(1)}%)`,
+      server ? `server ${server.cpuPercent}% ${server.rssMb} MB` : "",
+      workers && workers.seen
+        ? `workers ${workers.seen} x ${workers.cpuPercent}% ${workers.rssMb} MB`
+        : "",
+    ]
+      .filter(Boolean)
+      .join("  ")
+  );
+}
+
+async function main() {
+  const args = parseArgs(process.argv.slice(2));
+  if (args.help || !args.corpus) return usage();
+  const corpus = loadCorpus(args.corpus, args);
+
+  let base = args.url;
+  let server = null;
+  let pid = Number(args.pid) || null;
+  if (args.start) {
+    ({ server, base } = await startServer(args));
+    pid = server.pid;
+  }
+  const sampler = ResourceSampler.available(pid) ? new ResourceSampler(pid) : null;
+
+  const open = Boolean(args.rate);
+  const levels = String(open ? args.rate : args.concurrency)
+    .split(",")
+    .map(Number);
+  const unit = open ? "req/s" : "clients";
+  const seconds = Number(args.duration);
+  console.log(
+    `${corpus.length} images, ${open ? "open loop" : "closed loop"}, ${seconds}s per step against ${base}${args.async ? " (async jobs)" : ""}`
+  );
+
+  const steps = [];
+  try {
+    for (const level of levels) {
+      if (sampler) sampler.start();
+      const started = performance.now();
+      const samples = open
+        ? await openLoop(base, corpus, args, level, seconds)
+        : await closedLoop(base, corpus, args, level, seconds);
+      const elapsed = (performance.now() - started) / 1000;
+      const step = summarize(level, samples, elapsed, sampler ? sampler.stop() : null);
+      steps.push(step);
+      printStep(step, unit);
+      if (step.errorRate > ABORT_ERROR_RATE) {
+        console.log("Stopping: more than half of the requests failed");
+        break;
+      }
+    }
+  } finally {
+    if (server) server.kill("SIGTERM");
+  }
+
+  const knee = saturation(steps);
+  if (knee) {
+    console.log(
+      knee.load === null
+        ? `Saturated at the first step (${knee.reason})`
+        : `Saturation: ${knee.load} ${unit} at ${knee.throughput} sheets/s; ${knee.saturatedAt} ${unit} degraded (${knee.reason})`
+    );
+  } else {
+    console.log("No saturation within the tested range");
+  }
+
+  if (args.out) {
+    const report = {
+      created: new Date().toISOString(),
+      target: base,
+      mode: args.start ? args.mode : null,
+      workers: args.workers ? Number(args.workers) : null,
+      cache: args.start ? Boolean(args.cache) : null,
+      async: Boolean(args.async),
+      loop: open ? "open" : "closed",
+      secondsPerStep: seconds,
+      images: corpus.length,
+      steps,
+      saturation: knee,
+    };
+    fs.writeFileSync(args.out, JSON.stringify(report, null, 2));
+    console.log(`Report written to ${args.out}`);
+  }
+}
+
+main().catch((err) => {
+  console.error(err.message);
+  process.exit(1);
+});
@@ -0,0 +1,150 @@
+// Minimal Prometheus text-format metrics: histograms with fixed buckets and
+// gauges read at scrape time. Only what the grading server needs, so the
+// hot path stays a few array updates per observation.
+
+// Seconds, from sub-millisecond stages up to the worker timeout
+const DEFAULT_BUCKETS = [
+  0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+];
+
+// Label values escape backslash, double quote and newline; HELP text only
+// backslash and newline
+function escape(text, quotes) {
+  return String(text).replace(quotes ? /["\\\n]/g : /[\\\n]/g, (c) =>
+    c === "\n" ? "\\n" : `\\${c}`
+  );
+}
+
+function formatLabels(names, values) {
+  if (!names.length) return "";
+  const pairs = names.map((name, i) => `${name}="${escape(values[i], true)}"`);
+  return `{${pairs.join(",")}}`;
+}
+
+function header(metric, type) {
+  return [
+    `# HELP ${metric.name} ${escape(metric.help, false)}`,
+    `# TYPE ${metric.name} ${type}`,
+  ];
+}
+
+class Histogram {
+  constructor(name, help, labelNames = [], buckets = DEFAULT_BUCKETS) {
+    this.name = name;
+    this.help = help;
+    this.labelNames = labelNames;
+    this.buckets = buckets;
+    this.series = new Map();
+  }
+
+  // Record one value; labels is an object keyed by labelNames
+  observe(labels, value) {
+    const values = this.labelNames.map((name) => labels[name]);
+    const key = values.join("\u0000");
+    let series = this.series.get(key);
+    if (!series) {
+      series = { values, counts: this.buckets.map(() => 0), sum: 0, count: 0 };
+      this.series.set(key, series);
+    }
+    for (let i = 0; i < this.buckets.length; i++) {
+      if (value <= this.buckets[i]) series.counts[i]++;
+    }
+    series.sum += value;
+    series.count++;
+  }
+
+  render() {
+    const lines = header(this, "histogram");
+    for (const series of this.series.values()) {
+      this.buckets.forEach((bound, i) => {
+        const labels = formatLabels(
+          [...this.labelNames, "le"],
+          [...series.values, bound]
+        );
+        lines.push(`${this.name}_bucket${labels} ${series.counts[i]}`);
+      });
+      const labels = formatLabels(this.labelNames, series.values);
+      const inf = formatLabels([...this.labelNames, "le"], [...series.values, "+Inf"]);
+      lines.push(`${this.name}_bucket${inf} ${series.count}`);
+      lines.push(`${this.name}_sum${labels} ${series.sum}`);
+      lines.push(`${this.name}_count${labels} ${series.count}`);
+    }
+    return lines.join("\n");
+  }
+}
+
+class Counter {
+  constructor(name, help, labelNames = []) {
+    this.name = name;
+    this.help = help;
+    this.labelNames = labelNames;
+    this.series = new Map();
+  }
+
+  inc(labels = {}, amount = 1) {
+    const values = this.labelNames.map((name) => labels[name]);
+    const key = values.join("\u0000");
+    const series = this.series.get(key) || { values, value: 0 };
+    series.value += amount;
+    this.series.set(key, series);
+  }
+
+  render() {
+    const lines = header(this, "counter");
+    for (const series of this.series.values()) {
+      lines.push(`${this.name}${formatLabels(this.labelNames, series.values)} ${series.value}`);
+    }
+    return lines.join("\n");
+  }
+}
+
+// A gauge whose value is read from collect() when the metrics are scraped.
+// With type "counter" it exposes a count kept elsewhere (e.g. by a worker).
+class Gauge {
+  constructor(name, help, collect, type = "gauge") {
+    this.name = name;
+    this.help = help;
+    this.collect = collect;
+    this.type = type;
+  }
+
+  render() {
+    return [
+      ...header(this, this.type),
+      `${this.name} ${Number(this.collect()) || 0}`,
+    ].join("\n");
+  }
+}
+
+class Registry {
+  constructor() {
+    this.metrics = [];
+  }
+
+  histogram(name, help, labelNames, buckets) {
+    return this.add(new Histogram(name, help, labelNames, buckets));
+  }
+
+  counter(name, help, labelNames) {
+    return this.add(new Counter(name, help, labelNames));
+  }
+
+  gauge(name, help, collect) {
+    return this.add(new Gauge(name, help, collect));
+  }
+
+  collectedCounter(name, help, collect) {
+    return this.add(new Gauge(name, help, collect, "counter"));
+  }
+
+  add(metric) {
+    this.metrics.push(metric);
+    return metric;
+  }
+
+  render() {
+    return this.metrics.map((metric) => metric.render()).join("\n") + "\n";
+  }
+}
+
+module.exports = { Registry, Histogram, Counter, Gauge, DEFAULT_BUCKETS };
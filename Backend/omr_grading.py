@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 import sys
 
+import scoring
+import decode
+
 # Load the image path from the command line
 image_path = sys.argv[1]
 
@@ -15,11 +18,11 @@ choices = 5
 correct_answers = [0, 1, 2, 2, 0, 0, 1, 2, 3, 3, 0, 1, 0, 2, 2, 2, 0, 1, 2, 2]
 
 # Load image
-img = cv2.imread(image_path)
-img = cv2.resize(img, (widthImg, heightImg))
+# Only grayscale is used, so decode straight to gray at reduced resolution
+img = decode.read(image_path, widthImg, gray=True)
 
 # Preprocessing
-imgGray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+imgGray = img
 imgBlur = cv2.GaussianBlur(imgGray, (5, 5), 1)
 imgCanny = cv2.Canny(imgBlur, 10, 70)
 
@@ -50,19 +53,12 @@ if biggestContour.size != 0:
     imgWarpGray = cv2.warpPerspective(imgGray, matrix, (widthImg, heightImg))
     imgThresh = cv2.threshold(imgWarpGray, 150, 255, cv2.THRESH_BINARY_INV)[1]
 
-    # Split into boxes (assuming 20 rows × 5 columns per section)
-    rows = np.vsplit(imgThresh, 20)
-    boxes = [np.hsplit(row, choices) for row in rows]
-    
-    # Detect marked answers
-    user_answers = []
-    for row in boxes:
-        max_intensity = [np.sum(cell) for cell in row]
-        selected_option = np.argmax(max_intensity)
-        user_answers.append(selected_option)
+    # Fill ratio of every cell (assuming 20 rows × 5 columns per section)
+    fill = scoring.cell_fill(imgThresh, 20, choices)
+    user_answers = scoring.pick_answers(fill)
 
     # Grade the answers
-    score = sum([1 if user_answers[i] == correct_answers[i] else 0 for i in range(len(correct_answers))])
+    score = int(scoring.grade_answers(user_answers[:len(correct_answers)], correct_answers).sum())
     percentage = (score / len(correct_answers)) * 100
 
     # Output result
@@ -1,7 +1,13 @@
 import cv2
 import sys
+from functools import lru_cache
+
 import numpy as np
 
+import scoring
+import registration
+from layout import Layout
+
 def get_sorted_corners(pts):
     """Sorts the corners in the order: [Top-Left, Top-Right, Bottom-Right, Bottom-Left]"""
     rect = np.zeros((4, 2), dtype="float32")
@@ -32,37 +38,30 @@ def warp_perspective(image, rect, target_size=(400, 400)):
 
     return warped
 
+@lru_cache(maxsize=None)
+def question_grid(num_questions, options_per_question):
+    """One question per grid row, one option per column; compiled once per shape"""
+    return Layout({
+        "name": "process",
+        "grid": {"rows": num_questions, "cols": options_per_question},
+        "choices": options_per_question,
+        "questions": num_questions,
+        "blocks": [{"row": 0, "col": 0, "rows": num_questions}],
+    })
+
 def detect_answers(image, num_questions=10, options_per_question=5):
     """Detects filled answer bubbles and returns detected choices."""
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
 
-    h, w = thresh.shape
-    cell_h = h // num_questions
-    cell_w = w // options_per_question
-
-    detected_answers = []
     option_map = ['A', 'B', 'C', 'D', 'E']
+    grid = question_grid(num_questions, options_per_question)
 
-    for q in range(num_questions):
-        row_scores = []
-
-        for o in range(options_per_question):
-            y1 = q * cell_h
-            y2 = (q + 1) * cell_h
-            x1 = o * cell_w
-            x2 = (o + 1) * cell_w
-
-            cell = thresh[y1:y2, x1:x2]
+    # Global Otsu pass for every question; the 11px adaptive threshold only
+    # re-reads the rows whose top-two margin is ambiguous
+    fill, _ = scoring.tiered_warp_fill(gray, grid, block_size=11, c=2)
+    selected = scoring.pick_answers(fill)
 
-            # Count black pixels (shaded areas)
-            filled_ratio = np.count_nonzero(cell) / (cell_h * cell_w)
-            row_scores.append(filled_ratio)
-
-        selected_option = np.argmax(row_scores)
-        detected_answers.append(option_map[selected_option])
-
-    return detected_answers
+    return [option_map[i] for i in selected]
 
 def grade_exam(detected_answers, answer_key):
     """Compares detected answers with the answer key and calculates the score."""
@@ -76,24 +75,9 @@ image_path = sys.argv[1]
 image = cv2.imread(image_path)
 gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-# Preprocessing: Blur + Edge Detection
-blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-edges = cv2.Canny(blurred, 50, 150)
-
-# Find contours
-contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-# Initialize largest rectangle variables
-largest_area = 0
-largest_rect = None
-
-for contour in contours:
-    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
-    if len(approx) == 4:  # Ensure it's a quadrilateral
-        area = cv2.contourArea(approx)
-        if area > largest_area:  # Keep track of the largest rectangle
-            largest_area = area
-            largest_rect = approx.reshape(4, 2)
+# Coarse-to-fine sheet detection: largest quad on a small pyramid level,
+# corners refined to sub-pixel accuracy on the full-resolution image
+largest_rect = registration.locate_sheet(gray)
 
 # If no rectangle is found, exit
 if largest_rect is None:
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+from buffers import scratch
+
+# Long side of the thumbnail the checks run on; a few hundred pixels are
+# enough to spot blur, bad exposure and glare and cost well under a millisecond
+QUALITY_SIZE = 256
+
+# Laplacian variance divided by the squared contrast, so the same sheet scores
+# the same whether it was shot in bright or dim light
+MIN_SHARPNESS = 0.0005
+
+# Grey-level limits on the thumbnail's 5th / 95th percentiles
+MIN_BRIGHT = 60      # 95th percentile below this: the paper itself is dark
+MAX_DARK = 200       # 5th percentile above this: even the ink is washed out
+MIN_CONTRAST = 40    # 95th - 5th percentile
+
+# Pixels this far above the paper level (the 75th percentile: the sheet
+# covers most of a usable photo) and at least GLARE_LEVEL are glare
+GLARE_LEVEL = 250
+GLARE_OFFSET = 25
+MAX_GLARE = 0.05
+
+# Machine-readable rejection reasons and the message shown to the user
+REASONS = {
+    "blurry": "The photo is too blurry. Please hold the camera steady and make sure the sheet is in focus.",
+    "too_dark": "The photo is too dark. Please retake it in better light.",
+    "too_bright": "The photo is overexposed. Please retake it without direct light on the sheet.",
+    "low_contrast": "The photo has too little contrast. Please retake it in even, brighter light.",
+    "glare": "There is glare on the sheet. Please tilt the sheet or camera away from the light and retake.",
+}
+
+
+def thumbnail(gray, size=QUALITY_SIZE, reuse=False):
+    """
+    Grayscale thumbnail about size pixels on the long side. The image is
+    shrunk by a whole factor, which takes OpenCV's fast block-average path.
+    With reuse set it goes into a scratch buffer valid until the next call.
+    """
+    factor = max(gray.shape[:2]) // size
+    if factor <= 1:
+        return gray
+    height, width = gray.shape[:2]
+    out = scratch.get("thumbnail", (round(height / factor), round(width / factor))) if reuse else None
+    return cv2.resize(gray, None, dst=out, fx=1.0 / factor, fy=1.0 / factor, interpolation=cv2.INTER_AREA)
+
+
+def measure(gray):
+    """Sharpness, exposure and glare metrics of a grayscale image, from its thumbnail"""
+    small = thumbnail(gray, reuse=True)
+    hist = cv2.calcHist([small], [0], None, [256], [0, 256]).ravel() / float(small.size)
+    cdf = np.cumsum(hist)
+    dark, paper, bright = (int(np.searchsorted(cdf, p)) for p in (0.05, 0.75, 0.95))
+    contrast = bright - dark
+    laplacian = cv2.Laplacian(small, cv2.CV_32F, dst=scratch.get("laplacian", small.shape, np.float32))
+    sharpness = float(cv2.meanStdDev(laplacian)[1][0, 0]) ** 2 / float(max(contrast, 1) ** 2)
+    glare = hist[max(GLARE_LEVEL, paper + GLARE_OFFSET):].sum()
+    return {
+        "sharpness": round(float(sharpness), 5),
+        "dark": dark,
+        "bright": bright,
+        "contrast": contrast,
+        "glare": round(float(glare), 4),
+    }
+
+
+def reject_reason(metrics):
+    """First failed check as a key of REASONS, or None when the photo is usable"""
+    if metrics["bright"] < MIN_BRIGHT:
+        return "too_dark"
+    if metrics["dark"] > MAX_DARK:
+        return "too_bright"
+    if metrics["contrast"] < MIN_CONTRAST:
+        return "low_contrast"
+    if metrics["glare"] > MAX_GLARE:
+        return "glare"
+    if metrics["sharpness"] < MIN_SHARPNESS:
+        return "blurry"
+    return None
+
+
+def check(gray):
+    """(reason, metrics) for a grayscale photo; reason is None when it passes"""
+    metrics = measure(gray)
+    return reject_reason(metrics), metrics
@@ -0,0 +1,288 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from buffers import scratch
+from tracing import NO_TRACE
+
+# Long side of the pyramid level the sheet outline is searched on. Contour
+# search is the most expensive registration step and the outer border is
+# still a clean quad at this size.
+DETECT_SIZE = 350
+
+# Half-size of the cornerSubPix search window at full resolution
+REFINE_WINDOW = 7
+
+# Pyramid level fiducials are searched on; printed markers stay decodable at
+# this size and detection cost grows with pixel count
+MARKER_DETECT_SIZE = 700
+
+# Half-size of the cornerSubPix window for marker corners, well inside one
+# module of a marker at the working size
+MARKER_REFINE_WINDOW = 3
+
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+
+# Closes gaps in the edge map before the contour search
+EDGE_KERNEL = np.ones((3, 3), np.uint8)
+
+
+# Find rectangle contours
+def rectContour(contours, min_area=50):
+    rectCon = []
+    for i in contours:
+        area = cv2.contourArea(i)
+        if area > min_area:
+            peri = cv2.arcLength(i, True)
+            approx = cv2.approxPolyDP(i, 0.02 * peri, True)
+            if len(approx) == 4:
+                rectCon.append(i)
+    return sorted(rectCon, key=cv2.contourArea, reverse=True)
+
+# Get corner points
+def getCornerPoints(cont):
+    peri = cv2.arcLength(cont, True)
+    return cv2.approxPolyDP(cont, 0.02 * peri, True)
+
+# Reorder points to top-left, top-right, bottom-left, bottom-right
+def reorder(myPoints):
+    myPoints = myPoints.reshape((4, 2))
+    myPointsNew = np.zeros((4, 1, 2), myPoints.dtype)
+    add = myPoints.sum(1)
+    myPointsNew[0] = myPoints[np.argmin(add)]
+    myPointsNew[3] = myPoints[np.argmax(add)]
+    diff = np.diff(myPoints, axis=1)
+    myPointsNew[1] = myPoints[np.argmin(diff)]
+    myPointsNew[2] = myPoints[np.argmax(diff)]
+    return myPointsNew
+
+
+def downscale(gray, size=DETECT_SIZE, reuse=False):
+    """
+    Pyramid level with a long side of at most size, and its scale factor.
+    With reuse set the level is drawn into a scratch buffer, valid only until
+    the next reusing call.
+    """
+    scale = min(1.0, size / float(max(gray.shape[:2])))
+    if scale == 1.0:
+        return gray, 1.0
+    height, width = gray.shape[:2]
+    out = scratch.get("downscale", (round(height * scale), round(width * scale))) if reuse else None
+    small = cv2.resize(gray, None, dst=out, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return small, scale
+
+
+def find_quads(gray, min_area=50, trace=NO_TRACE):
+    """All 4-point contours of a grayscale image, largest first"""
+    imgBlur = cv2.GaussianBlur(gray, (5, 5), 1, dst=scratch.get("blur", gray.shape))
+    imgCanny = cv2.Canny(imgBlur, 10, 70, edges=scratch.get("canny", gray.shape))
+    # Thin border edges break up when downscaled; close the gaps so the
+    # sheet outline stays a single contour at the coarse level
+    imgCanny = cv2.dilate(imgCanny, EDGE_KERNEL, dst=scratch.get("edges", gray.shape))
+    trace.add("edges", imgCanny)
+    contours, _ = cv2.findContours(imgCanny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return rectContour(contours, min_area)
+
+
+def detect_corners(gray, size=DETECT_SIZE, trace=NO_TRACE):
+    """
+    Coarse pass: find the sheet quad on a small pyramid level and return its
+    corners (TL, TR, BL, BR) as a (4, 2) float32 array in gray's coordinates,
+    or None when no quad is found.
+    """
+    small, scale = downscale(gray, size, reuse=True)
+    trace.add("detect", small)
+    rectCon = find_quads(small, trace=trace)
+    if not rectCon:
+        return None
+    corners = getCornerPoints(rectCon[0])
+    if corners.size != 8:
+        return None
+    corners = reorder(corners).reshape(4, 2).astype(np.float32)
+    return corners / scale
+
+
+def refine_corners(gray, corners, window=REFINE_WINDOW):
+    """
+    Fine pass: move each coarse corner to the sub-pixel corner position in
+    the full-resolution image. Corners that wander further than the window
+    (e.g. snapping onto a nearby bubble) keep their coarse position.
+    """
+    refined = cv2.cornerSubPix(
+        gray, corners.reshape(-1, 1, 2).copy(), (window, window), (-1, -1), SUBPIX_CRITERIA
+    ).reshape(4, 2)
+    moved = np.abs(refined - corners).max(axis=1) > window
+    refined[moved] = corners[moved]
+    return refined
+
+
+def sheet_matrix(corners, size):
+    """Homography from the TL, TR, BL, BR corners to a size=(width, height) sheet"""
+    width, height = size
+    pts2 = np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+    return cv2.getPerspectiveTransform(np.float32(corners), pts2)
+
+
+def warp_sheet(gray, corners, size, reuse=False):
+    """
+    Warp only the grayscale sheet area to size=(width, height); with reuse
+    set, into a scratch buffer valid until the next reusing call
+    """
+    out = scratch.get("warp", (size[1], size[0])) if reuse else None
+    return cv2.warpPerspective(gray, sheet_matrix(corners, size), size, dst=out)
+
+
+def locate_sheet(gray, size=DETECT_SIZE, trace=NO_TRACE):
+    """Coarse-to-fine sheet corners (TL, TR, BL, BR) in gray's coordinates, or None"""
+    corners = detect_corners(gray, size, trace)
+    if corners is None:
+        return None
+    return refine_corners(gray, corners)
+
+
+def locate_sheets(gray, min_fraction=0.05, size=DETECT_SIZE):
+    """
+    Corners of every sheet-sized quad in gray (e.g. two sheets photographed
+    side by side, or several on a flatbed scan), in reading order. Quads
+    smaller than min_fraction of the image, or lying inside a sheet already
+    found, are skipped.
+    """
+    small, scale = downscale(gray, size, reuse=True)
+    min_area = min_fraction * small.shape[0] * small.shape[1]
+    found = []
+    for cont in find_quads(small, min_area):
+        corners = getCornerPoints(cont)
+        if corners.size != 8:
+            continue
+        center = tuple(float(v) for v in corners.reshape(4, 2).mean(axis=0))
+        if any(cv2.pointPolygonTest(other, center, False) >= 0 for other in found):
+            continue
+        found.append(corners)
+    if not found:
+        return []
+
+    sheets = [reorder(c).reshape(4, 2).astype(np.float32) / scale for c in found]
+    # Reading order: rows of sheets top to bottom, left to right within a row
+    band = np.median([np.ptp(s[:, 1]) for s in sheets]) / 2
+    sheets.sort(key=lambda s: (int(s[:, 1].mean() // band), s[:, 0].mean()))
+    return [refine_corners(gray, s) for s in sheets]
+
+
+@lru_cache(maxsize=None)
+def marker_detector(dictionary):
+    """ArUco detector for a predefined dictionary name, built once per process"""
+    aruco = cv2.aruco
+    params = aruco.DetectorParameters()
+    # Two adaptive-threshold passes (7 and 23 px) instead of the default three
+    params.adaptiveThreshWinSizeMin = 7
+    params.adaptiveThreshWinSizeMax = 23
+    params.adaptiveThreshWinSizeStep = 16
+    params.cornerRefinementMethod = aruco.CORNER_REFINE_SUBPIX
+    return aruco.ArucoDetector(aruco.getPredefinedDictionary(getattr(aruco, dictionary)), params)
+
+
+def marker_geometry(sheet_layout):
+    """
+    Where the layout's markers are printed, in warp coordinates: their
+    centres (TL, TR, BL, BR) and, when the layout gives the marker side
+    (markers["size"], in cells), the four corners of each marker in ArUco
+    order (clockwise from the marker's top-left), else None. Markers sit
+    markers["offset"] cells diagonally outside the grid corners.
+    """
+    width, height = sheet_layout.warp_size
+    cell_w, cell_h = sheet_layout.cell_size(width, height)
+    offset = float(sheet_layout.markers.get("offset", 0))
+    directions = np.float32([[-1, -1], [1, -1], [-1, 1], [1, 1]])
+    grid = np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+    centers = grid + directions * np.float32([offset * cell_w, offset * cell_h])
+    if "size" not in sheet_layout.markers:
+        return centers, None
+    half = float(sheet_layout.markers["size"]) / 2 * np.float32([cell_w, cell_h])
+    square = np.float32([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * half
+    return centers, centers[:, None, :] + square[None, :, :]
+
+
+def detect_markers(gray, sheet_layout, size=MARKER_DETECT_SIZE, trace=NO_TRACE):
+    """
+    Centres of the four printed fiducials of a layout in TL, TR, BL, BR
+    order, or None.
+
+    The layout's marker spec gives an ArUco dictionary name and the ids
+    printed at the sheet's TL, TR, BL and BR corners. Markers are matched by
+    id rather than by position, so a rotated or upside-down sheet still maps
+    onto the right grid cells. A single missing marker is recovered from the
+    homography fitted to the 12 corners of the other three, which needs the
+    marker size in the layout; without it the sheet is not registered.
+    """
+    if not hasattr(cv2, "aruco"):
+        return None
+    markers = sheet_layout.markers
+    small, scale = downscale(gray, size, reuse=True)
+    trace.add("markers", small)
+    found, ids, _ = marker_detector(markers["dictionary"]).detectMarkers(small)
+    if ids is None:
+        return None
+    trace.note(marker_ids=ids.ravel().tolist())
+
+    quads = {}
+    for quad, marker_id in zip(found, ids.ravel()):
+        # Corners found on the pyramid level are off by a pixel or two at
+        # full size, which the extrapolation to a missing marker magnifies
+        quads[int(marker_id)] = refine_corners(gray, quad.reshape(4, 2) / scale, MARKER_REFINE_WINDOW)
+    present = [int(marker_id) in quads for marker_id in markers["ids"]]
+    if all(present):
+        return np.float32([quads[marker_id].mean(axis=0) for marker_id in markers["ids"]])
+
+    # Three centres only fix an affine map, which is wrong under perspective:
+    # the missing centre is projected through the homography of the 12
+    # marker corners that were found instead
+    sheet_centers, sheet_corners = marker_geometry(sheet_layout)
+    if sum(present) < 3 or sheet_corners is None:
+        return None
+    src = np.concatenate([sheet_corners[i] for i in range(4) if present[i]])
+    dst = np.concatenate([quads[marker_id] for marker_id in markers["ids"] if marker_id in quads])
+    matrix, _ = cv2.findHomography(src, dst)
+    if matrix is None:
+        return None
+    centers = cv2.perspectiveTransform(sheet_centers.reshape(-1, 1, 2), matrix).reshape(4, 2)
+    for i, marker_id in enumerate(markers["ids"]):
+        if present[i]:
+            centers[i] = quads[marker_id].mean(axis=0)
+    return np.float32(centers)
+
+
+def markers_to_corners(centers, sheet_layout):
+    """
+    Sheet corners (TL, TR, BL, BR) from marker centres: the warp rectangle
+    mapped back through the homography of the markers' printed positions.
+    """
+    width, height = sheet_layout.warp_size
+    grid = np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+    matrix = cv2.getPerspectiveTransform(marker_geometry(sheet_layout)[0], np.float32(centers))
+    return cv2.perspectiveTransform(grid.reshape(-1, 1, 2), matrix).reshape(4, 2)
+
+
+def sheet_orientation(corners):
+    """
+    Clockwise rotation of the sheet in the image in degrees (0, 90, 180 or
+    270), from the direction of its top edge (TL -> TR).
+    """
+    dx, dy = corners[1] - corners[0]
+    angle = np.degrees(np.arctan2(dy, dx)) % 360
+    return int(round(angle / 90.0)) % 4 * 90
+
+
+def register(gray, sheet_layout, size=DETECT_SIZE, trace=NO_TRACE):
+    """
+    Sheet corners (TL, TR, BL, BR) and the method that found them. Layouts
+    with printed markers are located from those first; the contour search
+    is only the fallback when markers are missing. Returns (None, None) when
+    neither finds the sheet. trace gets the pyramid levels searched.
+    """
+    if sheet_layout.markers:
+        centers = detect_markers(gray, sheet_layout, trace=trace)
+        if centers is not None:
+            return markers_to_corners(centers, sheet_layout), "markers"
+    corners = locate_sheet(gray, size, trace)
+    return (corners, "contour") if corners is not None else (None, None)
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import zipfile
+
+import cv2
+import numpy as np
+
+import layout
+import registration
+import scan
+
+# Calibrated rigs (fixed document cameras, flatbeds): <id>.npz with where the
+# sheet lands and what its corners look like, read by every worker
+RIG_DIR = os.environ.get("GRADER_RIG_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "rigs")
+RIG_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Half-size of the reference patch kept around each anchor, and how far (in
+# working-image pixels) a sheet may sit from the calibrated spot and still be
+# verified
+PATCH = 12
+SLACK = 6
+
+# Normalised correlation every anchor must reach against its reference patch
+MIN_MATCH = 0.8
+
+# Reference patches flatter than this (grey-level std) cannot verify anything
+MIN_CONTRAST = 8.0
+
+
+class Rig:
+    """
+    Where the sheet sits on a fixed rig: the sheet corners found once by full
+    registration, and small reference patches around the points registration
+    anchored on (the sheet corners, or the printed markers). A later sheet is
+    only verified by matching those patches near their calibrated spots.
+    """
+
+    def __init__(self, rig_id, sheet_layout, method, size, anchors, patches, version=None):
+        self.id = rig_id
+        # mtime of the calibration file; measurements cached for a rig are
+        # keyed by it, so a recalibration invalidates them
+        self.version = version
+        self.layout = sheet_layout
+        self.method = method
+        self.size = tuple(size)
+        self.anchors = np.float32(anchors)
+        self.patches = patches
+        self.corners = self.corners_from(self.anchors)
+
+    def corners_from(self, anchors):
+        if self.method == "markers":
+            return registration.markers_to_corners(anchors, self.layout)
+        return anchors
+
+    def locate(self, gray):
+        """
+        (corners, "calibrated") when every anchor patch is found within SLACK
+        of its calibrated spot, otherwise None and the caller registers the
+        sheet as usual. A sheet that moved a few pixels gets shifted corners.
+        """
+        if gray.shape[:2] != self.size:
+            return None
+        shifts = np.zeros_like(self.anchors)
+        for i, (patch, (x, y)) in enumerate(zip(self.patches, np.round(self.anchors).astype(int))):
+            window = gray[y - PATCH - SLACK:y + PATCH + SLACK + 1, x - PATCH - SLACK:x + PATCH + SLACK + 1]
+            match = cv2.matchTemplate(window, patch, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(match)
+            if score < MIN_MATCH:
+                return None
+            shifts[i] = (dx - SLACK, dy - SLACK)
+        if not shifts.any():
+            return self.corners, "calibrated"
+        return self.corners_from(self.anchors + shifts), "calibrated"
+
+
+def calibrate(rig_id, gray, sheet_layout):
+    """
+    Register a reference sheet photographed on the rig (grayscale, at the
+    layout's working size) with the full search and store the rig
+    """
+    if not isinstance(rig_id, str) or not RIG_ID.match(rig_id):
+        raise scan.ScanError(f"Invalid rig id: {rig_id}")
+    anchors, method = None, None
+    if sheet_layout.markers:
+        anchors, method = registration.detect_markers(gray, sheet_layout), "markers"
+    if anchors is None:
+        anchors, method = registration.locate_sheet(gray), "contour"
+    if anchors is None:
+        raise scan.ScanError("No answer sheet detected on the calibration image.")
+
+    height, width = gray.shape[:2]
+    patches = []
+    for x, y in np.round(anchors).astype(int):
+        if not (PATCH + SLACK <= x < width - PATCH - SLACK and PATCH + SLACK <= y < height - PATCH - SLACK):
+            raise scan.ScanError("The sheet is too close to the image edge to calibrate the rig.")
+        patch = gray[y - PATCH:y + PATCH + 1, x - PATCH:x + PATCH + 1].copy()
+        if patch.std() < MIN_CONTRAST:
+            raise scan.ScanError("The sheet corners are too faint to calibrate the rig.")
+        patches.append(patch)
+
+    rig = Rig(rig_id, sheet_layout, method, gray.shape[:2], anchors, np.stack(patches))
+    _save(rig)
+    return rig
+
+
+def _path(rig_id):
+    return os.path.join(RIG_DIR, rig_id + ".npz")
+
+
+def _save(rig):
+    os.makedirs(RIG_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=RIG_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                layout=np.str_(rig.layout.name),
+                method=np.str_(rig.method),
+                size=np.int32(rig.size),
+                anchors=rig.anchors,
+                patches=rig.patches,
+            )
+        os.replace(tmp, _path(rig.id))
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# Loaded rigs by id, with the mtime of the file they were loaded from
+_loaded = {}
+
+
+def load_rig(rig_id):
+    """Calibrated rig for an id, reloaded only when it was recalibrated"""
+    if not isinstance(rig_id, str) or not RIG_ID.match(rig_id):
+        raise scan.ScanError(f"Invalid rig id: {rig_id}")
+    path = _path(rig_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise scan.ScanError(f"Unknown rig: {rig_id}")
+
+    cached = _loaded.get(rig_id)
+    if cached is None or cached[0] != mtime:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                rig = Rig(
+                    rig_id,
+                    layout.load_layout(str(data["layout"])),
+                    str(data["method"]),
+                    data["size"].tolist(),
+                    data["anchors"],
+                    data["patches"],
+                    mtime,
+                )
+        except (KeyError, ValueError, zipfile.BadZipFile):
+            raise scan.ScanError(f"Rig {rig_id} is damaged; calibrate it again")
+        cached = _loaded[rig_id] = (mtime, rig)
+    return cached[1]
+
+
+def describe(rig):
+    return {
+        "rig": rig.id,
+        "layout": rig.layout.name,
+        "method": rig.method,
+        "size": [rig.size[1], rig.size[0]],
+        "corners": np.round(rig.corners.astype(float), 2).tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate a fixed scanning rig, or check a photo against one")
+    parser.add_argument("command", choices=("calibrate", "check"))
+    parser.add_argument("rig", help="rig id")
+    parser.add_argument("image", help="sheet photographed on the rig")
+    parser.add_argument("--layout", help="sheet layout name (calibrate only)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "calibrate":
+            sheet_layout = scan.get_layout(args.layout)
+            gray = scan.read_image(args.image, sheet_layout, gray=True)
+            print(json.dumps(describe(calibrate(args.rig, gray, sheet_layout))))
+            return
+        rig = load_rig(args.rig)
+        gray = scan.read_image(args.image, rig.layout, gray=True)
+        located = rig.locate(gray)
+        print(json.dumps({**describe(rig), "verified": located is not None}))
+    except Exception as e:
+        print(json.dumps(scan.error_result(e)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
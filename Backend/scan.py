@@ -1,38 +1,360 @@
 import cv2
 import numpy as np
+import os
 import sys
 import json
 import base64
+import time
+
+import scoring
+import layout
+import decode
+import registration
+import quality
+from buffers import scratch
+from tracing import NO_TRACE
+
+# Long side of each half of the annotated result image
+PREVIEW_SIZE = 350
+
+def encode_jpeg(img):
+    """Encode an OpenCV image as raw JPEG bytes"""
+    _, buffer = cv2.imencode('.jpg', img)
+    return buffer.tobytes()
 
 def image_to_base64(img):
     """Convert OpenCV image to base64 string"""
-    _, buffer = cv2.imencode('.jpg', img)
-    return base64.b64encode(buffer).decode('utf-8')
+    return base64.b64encode(encode_jpeg(img)).decode('utf-8')
 
-def draw_corner_markers(img, corners, color=(0, 255, 255), size=20):
-    """Draw corner markers at the specified points"""
+def draw_corner_markers(img, corners, color=(0, 255, 255), size=20, scale=1.0):
+    """Draw corner markers at the specified points; scale shrinks them with the image"""
+    px = lambda v: max(1, int(round(v * scale)))
+    size, pad, line, font = px(size), px(5), px(3), 0.7 * scale
     for i, corner in enumerate(corners):
         x, y = int(corner[0][0]), int(corner[0][1])
         
         # Draw different shapes for each corner for identification
         if i == 0:  # Top-left - Circle
             cv2.circle(img, (x, y), size, color, -1)
-            cv2.circle(img, (x, y), size + 5, (255, 255, 255), 3)
-            cv2.putText(img, "TL", (x - 15, y - 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+            cv2.circle(img, (x, y), size + pad, (255, 255, 255), line)
+            cv2.putText(img, "TL", (x - px(15), y - px(25)), cv2.FONT_HERSHEY_SIMPLEX, font, color, px(2))
         elif i == 1:  # Top-right - Square
             cv2.rectangle(img, (x - size, y - size), (x + size, y + size), color, -1)
-            cv2.rectangle(img, (x - size - 5, y - size - 5), (x + size + 5, y + size + 5), (255, 255, 255), 3)
-            cv2.putText(img, "TR", (x - 15, y - 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+            cv2.rectangle(img, (x - size - pad, y - size - pad), (x + size + pad, y + size + pad), (255, 255, 255), line)
+            cv2.putText(img, "TR", (x - px(15), y - px(25)), cv2.FONT_HERSHEY_SIMPLEX, font, color, px(2))
         elif i == 2:  # Bottom-left - Triangle
             pts = np.array([[x, y - size], [x - size, y + size], [x + size, y + size]], np.int32)
             cv2.fillPoly(img, [pts], color)
-            cv2.polylines(img, [pts], True, (255, 255, 255), 3)
-            cv2.putText(img, "BL", (x - 15, y + 35), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+            cv2.polylines(img, [pts], True, (255, 255, 255), line)
+            cv2.putText(img, "BL", (x - px(15), y + px(35)), cv2.FONT_HERSHEY_SIMPLEX, font, color, px(2))
         elif i == 3:  # Bottom-right - Diamond
             pts = np.array([[x, y - size], [x + size, y], [x, y + size], [x - size, y]], np.int32)
             cv2.fillPoly(img, [pts], color)
-            cv2.polylines(img, [pts], True, (255, 255, 255), 3)
-            cv2.putText(img, "BR", (x - 15, y + 35), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+            cv2.polylines(img, [pts], True, (255, 255, 255), line)
+            cv2.putText(img, "BR", (x - px(15), y + px(35)), cv2.FONT_HERSHEY_SIMPLEX, font, color, px(2))
+
+class ScanError(Exception):
+    """
+    Raised with a user-facing message when a sheet cannot be graded. reason
+    is an optional machine-readable code (e.g. a quality.REASONS key).
+    """
+
+    def __init__(self, message, reason=None):
+        super().__init__(message)
+        self.reason = reason
+
+
+def get_layout(name=None):
+    """Compiled sheet layout, with unknown names reported as a ScanError"""
+    try:
+        return layout.load_layout(name)
+    except ValueError as e:
+        raise ScanError(str(e))
+
+def parse_answers(no_questions, answers, sheet_layout=None):
+    """Validate the question count and answer key, returning the key as a list"""
+    sheet_layout = sheet_layout or get_layout()
+    if no_questions > sheet_layout.questions or no_questions <= 0:
+        raise ScanError(f"Number must be between 1 and {sheet_layout.questions}")
+
+    ans = json.loads(answers) if isinstance(answers, str) else answers
+    if not isinstance(ans, list) or len(ans) != no_questions:
+        raise ScanError("Invalid answers format")
+    if not all(isinstance(a, int) and 0 <= a < sheet_layout.choices for a in ans):
+        raise ScanError(f"Answers must be choice indexes between 0 and {sheet_layout.choices - 1}")
+    return ans
+
+def decode_image(data, sheet_layout=None, gray=False):
+    """
+    Decode an encoded image (JPEG/PNG bytes) straight from memory at the
+    resolution the layout needs, upright and in its original aspect ratio
+    """
+    sheet_layout = sheet_layout or get_layout()
+    img = decode.decode(data, sheet_layout.source_size, gray)
+    if img is None:
+        raise Exception("Could not read image file")
+    return img
+
+def read_image(path, sheet_layout=None, gray=False):
+    """Load the sheet from a file path, or from stdin bytes when path is "-" """
+    if path == "-":
+        return decode_image(sys.stdin.buffer.read(), sheet_layout, gray)
+    sheet_layout = sheet_layout or get_layout()
+    img = decode.read(path, sheet_layout.source_size, gray)
+    if img is None:
+        raise Exception("Could not read image file")
+    return img
+
+def resize_sheet(img, sheet_layout=None):
+    """Fit an already decoded image to the layout's working size, keeping its aspect ratio"""
+    sheet_layout = sheet_layout or get_layout()
+    return decode.fit(img, sheet_layout.source_size)
+
+SCORING_MODES = ("sample", "warp")
+
+class StageTimer:
+    """
+    Wall time of consecutive pipeline stages in milliseconds: mark(stage)
+    charges the time since the previous mark to stage. A stage marked twice
+    adds up.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self.last) * 1000
+        self.last = now
+
+    def skip(self):
+        """Leave the time since the last mark uncounted"""
+        self.last = time.perf_counter()
+
+    def result(self):
+        return {stage: round(ms, 3) for stage, ms in self.stages.items()}
+
+
+class _NoTimer:
+    """Stand-in when timing is off, so the hot path never checks for it"""
+
+    def mark(self, stage):
+        pass
+
+    def skip(self):
+        pass
+
+
+NO_TIMER = _NoTimer()
+
+
+def check_quality(gray):
+    """Pre-flight blur / exposure / glare check; raises ScanError with the reason"""
+    reason, metrics = quality.check(gray)
+    if reason is not None:
+        raise ScanError(quality.REASONS[reason], reason)
+    return metrics
+
+def measure_sheet(img, sheet_layout=None, mode="sample", check=True, registered=None, timer=NO_TIMER, trace=NO_TRACE, rig=None):
+    """
+    Register a resized sheet (colour or grayscale) and read the fill ratio of
+    every bubble of the layout. Nothing here depends on the answer key, so
+    the measurement can be cached per image and graded against any key.
+
+    mode "sample" reads the bubbles straight through the homography; "warp"
+    warps the whole sheet first. With check set, unusable photos are rejected
+    from a thumbnail before registration is attempted. registered is an
+    optional (corners, method) pair found earlier (e.g. by a frame tracker);
+    registration is then skipped. With a calibrated rig (rigs.Rig) the
+    stored corners are used when the sheet is verified to sit where the rig
+    expects it, and the full registration only runs when it does not.
+    timer (a StageTimer) gets the quality,
+    register, warp and threshold stages; trace (a tracing.Trace) a copy of
+    each intermediate image and the facts behind the result.
+    """
+    if mode not in SCORING_MODES:
+        raise ScanError(f"Unknown scoring mode: {mode}")
+    sheet_layout = sheet_layout or get_layout()
+
+    # Preprocessing
+    if img.ndim == 3:
+        imgGray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=scratch.get("gray", img.shape[:2]))
+    else:
+        imgGray = img
+    timer.mark("gray")
+    trace.add("gray", imgGray)
+    trace.note(layout=sheet_layout.name, mode=mode, width=imgGray.shape[1])
+    metrics = check_quality(imgGray) if check else None
+    timer.mark("quality")
+    trace.note(quality=metrics)
+
+    # Registration: a calibrated rig's stored corners once verified, else
+    # printed markers when the layout has them, else a coarse-to-fine
+    # contour search
+    if registered is None and rig is not None:
+        registered = rig.locate(imgGray)
+        trace.note(rig=rig.id, verified=registered is not None)
+    corners, method = registered or registration.register(imgGray, sheet_layout, trace=trace)
+    timer.mark("register")
+    trace.note(corners=corners, registration=method)
+    if corners is None:
+        raise ScanError("No answer sheet detected. Please ensure the image contains a clear, well-lit answer sheet with visible borders.")
+
+    # Two tiers: one global Otsu threshold for every question, and the
+    # local (adaptive / per-question) threshold only for questions whose
+    # top-1 / top-2 margin is too small to trust
+    if mode == "warp":
+        imgWarpGray = registration.warp_sheet(imgGray, corners, sheet_layout.warp_size, reuse=True)
+        timer.mark("warp")
+        fill, escalated = scoring.tiered_warp_fill(imgWarpGray, sheet_layout, trace=trace)
+    else:
+        # Sample only the bubble cells through the homography, no full-frame warp
+        matrix = registration.sheet_matrix(corners, sheet_layout.warp_size)
+        fill, escalated = scoring.tiered_sample_fill(imgGray, matrix, sheet_layout, trace=trace)
+    timer.mark("threshold")
+    trace.add("fill", fill)
+    trace.note(escalated=escalated)
+
+    return {
+        "fill": fill,
+        "escalated": escalated,
+        "corners": corners,
+        "registration": method,
+        "quality": metrics,
+    }
+
+def grade_measurement(measured, no_questions, ans, sheet_layout=None):
+    """
+    Grade a measure_sheet result against an answer key: only the vectorized
+    pick / compare over the fill matrix, no image work. The result carries
+    the detected corners and picks so render_overlay can draw the annotated
+    image later, and per question the confidence margin and whether it looks
+    blank or multi-marked.
+    """
+    sheet_layout = sheet_layout or get_layout()
+    myPixelVal = measured["fill"][:no_questions]
+    escalated = measured["escalated"]
+    corners = measured["corners"]
+
+    myIndex = scoring.pick_answers(myPixelVal)
+    blank, multi = scoring.mark_flags(myPixelVal)
+    grading = scoring.grade_answers(myIndex, ans)
+    # A blank question has no pick worth crediting, whatever argmax says
+    grading[blank] = 0
+    score = int(grading.sum())
+
+    # Validate that we detected some answers
+    total_detected = scoring.detected_count(myPixelVal)
+    if total_detected < no_questions * 0.5:  # At least 50% of questions should have detected answers
+        raise ScanError("Insufficient answer markings detected. Please ensure the answer sheet has clear, dark markings and good contrast.")
+
+    return {
+        "score": score,
+        "correct": score,
+        "total": no_questions,
+        "grading": grading.tolist(),
+        "picks": myIndex.tolist(),
+        "confidence": np.round(scoring.margins(myPixelVal), 3).tolist(),
+        "blank": (np.flatnonzero(blank) + 1).tolist(),
+        "multi": (np.flatnonzero(multi) + 1).tolist(),
+        "escalated": int(np.count_nonzero(escalated < no_questions)),
+        "corners": np.round(np.asarray(corners, dtype=float), 2).tolist(),
+        "registration": measured["registration"],
+        "orientation": registration.sheet_orientation(corners),
+        "layout": sheet_layout.name,
+        "quality": measured["quality"],
+    }
+
+def analyze_sheet(img, no_questions, ans, sheet_layout=None, mode="sample", check=True, registered=None, timer=NO_TIMER, trace=NO_TRACE, rig=None):
+    """
+    Register, score and grade a resized sheet without drawing anything;
+    measure_sheet followed by grade_measurement.
+    """
+    measured = measure_sheet(img, sheet_layout, mode, check, registered, timer, trace, rig)
+    result = grade_measurement(measured, no_questions, ans, sheet_layout)
+    timer.mark("grade")
+    trace.note(score=result["score"], picks=result["picks"], grading=result["grading"])
+    return result
+
+def render_overlay(img, result, ans, sheet_layout=None):
+    """
+    Draw corner markers and the answer overlay for a result of analyze_sheet,
+    side by side at PREVIEW_SIZE. Everything is drawn at preview size into
+    scratch buffers; the returned image is only valid until the next call,
+    so encode it straight away.
+    """
+    sheet_layout = sheet_layout or get_layout()
+    widthImg, heightImg = sheet_layout.warp_size
+    height, width = img.shape[:2]
+    scale = PREVIEW_SIZE / float(max(width, height))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    corners = np.float32(result["corners"])
+    biggestContour = np.int32(np.round(corners * scale)).reshape(4, 1, 2)
+    myIndex = result["picks"]
+    grading = result["grading"]
+
+    # Shrink the photo once; both halves start from it
+    imgFinal = cv2.resize(img, size, dst=scratch.get("preview", (size[1], size[0], 3)), interpolation=cv2.INTER_AREA)
+    img_with_corners = scratch.get("preview_corners", imgFinal.shape)
+    np.copyto(img_with_corners, imgFinal)
+
+    # Draw corner markers on the original image
+    draw_corner_markers(img_with_corners, biggestContour, color=(0, 255, 255), size=15, scale=scale)
+
+    # Also draw the contour outline
+    cv2.drawContours(img_with_corners, [biggestContour], -1, (0, 255, 0), max(1, round(3 * scale)))
+
+    # Create visualization
+    imgVisualization = scratch.zeros("visualization", (heightImg, widthImg, 3))
+    centers = sheet_layout.centers(widthImg, heightImg)
+
+    # Draw answer markers
+    for q in range(len(grading)):
+        # Correct answer (small green circle)
+        cv2.circle(imgVisualization, tuple(centers[q, ans[q]].tolist()), 10, (0, 255, 0), 2)
+
+        # Student answer (colored circle)
+        color = (0, 255, 0) if grading[q] == 1 else (0, 0, 255)
+        cv2.circle(imgVisualization, tuple(centers[q, myIndex[q]].tolist()), 15, color, 3)
+
+    # Inverse perspective transform, straight to preview size
+    invMatrix = np.linalg.inv(registration.sheet_matrix(corners * scale, (widthImg, heightImg)))
+    imgInvWarp = cv2.warpPerspective(imgVisualization, invMatrix, size, dst=scratch.get("preview_overlay", imgFinal.shape))
+    cv2.addWeighted(imgFinal, 1, imgInvWarp, 0.7, 0, dst=imgFinal)
+
+    # Combine images (corner detection + final result)
+    combined = scratch.get("preview_combined", (size[1], size[0] * 2, 3))
+    return np.concatenate((img_with_corners, imgFinal), axis=1, out=combined)
+
+def grade_image(img, no_questions, ans, sheet_layout=None, render=True, timer=None, trace=NO_TRACE, rig=None):
+    """
+    Grade a decoded BGR sheet image against the answer key and return the
+    result dict. The annotated image is only drawn and encoded when render is
+    set. With a StageTimer the result also carries "timing", milliseconds per
+    stage; a tracing.Trace collects the intermediate images. rig is an
+    optional calibrated rigs.Rig the photo was taken on.
+    """
+    stages = timer or NO_TIMER
+    img = resize_sheet(img, sheet_layout)
+    stages.mark("resize")
+    result = analyze_sheet(img, no_questions, ans, sheet_layout, timer=stages, trace=trace, rig=rig)
+    if render:
+        overlay = render_overlay(img, result, ans, sheet_layout)
+        stages.mark("overlay")
+        trace.add("overlay", overlay)
+        result["image"] = image_to_base64(overlay)
+        stages.mark("encode")
+        result["image_type"] = "jpg"
+    if timer:
+        result["timing"] = timer.result()
+    return result
+
+def error_result(e):
+    """Build the JSON error payload for an exception raised while grading"""
+    if isinstance(e, ScanError):
+        return {"error": str(e), "reason": e.reason} if e.reason else {"error": str(e)}
+    return {"error": f"Processing failed: {str(e)}. Please ensure you're scanning a valid answer sheet with good lighting and clear markings."}
 
 def main():
     try:
@@ -43,191 +365,23 @@ def main():
 
         path = sys.argv[1]
         no_questions = int(sys.argv[2])
+        sheet_layout = get_layout(sys.argv[4] if len(sys.argv) > 4 else None)
 
-        if no_questions > 60 or no_questions <= 0:
-            print(json.dumps({"error": "Number must be between 1 and 60"}))
-            return
-
-        # Configuration
-        widthImg = 700
-        heightImg = 700
-        choices = 5
-        
         # Parse the answers array from the JSON string
-        ans = json.loads(sys.argv[3])
-        
-        if not isinstance(ans, list) or len(ans) != no_questions:
-            print(json.dumps({"error": "Invalid answers format"}))
-            return
-        
-        # Load image
-        img = cv2.imread(path)
-        if img is None:
-            raise Exception("Could not read image file")
-
-        # Preprocessing
-        img = cv2.resize(img, (widthImg, heightImg))
-        img_orig = img.copy()
-        imgGray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        imgBlur = cv2.GaussianBlur(imgGray, (5, 5), 1)
-        imgCanny = cv2.Canny(imgBlur, 10, 70)
-
-        # Find contours
-        contours, _ = cv2.findContours(imgCanny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Find rectangle contours
-        def rectContour(contours):
-            rectCon = []
-            for i in contours:
-                area = cv2.contourArea(i)
-                if area > 50:
-                    peri = cv2.arcLength(i, True)
-                    approx = cv2.approxPolyDP(i, 0.02 * peri, True)
-                    if len(approx) == 4:
-                        rectCon.append(i)
-            return sorted(rectCon, key=cv2.contourArea, reverse=True)
-
-        rectCon = rectContour(contours)
-        if not rectCon:
-            print(json.dumps({"error": "No answer sheet detected. Please ensure the image contains a clear, well-lit answer sheet with visible borders."}))
-            return
-
-        # Get corner points
-        def getCornerPoints(cont):
-            peri = cv2.arcLength(cont, True)
-            return cv2.approxPolyDP(cont, 0.02 * peri, True)
+        ans = parse_answers(no_questions, sys.argv[3], sheet_layout)
 
-        biggestContour = getCornerPoints(rectCon[0])
-        if biggestContour.size == 0:
-            print(json.dumps({"error": "Could not detect answer sheet corners. Please ensure the answer sheet is clearly visible and not too blurry."}))
-            return
+        # GRADER_TIMING=1 adds per-stage wall times to the result
+        timer = StageTimer() if os.environ.get("GRADER_TIMING") else None
 
-        # Reorder points
-        def reorder(myPoints):
-            myPoints = myPoints.reshape((4, 2))
-            myPointsNew = np.zeros((4, 1, 2), np.int32)
-            add = myPoints.sum(1)
-            myPointsNew[0] = myPoints[np.argmin(add)]
-            myPointsNew[3] = myPoints[np.argmax(add)]
-            diff = np.diff(myPoints, axis=1)
-            myPointsNew[1] = myPoints[np.argmin(diff)]
-            myPointsNew[2] = myPoints[np.argmax(diff)]
-            return myPointsNew
-
-        biggestContour = reorder(biggestContour)
-
-        # Create a copy of the original image to draw corner markers
-        img_with_corners = img_orig.copy()
-        
-        # Draw corner markers on the original image
-        draw_corner_markers(img_with_corners, biggestContour, color=(0, 255, 255), size=15)
-        
-        # Also draw the contour outline
-        cv2.drawContours(img_with_corners, [biggestContour], -1, (0, 255, 0), 3)
-
-        # Perspective transform
-        pts1 = np.float32(biggestContour)
-        pts2 = np.float32([[0, 0], [widthImg, 0], [0, heightImg], [widthImg, heightImg]])
-        matrix = cv2.getPerspectiveTransform(pts1, pts2)
-        imgWarpColored = cv2.warpPerspective(img, matrix, (widthImg, heightImg))
-
-        # Thresholding
-        imgWarpGray = cv2.cvtColor(imgWarpColored, cv2.COLOR_BGR2GRAY)
-        imgThresh = cv2.adaptiveThreshold(
-            imgWarpGray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY_INV, 199, 20
-        )
-
-        # Split into boxes
-        def splitBoxes(img, grid_rows=20, grid_cols=20):
-            cell_h = img.shape[0] // grid_rows
-            cell_w = img.shape[1] // grid_cols
-            boxes = []
-            rows_split = np.vsplit(img, grid_rows)
-            for row in rows_split:
-                cols_split = np.hsplit(row, grid_cols)
-                boxes.append(cols_split)
-            return boxes, cell_w, cell_h
-
-        boxes, cell_w, cell_h = splitBoxes(imgThresh)
-
-        # Analyze answers
-        myPixelVal = np.zeros((no_questions, choices))
-        for q in range(no_questions):
-            if q < 20:
-                row = q
-                offset = 1
-            elif q < 40:
-                row = q - 20
-                offset = 8
-            else:
-                row = q - 40
-                offset = 15
-            
-            for i, c in enumerate(range(offset, offset+5)):
-                box = boxes[row][c]
-                myPixelVal[q][i] = cv2.countNonZero(box) / float(box.size)
-
-        # Calculate results
-        myIndex = [np.argmax(row) for row in myPixelVal]
-        grading = [1 if ans[q] == myIndex[q] else 0 for q in range(no_questions)]
-        score = sum(grading)
-
-        # Validate that we detected some answers
-        total_detected = sum([1 for row in myPixelVal if np.max(row) > 0.01])  # Threshold for detection
-        if total_detected < no_questions * 0.5:  # At least 50% of questions should have detected answers
-            print(json.dumps({"error": "Insufficient answer markings detected. Please ensure the answer sheet has clear, dark markings and good contrast."}))
-            return
+        # Load image
+        img = read_image(path, sheet_layout)
+        if timer:
+            timer.mark("decode")
 
-        # Create visualization
-        imgVisualization = np.zeros_like(imgWarpColored)
-        
-        # Draw answer markers
-        for q in range(no_questions):
-            if q < 20:
-                row = q
-                offset = 1
-            elif q < 40:
-                row = q - 20
-                offset = 8
-            else:
-                row = q - 40
-                offset = 15
-            
-            # Correct answer (small green circle)
-            x_correct = int((offset + ans[q] + 0.5) * cell_w)
-            y_pos = int((row + 0.5) * cell_h)
-            cv2.circle(imgVisualization, (x_correct, y_pos), 10, (0, 255, 0), 2)
-            
-            # Student answer (colored circle)
-            x_student = int((offset + myIndex[q] + 0.5) * cell_w)
-            color = (0, 255, 0) if grading[q] == 1 else (0, 0, 255)
-            cv2.circle(imgVisualization, (x_student, y_pos), 15, color, 3)
-
-        # Inverse perspective transform
-        invMatrix = cv2.getPerspectiveTransform(pts2, pts1)
-        imgInvWarp = cv2.warpPerspective(imgVisualization, invMatrix, (widthImg, heightImg))
-        imgFinal = cv2.addWeighted(img_orig, 1, imgInvWarp, 0.7, 0)
-
-        # Resize and combine images (now showing corner detection + final result)
-        img_corners_small = cv2.resize(img_with_corners, (350, 350))
-        img_final_small = cv2.resize(imgFinal, (350, 350))
-        img_combined = np.hstack((img_corners_small, img_final_small))
-
-        # Prepare result
-        result = {
-            "score": int(score),
-            "correct": int(sum(grading)),
-            "total": no_questions,
-            "grading": grading,
-            "image": image_to_base64(img_combined),
-            "image_type": "jpg"
-        }
-        print(json.dumps(result))
+        print(json.dumps(grade_image(img, no_questions, ans, sheet_layout, timer=timer)))
 
     except Exception as e:
-        error_msg = f"Processing failed: {str(e)}. Please ensure you're scanning a valid answer sheet with good lighting and clear markings."
-        print(json.dumps({"error": error_msg}))
+        print(json.dumps(error_result(e)))
         return
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+import cv2
+import numpy as np
+
+from buffers import scratch
+from tracing import NO_TRACE
+
+# Samples per cell side when reading bubbles straight from the source image
+SAMPLES = 12
+
+# Questions whose top-1 / top-2 fill gap is below this are re-read with the
+# local (adaptive) threshold
+ESCALATE_MARGIN = 0.15
+
+# A question is blank when no choice stands this far above its emptiest
+# choice, and multi-marked when its runner-up reaches MULTI_RATIO of the winner
+BLANK_MARGIN = 0.1
+MULTI_RATIO = 0.6
+
+# Minimum darkness below the local paper level that counts as ink, in grey
+# levels (the same offset the full-frame adaptive threshold uses)
+INK_OFFSET = 20
+
+
+def cell_fill(thresh, grid_rows, grid_cols, ones=False):
+    """
+    Fraction of non-zero pixels in every cell of a grid_rows x grid_cols grid,
+    computed with one block reshape-sum over the whole thresholded image.
+    Pixels left over when the size isn't a multiple of the grid are ignored.
+    With ones set the mask holds only 0 and 1 and is summed as it is, without
+    a boolean copy.
+    """
+    cell_h = thresh.shape[0] // grid_rows
+    cell_w = thresh.shape[1] // grid_cols
+    blocks = thresh[: grid_rows * cell_h, : grid_cols * cell_w]
+    if not ones:
+        blocks = blocks != 0
+    blocks = blocks.reshape(grid_rows, cell_h, grid_cols, cell_w)
+    return blocks.sum(axis=(1, 3), dtype=np.int32) / float(cell_h * cell_w)
+
+
+def fill_matrix(cells, layout, no_questions=None):
+    """Gather the question x choice fill matrix out of the per-cell fill grid"""
+    return cells.ravel()[layout.cell_index[:no_questions]]
+
+
+def sample_cells(gray, matrix, layout, no_questions=None, samples=SAMPLES, reuse=False):
+    """
+    Remap only the bubble cells out of the source grayscale image. matrix is
+    the source -> warped-sheet homography; the layout's warp-space sample
+    grid is mapped back through it and sampled into a mosaic of shape
+    (questions * samples, choices * samples), so no full-frame warp is made.
+    With reuse set the map and mosaic live in scratch buffers, valid until
+    the next reusing call.
+    """
+    points = layout.sample_points(samples)
+    if no_questions is not None:
+        points = points[: no_questions * samples]
+    flat = points.reshape(-1, 1, 2)
+    src_map = scratch.get("sample_map", flat.shape, np.float32) if reuse else None
+    mosaic = scratch.get("mosaic", points.shape[:2]) if reuse else None
+    src = cv2.perspectiveTransform(flat, np.linalg.inv(matrix), dst=src_map)
+    # One two-channel map instead of separate x / y maps saves two copies
+    return cv2.remap(
+        gray, src.reshape(points.shape), None, cv2.INTER_LINEAR, dst=mosaic, borderMode=cv2.BORDER_REPLICATE
+    )
+
+
+def mosaic_ink(mosaic, samples=SAMPLES, offset=INK_OFFSET):
+    """
+    Ink mask of a bubble mosaic with illumination normalised per question:
+    each question's paper and ink levels are its bright and dark percentiles,
+    and a sample is ink when it is darker than their midpoint and at least
+    `offset` grey levels below the paper.
+    """
+    rows = mosaic.reshape(-1, samples * mosaic.shape[1]).astype(np.float32)
+    paper, ink = np.percentile(rows, (95, 5), axis=1)
+    limit = np.minimum(paper - offset, (paper + ink) / 2)
+    return rows < limit[:, None]
+
+
+def mosaic_fill(mask, choices, samples=SAMPLES):
+    """Fill ratio of each question x choice cell of a mosaic ink mask"""
+    return mask.reshape(-1, samples, choices, samples).mean(axis=(1, 3))
+
+
+def otsu_mask(gray, value=255, out=None):
+    """Cheap global ink mask: one Otsu threshold for the whole image, ink = value"""
+    return cv2.threshold(gray, 0, value, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU, dst=out)[1]
+
+
+def top_two(fill):
+    """Largest and second largest fill of each question"""
+    ordered = np.sort(fill, axis=1)
+    return ordered[:, -1], ordered[:, -2]
+
+
+def margins(fill):
+    """Confidence margin of each question: top-1 minus top-2 fill"""
+    first, second = top_two(fill)
+    return first - second
+
+
+def mark_flags(fill, blank_margin=BLANK_MARGIN, multi_ratio=MULTI_RATIO):
+    """Boolean blank and multi-mark flags per question"""
+    first, second = top_two(fill)
+    floor = fill.min(axis=1)
+    blank = first - floor < blank_margin
+    multi = ~blank & (second - floor >= multi_ratio * (first - floor))
+    return blank, multi
+
+
+def adaptive_band_cells(gray, grid_rows, grid_cols, first_row, last_row, block_size, c):
+    """
+    cell_fill of grid rows first_row..last_row only, adaptive-thresholding
+    just the horizontal band that covers them (padded by half a block so
+    the local means match a full-frame pass)
+    """
+    cell_h = gray.shape[0] // grid_rows
+    top, bottom = first_row * cell_h, (last_row + 1) * cell_h
+    pad = block_size // 2
+    y0, y1 = max(0, top - pad), min(gray.shape[0], bottom + pad)
+    # Rows of a full-height scratch buffer, so any band size reuses it
+    out = scratch.get("band", gray.shape)[: y1 - y0]
+    band = cv2.adaptiveThreshold(
+        gray[y0:y1], 1, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c, dst=out
+    )
+    return cell_fill(band[top - y0:bottom - y0], last_row - first_row + 1, grid_cols, ones=True)
+
+
+def tiered_warp_fill(gray, layout, no_questions=None, block_size=199, c=20, escalate_margin=ESCALATE_MARGIN, trace=NO_TRACE):
+    """
+    Fill matrix of a warped grayscale sheet in two tiers: a global Otsu pass
+    for every question, then an adaptive threshold only over the grid rows of
+    questions whose margin is below escalate_margin. Returns (fill, escalated
+    question indexes). trace gets the warped sheet and its Otsu mask.
+    """
+    mask = otsu_mask(gray, 1, scratch.get("warp_mask", gray.shape))
+    trace.add("warp", gray)
+    trace.add("mask", mask)
+    cells = cell_fill(mask, layout.grid_rows, layout.grid_cols, ones=True)
+    fill = fill_matrix(cells, layout, no_questions)
+    escalated = np.flatnonzero(margins(fill) < escalate_margin)
+    if escalated.size:
+        rows = layout.cell_rows[escalated]
+        first_row, last_row = int(rows.min()), int(rows.max())
+        band = adaptive_band_cells(gray, layout.grid_rows, layout.grid_cols, first_row, last_row, block_size, c)
+        fill[escalated] = band[rows - first_row, layout.cell_cols[escalated]]
+    return fill, escalated
+
+
+def tiered_sample_fill(gray, matrix, layout, no_questions=None, samples=SAMPLES, escalate_margin=ESCALATE_MARGIN, trace=NO_TRACE):
+    """
+    Question x choice fill matrix read through the homography, no warp
+    needed, in two tiers: one Otsu threshold over the whole bubble mosaic,
+    then per-question illumination normalisation only for the questions whose
+    margin is below escalate_margin. Returns (fill, escalated question indexes).
+    trace gets the bubble mosaic and its Otsu mask.
+    """
+    mosaic = sample_cells(gray, matrix, layout, no_questions, samples, reuse=True)
+    mask = otsu_mask(mosaic, 1, scratch.get("mosaic_mask", mosaic.shape))
+    trace.add("mosaic", mosaic)
+    trace.add("mask", mask)
+    fill = mosaic_fill(mask, layout.choices, samples)
+    escalated = np.flatnonzero(margins(fill) < escalate_margin)
+    if escalated.size:
+        rows = mosaic.reshape(-1, samples, mosaic.shape[1])[escalated]
+        local = mosaic_ink(rows.reshape(-1, mosaic.shape[1]), samples)
+        fill[escalated] = mosaic_fill(local, layout.choices, samples)
+    return fill, escalated
+
+
+def pick_answers(fill):
+    """Index of the most filled choice for each question"""
+    return np.argmax(fill, axis=1)
+
+
+def grade_answers(picks, key):
+    """1 where the picked choice matches the key, 0 otherwise"""
+    return (picks == np.asarray(key)).astype(np.int32)
+
+
+def detected_count(fill, min_fill=0.01):
+    """Number of questions with at least one choice above min_fill"""
+    return int(np.count_nonzero(fill.max(axis=1) > min_fill))
@@ -1,81 +1,712 @@
 const express = require("express");
 const multer = require("multer");
 const cors = require("cors");
-const { spawn } = require("child_process");
+const crypto = require("crypto");
 const fs = require("fs");
+const http = require("http");
+const path = require("path");
+const { performance } = require("perf_hooks");
+const { WebSocketServer } = require("ws");
+const { WorkerPool, runOnce } = require("./workerPool");
+const { ImageStore } = require("./imageStore");
+const { JobQueue } = require("./jobQueue");
+const { Registry } = require("./metrics");
+
+// Latency histograms, served in Prometheus text format on a local-only
+// port (METRICS_PORT, default 9464) so pool sizing and regressions can be
+// watched in production. Workers report their own per-stage times.
+const metrics = new Registry();
+const httpSeconds = metrics.histogram(
+  "grader_http_request_seconds",
+  "HTTP request duration",
+  ["route", "status"]
+);
+const uploadSeconds = metrics.histogram(
+  "grader_upload_seconds",
+  "Time to receive and parse a multipart upload"
+);
+const queueSeconds = metrics.histogram(
+  "grader_queue_wait_seconds",
+  "Time a request waited for a free worker",
+  ["op"]
+);
+const workerSeconds = metrics.histogram(
+  "grader_worker_seconds",
+  "Worker round trip of a request",
+  ["op"]
+);
+const spawnSeconds = metrics.histogram(
+  "grader_spawn_seconds",
+  "Python worker start-up until it is ready for requests"
+);
+const stageSeconds = metrics.histogram(
+  "grader_stage_seconds",
+  "Wall time of one grading pipeline stage inside the worker",
+  ["stage"]
+);
+const jobWaitSeconds = metrics.histogram(
+  "grader_job_wait_seconds",
+  "Time an async job waited in the job queue before it started"
+);
+const rejected = metrics.counter(
+  "grader_rejected_total",
+  "Requests turned away with 429 because a queue was full"
+);
 
 const app = express();
+
+app.use((req, res, next) => {
+  req.receivedAt = performance.now();
+  res.on("finish", () => {
+    const route = req.route ? req.baseUrl + req.route.path : "unmatched";
+    httpSeconds.observe(
+      { route, status: res.statusCode },
+      (performance.now() - req.receivedAt) / 1000
+    );
+  });
+  next();
+});
 app.use(cors());
 app.use(express.json());
 
-// File upload configuration
-const upload = multer({ dest: "uploads/" });
+// File upload configuration: uploads stay in memory and are handed to the
+// grader as bytes, so nothing is written to disk on the hot path
+const upload = multer({
+  storage: multer.memoryStorage(),
+  limits: {
+    fileSize: Number.parseInt(process.env.MAX_UPLOAD_BYTES) || 20 * 1024 * 1024,
+  },
+});
 
-app.post("/process-image", upload.single("image"), (req, res) => {
-  if (!req.file) {
-    return res.status(400).json({ error: "No file uploaded" });
+// Runs right after multer, so the time so far went into receiving the upload
+function uploaded(req, res, next) {
+  uploadSeconds.observe({}, (performance.now() - req.receivedAt) / 1000);
+  next();
+}
+
+// "pool" keeps pre-warmed workers alive; "spawn" forks a worker per request
+const GRADER_MODE = process.env.GRADER_MODE || "pool";
+const pool =
+  GRADER_MODE === "pool"
+    ? new WorkerPool({
+        size: Number.parseInt(process.env.GRADER_WORKERS) || undefined,
+        maxQueue: Number.parseInt(process.env.GRADER_QUEUE_LIMIT) || undefined,
+        onSpawn: (ms) => spawnSeconds.observe({}, ms / 1000),
+      })
+    : null;
+
+// Sheet layouts shared with the Python grader (layouts/*.json)
+const DEFAULT_LAYOUT = "standard";
+const layouts = loadLayouts(path.join(__dirname, "layouts"));
+
+function loadLayouts(dir) {
+  const byName = {};
+  for (const file of fs.readdirSync(dir)) {
+    if (!file.endsWith(".json")) continue;
+    const spec = JSON.parse(fs.readFileSync(path.join(dir, file), "utf8"));
+    byName[path.basename(file, ".json")] = spec;
   }
+  return byName;
+}
+
+app.get("/layouts", (req, res) => {
+  res.json(
+    Object.entries(layouts).map(([name, spec]) => ({
+      name,
+      description: spec.description,
+      questions: spec.questions,
+      choices: spec.choices,
+    }))
+  );
+});
 
-  console.log("Received answers:", req.body.answers);
+// What uploads for a layout (or an exam's layout) need: long side in
+// pixels, whether grayscale is accepted and the JPEG quality to encode at.
+// Clients resize and compress to it before uploading. Profiles come from
+// the compiled layouts in the workers and never change while running.
+const captureProfiles = new Map();
 
-  const noQuestions = Number.parseInt(req.body.questions);
-  if (isNaN(noQuestions) || noQuestions <= 0 || noQuestions > 60) {
-    cleanup(req.file.path);
-    return res.status(400).json({ error: "Invalid question count (1-60)" });
+app.get("/capture", (req, res) => {
+  let layoutName = req.query.layout || DEFAULT_LAYOUT;
+  if (req.query.exam) {
+    const exam = exams.get(req.query.exam);
+    if (!exam) return res.status(404).json({ error: "Exam not found" });
+    layoutName = exam.layout;
+  }
+  if (!layouts[layoutName]) {
+    return res.status(400).json({ error: `Unknown layout: ${layoutName}` });
+  }
+
+  const cached = captureProfiles.get(layoutName);
+  const profile = cached
+    ? Promise.resolve(cached)
+    : run({ op: "capture", layout: layoutName }, null).then(({ result }) => {
+        if (!result.error) captureProfiles.set(layoutName, result);
+        return result;
+      });
+  profile
+    .then((result) => {
+      if (result.error) return res.status(422).json(result);
+      res.set("Cache-Control", "public, max-age=3600");
+      res.json(req.query.exam ? { exam: req.query.exam, ...result } : result);
+    })
+    .catch((err) => sendRunError(res, err));
+});
+
+// Registered exams: key, layout and question count stored once under an
+// exam id (exams/<id>.json, read by the workers too), so uploads only
+// reference the id
+const EXAM_DIR = process.env.GRADER_EXAM_DIR || path.join(__dirname, "exams");
+const EXAM_ID = /^[A-Za-z0-9_-]{1,64}$/;
+const exams = loadExams(EXAM_DIR);
+
+function loadExams(dir) {
+  fs.mkdirSync(dir, { recursive: true });
+  const byId = new Map();
+  for (const file of fs.readdirSync(dir)) {
+    if (!file.endsWith(".json")) continue;
+    const exam = JSON.parse(fs.readFileSync(path.join(dir, file), "utf8"));
+    byId.set(exam.id, exam);
+  }
+  return byId;
+}
+
+function saveExam(exam) {
+  // Write and rename so a worker never reads a half-written key
+  const file = path.join(EXAM_DIR, `${exam.id}.json`);
+  fs.writeFileSync(`${file}.tmp`, JSON.stringify(exam, null, 2));
+  fs.renameSync(`${file}.tmp`, file);
+  exams.set(exam.id, exam);
+}
+
+// Validate the layout, question count and answer key of a grading request,
+// or look them up when it names a registered exam. answers may be a JSON
+// string (multipart fields) or an array.
+function parseExam(fields) {
+  if (fields.exam) {
+    const exam = exams.get(fields.exam);
+    if (!exam) return { error: `Unknown exam: ${fields.exam}` };
+    return {
+      examId: exam.id,
+      layoutName: exam.layout,
+      noQuestions: exam.questions,
+      answers: exam.answers,
+    };
+  }
+
+  const layoutName = fields.layout || DEFAULT_LAYOUT;
+  const layout = layouts[layoutName];
+  if (!layout) {
+    return { error: `Unknown layout: ${layoutName}` };
+  }
+
+  const noQuestions = Number.parseInt(fields.questions);
+  if (isNaN(noQuestions) || noQuestions <= 0 || noQuestions > layout.questions) {
+    return { error: `Invalid question count (1-${layout.questions})` };
   }
 
   // Parse the answers array from the request
-  const answers = JSON.parse(req.body.answers || "[]");
+  const answers =
+    typeof fields.answers === "string"
+      ? JSON.parse(fields.answers || "[]")
+      : fields.answers || [];
   if (!Array.isArray(answers) || answers.length !== noQuestions) {
-    cleanup(req.file.path);
-    return res.status(400).json({ error: "Invalid answers array" });
+    return { error: "Invalid answers array" };
+  }
+  if (!answers.every((a) => Number.isInteger(a) && a >= 0 && a < layout.choices)) {
+    return { error: `Answers must be choice indexes between 0 and ${layout.choices - 1}` };
   }
+  return { layoutName, noQuestions, answers };
+}
 
-  // Pass the answers as a single JSON string argument
-  const python = spawn("python", [
-    "scan.py",
-    req.file.path,
-    noQuestions.toString(),
-    JSON.stringify(answers), // Pass as a single JSON string
-  ]);
+app.post("/exams", (req, res) => {
+  const id = req.body.id || crypto.randomUUID();
+  if (!EXAM_ID.test(id)) {
+    return res.status(400).json({ error: "Invalid exam id" });
+  }
+  if (exams.has(id)) {
+    return res.status(409).json({ error: `Exam ${id} already exists` });
+  }
+  const parsed = parseExam({ ...req.body, exam: undefined });
+  if (parsed.error) {
+    return res.status(400).json({ error: parsed.error });
+  }
 
-  let resultData = "";
-  let errorData = "";
+  const exam = {
+    id,
+    title: req.body.title || null,
+    layout: parsed.layoutName,
+    questions: parsed.noQuestions,
+    answers: parsed.answers,
+    updated: new Date().toISOString(),
+  };
+  saveExam(exam);
+  res.status(201).json(exam);
+});
 
-  python.stdout.on("data", (data) => (resultData += data.toString()));
-  python.stderr.on("data", (data) => (errorData += data.toString()));
+app.get("/exams/:id", (req, res) => {
+  const exam = exams.get(req.params.id);
+  if (!exam) return res.status(404).json({ error: "Exam not found" });
+  res.json(exam);
+});
 
-  python.on("close", (code) => {
-    cleanup(req.file.path);
+// Correct the key of an exam. With ?regrade=1 every sheet already graded
+// for it is regraded from its stored fill matrix in the same request.
+app.put("/exams/:id/answers", (req, res) => {
+  const exam = exams.get(req.params.id);
+  if (!exam) return res.status(404).json({ error: "Exam not found" });
+  const parsed = parseExam({
+    layout: exam.layout,
+    questions: exam.questions,
+    answers: req.body.answers,
+  });
+  if (parsed.error) {
+    return res.status(400).json({ error: parsed.error });
+  }
 
-    if (code !== 0) {
-      return res.status(500).json({
-        error: "Processing failed",
-        details: errorData,
-      });
+  const updated = { ...exam, answers: parsed.answers, updated: new Date().toISOString() };
+  saveExam(updated);
+  if (!req.query.regrade) return res.json(updated);
+  regrade(updated.id)
+    .then((result) => res.json({ ...updated, regrade: result.results }))
+    .catch((err) => sendRunError(res, err));
+});
+
+app.post("/exams/:id/regrade", (req, res) => {
+  if (!exams.has(req.params.id)) {
+    return res.status(404).json({ error: "Exam not found" });
+  }
+  regrade(req.params.id)
+    .then((result) => res.json(result))
+    .catch((err) => sendRunError(res, err));
+});
+
+// Item analysis of the exam's graded sheets: difficulty, discrimination,
+// choice distribution per question and the score histogram
+app.get("/exams/:id/analytics", (req, res) => {
+  if (!exams.has(req.params.id)) {
+    return res.status(404).json({ error: "Exam not found" });
+  }
+  run({ op: "analytics", exam: req.params.id }, null)
+    .then(({ result }) => res.status(result.error ? 422 : 200).json(result))
+    .catch((err) => sendRunError(res, err));
+});
+
+function regrade(examId) {
+  return run({ op: "regrade", exam: examId }, null).then(({ result }) => {
+    if (result.error) throw Object.assign(new Error(result.error), { details: result.error });
+    return result;
+  });
+}
+
+// Fixed scanning rigs (document cameras, flatbeds): a reference sheet
+// photographed on the rig is registered once (rigs/<id>.npz, kept by the
+// workers), and uploads naming the rig reuse where the sheet was found
+const RIG_ID = /^[A-Za-z0-9_-]{1,64}$/;
+
+app.post("/rigs/:id/calibrate", upload.single("image"), uploaded, (req, res) => {
+  if (!RIG_ID.test(req.params.id)) {
+    return res.status(400).json({ error: "Invalid rig id" });
+  }
+  if (!req.file) {
+    return res.status(400).json({ error: "No file uploaded" });
+  }
+  const layoutName = req.body.layout || DEFAULT_LAYOUT;
+  if (!layouts[layoutName]) {
+    return res.status(400).json({ error: `Unknown layout: ${layoutName}` });
+  }
+  run({ op: "calibrate", rig: req.params.id, layout: layoutName }, req.file.buffer)
+    .then(({ result }) => res.status(result.error ? 422 : 201).json(result))
+    .catch((err) => sendRunError(res, err));
+});
+
+// Rendered result images, addressed by the hash of their bytes and kept on
+// disk, since their URLs are stored in job results and client history
+const images = new ImageStore(
+  process.env.IMAGE_DIR || path.join(__dirname, "images"),
+  Number.parseInt(process.env.IMAGE_CACHE_BYTES) || undefined
+);
+
+// Validate an upload's fields and build the worker header for grading it.
+// renders lists the render options the endpoint supports.
+function gradeRequest(req, renders) {
+  if (!req.file) {
+    return { error: "No file uploaded" };
+  }
+
+  console.log("Received answers:", req.body.exam || req.body.answers);
+
+  const exam = parseExam(req.body);
+  if (exam.error) {
+    return { error: exam.error };
+  }
+  const { examId, layoutName, noQuestions, answers } = exam;
+
+  // "inline" returns the annotated image with the result (the default),
+  // "lazy" returns an image_url that renders it on first request,
+  // "none" only grades
+  const render = req.body.render || "inline";
+  if (!renders.includes(render)) {
+    return { error: "Invalid render option" };
+  }
+
+  // Registered exams travel by id; the worker keeps the compiled key
+  // Workers always report per-stage times; they feed the metrics
+  const header = examId
+    ? { op: "grade", exam: examId, render: render === "inline", timing: true }
+    : {
+        op: "grade",
+        questions: noQuestions,
+        answers,
+        layout: layoutName,
+        render: render === "inline",
+        timing: true,
+      };
+
+  // A photo from a calibrated rig skips the sheet search when it verifies
+  if (req.body.rig) {
+    if (!RIG_ID.test(req.body.rig)) return { error: "Invalid rig id" };
+    header.rig = req.body.rig;
+  }
+  return { header, render, layoutName, answers };
+}
+
+// Run a grade request; an annotated JPEG coming back as raw bytes is kept
+// in the image store and referenced by a relative image_url. The stage
+// timings are only passed on to the client when keepTiming is set.
+function grade(header, body, keepTiming = false) {
+  return run(header, body).then(({ result, body: image }) => {
+    if (!keepTiming) delete result.timing;
+    if (image.length) {
+      const id = images.put(image, result.image_type);
+      result.image_url = `/images/${id}`;
+      delete result.image_type;
     }
+    return result;
+  });
+}
 
-    try {
-      const result = JSON.parse(resultData);
+app.post("/process-image", upload.single("image"), uploaded, (req, res) => {
+  const request = gradeRequest(req, ["inline", "lazy", "none"]);
+  if (request.error) {
+    return res.status(400).json({ error: request.error });
+  }
+  const { header, render, layoutName, answers } = request;
 
-      if (result.image) {
-        // Convert base64 to data URL
-        result.image = `data:image/${result.image_type};base64,${result.image}`;
-        delete result.image_type;
+  // ?trace=1 keeps this sheet's intermediate images when the workers
+  // trace (GRADER_TRACE_DIR); the result then names the trace
+  if (req.query.trace) header.trace = true;
+  // ?timing=1 returns the worker's per-stage milliseconds with the result
+  grade(header, req.file.buffer, Boolean(req.query.timing))
+    .then((result) => {
+      if (render === "lazy" && !result.error) {
+        const id = crypto.randomUUID();
+        rememberRender(id, { image: req.file.buffer, answers, layoutName, result });
+        result.image_url = `/results/${id}/image`;
       }
 
+      if (result.image_url) result.image = absoluteUrl(req, result.image_url);
       res.json(result);
-    } catch (e) {
-      res.status(500).json({ error: "Invalid processing output" });
-    }
+    })
+    .catch((err) => sendRunError(res, err));
+});
+
+// Asynchronous grading: POST /jobs answers 202 with a job id straight away,
+// a bounded scheduler feeds the jobs to the workers, and the result is
+// polled at GET /jobs/:id or pushed as server-sent events from
+// GET /jobs/:id/events. Jobs are kept on disk, so a restart resumes them.
+const jobs = new JobQueue(grade, {
+  dir: process.env.JOB_DIR || path.join(__dirname, "jobs"),
+  concurrency:
+    Number.parseInt(process.env.JOB_CONCURRENCY) ||
+    (pool ? pool.workers.length : 2),
+  maxPending: Number.parseInt(process.env.JOB_QUEUE_LIMIT) || undefined,
+});
+jobs.on("update", (job) => {
+  if (job.status === "running") {
+    jobWaitSeconds.observe({}, (job.updated - job.created) / 1000);
+  }
+});
+
+function presentJob(req, job) {
+  const result = job.result;
+  if (result && result.image_url) result.image = absoluteUrl(req, result.image_url);
+  return { ...job, url: `/jobs/${job.id}` };
+}
+
+app.post("/jobs", upload.single("image"), uploaded, (req, res) => {
+  const request = gradeRequest(req, ["inline", "none"]);
+  if (request.error) {
+    return res.status(400).json({ error: request.error });
+  }
+  try {
+    const job = jobs.submit(request.header, req.file.buffer);
+    res.status(202).json(presentJob(req, job));
+  } catch (err) {
+    sendRunError(res, err);
+  }
+});
+
+app.get("/jobs/:id", (req, res) => {
+  const job = jobs.get(req.params.id);
+  if (!job) return res.status(404).json({ error: "Job not found" });
+  res.json(presentJob(req, job));
+});
+
+app.get("/jobs/:id/events", (req, res) => {
+  const id = req.params.id;
+  const job = jobs.get(id);
+  if (!job) return res.status(404).json({ error: "Job not found" });
+
+  res.writeHead(200, {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    Connection: "keep-alive",
   });
+  const finished = (update) => update.status === "done" || update.status === "failed";
+  const send = (update) =>
+    res.write(`data: ${JSON.stringify(presentJob(req, update))}\n\n`);
+
+  send(job);
+  if (finished(job)) return res.end();
+
+  const onUpdate = (update) => {
+    if (update.id !== id) return;
+    send(update);
+    if (finished(update)) {
+      jobs.off("update", onUpdate);
+      res.end();
+    }
+  };
+  jobs.on("update", onUpdate);
+  req.on("close", () => jobs.off("update", onUpdate));
+});
+
+// Upload bytes and grading results kept so the overlay can be rendered
+// on demand. Uploads can be up to 20 MB each, so the cache is bounded by
+// their total size as well as by count; the oldest entries go first.
+const RENDER_CACHE_SIZE = Number.parseInt(process.env.RENDER_CACHE_SIZE) || 200;
+const RENDER_CACHE_BYTES =
+  Number.parseInt(process.env.RENDER_CACHE_BYTES) || 256 * 1024 * 1024;
+const pendingRenders = new Map();
+let pendingRenderBytes = 0;
+
+function rememberRender(id, context) {
+  pendingRenders.set(id, context);
+  pendingRenderBytes += context.image.length;
+  while (
+    pendingRenders.size > 1 &&
+    (pendingRenders.size > RENDER_CACHE_SIZE || pendingRenderBytes > RENDER_CACHE_BYTES)
+  ) {
+    const [oldest, entry] = pendingRenders.entries().next().value;
+    pendingRenders.delete(oldest);
+    pendingRenderBytes -= entry.image.length;
+  }
+}
+
+app.get("/results/:id/image", (req, res) => {
+  const context = pendingRenders.get(req.params.id);
+  if (!context) {
+    return res.status(404).json({ error: "Result not found or expired" });
+  }
+  if (context.imageId && images.has(context.imageId)) {
+    return images.send(req, res, context.imageId);
+  }
+
+  const header = {
+    op: "render",
+    answers: context.answers,
+    layout: context.layoutName,
+    result: context.result,
+  };
+
+  run(header, context.image)
+    .then(({ result, body }) => {
+      if (result.error) return res.status(422).json(result);
+      context.imageId = images.put(body, result.image_type);
+      images.send(req, res, context.imageId);
+    })
+    .catch((err) => sendRunError(res, err));
 });
 
-function cleanup(filePath) {
-  fs.unlink(filePath, (err) => {
-    if (err) console.error("Error cleaning up file:", err);
+app.get("/images/:id", (req, res) => images.send(req, res, req.params.id));
+
+function absoluteUrl(req, url) {
+  return `${req.protocol}://${req.get("host")}${url}`;
+}
+
+function run(header, body, affinity) {
+  const running = pool ? pool.run(header, body, affinity) : runOnce(header, body);
+  return running.then((response) => {
+    observeRun(header.op || "grade", response);
+    return response;
   });
 }
 
+function observeRun(op, { result, timing }) {
+  if (timing.queueMs !== undefined) queueSeconds.observe({ op }, timing.queueMs / 1000);
+  if (timing.spawnMs !== undefined) spawnSeconds.observe({}, timing.spawnMs / 1000);
+  workerSeconds.observe({ op }, timing.workerMs / 1000);
+  if (result && result.timing) {
+    for (const [stage, ms] of Object.entries(result.timing)) {
+      stageSeconds.observe({ stage }, ms / 1000);
+    }
+  }
+}
+
+function sendRunError(res, err) {
+  if (err.code === "QUEUE_FULL") {
+    rejected.inc();
+    // Admission control: tell the client when the backlog should have room
+    res.set("Retry-After", String(err.retryAfter || 1));
+    return res.status(429).json({ error: "Server busy, please retry" });
+  }
+  res.status(500).json({
+    error: "Processing failed",
+    details: err.details || err.message,
+  });
+}
+
+app.use((err, req, res, next) => {
+  if (err instanceof multer.MulterError) {
+    const status = err.code === "LIMIT_FILE_SIZE" ? 413 : 400;
+    return res.status(status).json({ error: err.message });
+  }
+  next(err);
+});
+
 const PORT = process.env.PORT || 3000;
-app.listen(PORT, () => console.log(`Server running on port ${PORT}`));
+const server = app.listen(PORT, () =>
+  console.log(`Server running on port ${PORT}`)
+);
+
+metrics.gauge("grader_workers", "Python workers in the pool", () =>
+  pool ? pool.stats().size : 0
+);
+metrics.gauge("grader_workers_busy", "Workers running a request", () =>
+  pool ? pool.stats().busy : 0
+);
+metrics.gauge("grader_queue_depth", "Requests waiting for a worker", () =>
+  pool ? pool.stats().queued : 0
+);
+metrics.gauge("grader_jobs_queued", "Async jobs waiting to start", () => jobs.stats().queued);
+metrics.gauge("grader_jobs_running", "Async jobs running", () => jobs.stats().running);
+
+// Measurement cache of the workers (spawn mode has no cache across requests)
+const cacheStat = (key) => () => (pool ? pool.cacheStats()[key] : 0);
+metrics.gauge("grader_cache_entries", "Measurements cached in worker memory", cacheStat("entries"));
+metrics.collectedCounter(
+  "grader_cache_hits_total",
+  "Uploads whose measurement came from a worker's memory",
+  cacheStat("hits")
+);
+metrics.collectedCounter(
+  "grader_cache_disk_hits_total",
+  "Uploads whose measurement came from the shared cache directory",
+  cacheStat("disk_hits")
+);
+metrics.collectedCounter(
+  "grader_cache_misses_total",
+  "Uploads that had to be decoded and registered",
+  cacheStat("misses")
+);
+
+// The metrics listener is separate from the public app and bound to the
+// loopback interface by default; METRICS_PORT=0 turns it off
+const METRICS_PORT = process.env.METRICS_PORT || 9464;
+if (METRICS_PORT !== "0") {
+  http
+    .createServer((req, res) => {
+      if (req.url !== "/metrics") {
+        res.writeHead(404);
+        return res.end();
+      }
+      res.writeHead(200, { "Content-Type": "text/plain; version=0.0.4" });
+      res.end(metrics.render());
+    })
+    .listen(METRICS_PORT, process.env.METRICS_HOST || "127.0.0.1");
+}
+
+// Live camera streaming. The client opens ws://host/stream, sends one JSON
+// text message { questions, answers, layout } and then binary JPEG preview
+// frames. Every frame is answered with framing guidance (corners, stable
+// frame count, quality reason); once the sheet has held still the answer
+// also carries the graded result. Frames that arrive while one is being
+// processed replace each other, so only the newest is looked at and latency
+// never builds up behind a slow frame.
+const wss = new WebSocketServer({
+  server,
+  path: "/stream",
+  maxPayload: Number.parseInt(process.env.MAX_UPLOAD_BYTES) || 20 * 1024 * 1024,
+});
+
+wss.on("connection", (socket) => {
+  // Sessions keep tracker state inside one worker, which spawn mode lacks
+  if (!pool) return socket.close(1011, "Streaming needs GRADER_MODE=pool");
+
+  const session = crypto.randomUUID();
+  let exam = null;
+  let busy = false;
+  let pending = null;
+
+  const send = (message) => {
+    if (socket.readyState === socket.OPEN) socket.send(JSON.stringify(message));
+  };
+
+  const track = (frame) => {
+    busy = true;
+    const header = exam.examId
+      ? { op: "track", session, exam: exam.examId }
+      : {
+          op: "track",
+          session,
+          layout: exam.layoutName,
+          questions: exam.noQuestions,
+          answers: exam.answers,
+        };
+    run(header, frame, session)
+      .then(({ result }) => send(result))
+      .catch((err) => {
+        if (err.code === "QUEUE_FULL") rejected.inc();
+        send({
+          error:
+            err.code === "QUEUE_FULL"
+              ? "Server busy, please retry"
+              : "Processing failed",
+        });
+      })
+      .finally(() => {
+        busy = false;
+        if (pending) {
+          const next = pending;
+          pending = null;
+          track(next);
+        }
+      });
+  };
+
+  socket.on("message", (data, isBinary) => {
+    if (!isBinary) {
+      let parsed;
+      try {
+        parsed = parseExam(JSON.parse(data.toString("utf8")));
+      } catch (err) {
+        return send({ error: "Invalid settings message" });
+      }
+      if (parsed.error) return send({ error: parsed.error });
+      exam = parsed;
+      return send({ ready: true, session });
+    }
+    if (!exam) return send({ error: "Send the exam settings first" });
+    if (busy) pending = data;
+    else track(data);
+  });
+
+  socket.on("close", () => {
+    pending = null;
+    pool
+      .run({ op: "end", session }, null, session)
+      .catch(() => {})
+      .finally(() => pool.unpin(session));
+  });
+});
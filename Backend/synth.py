@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+import layout
+
+# Distortion presets: perspective jitter (fraction of the sheet size),
+# rotation (degrees), blur sigma, lighting gradient strength, noise sigma,
+# and the share of questions left blank / with an erased second mark
+PRESETS = {
+    "clean": dict(perspective=0.0, rotation=0.0, blur=0.0, gradient=0.0, noise=0.0, blank=0.0, erased=0.0),
+    "moderate": dict(perspective=0.06, rotation=6.0, blur=1.2, gradient=0.35, noise=4.0, blank=0.03, erased=0.05),
+    "hard": dict(perspective=0.12, rotation=12.0, blur=2.5, gradient=0.6, noise=9.0, blank=0.05, erased=0.1),
+    # Fixed document camera: the sheet lands within a few pixels of one spot
+    "rig": dict(perspective=0.003, rotation=0.3, blur=0.8, gradient=0.15, noise=3.0, blank=0.03, erased=0.05),
+}
+
+PAPER = 235
+INK = 35
+
+
+def random_marks(sheet_layout, questions, rng, blank=0.0):
+    """Marked choice per question, -1 for a question left blank"""
+    marks = rng.integers(0, sheet_layout.choices, questions)
+    marks[rng.random(questions) < blank] = -1
+    return marks
+
+
+def render_sheet(sheet_layout, marks, rng, cell=48, erased=0.0):
+    """
+    Draw a clean sheet for a layout: an empty ring for every bubble and a
+    filled bubble for each mark. A share `erased` of questions also gets a
+    faint, partly erased mark on another choice. The paper edge is the grid
+    outline, as contour registration expects; layouts with markers get them
+    printed on a margin around the grid instead. Returns the page and the
+    grid corners (TL, TR, BL, BR) in page coordinates.
+    """
+    width, height = sheet_layout.grid_cols * cell, sheet_layout.grid_rows * cell
+    margin = 2 * cell if sheet_layout.markers else 0
+    page = np.full((height + 2 * margin, width + 2 * margin), PAPER, np.uint8)
+    centers = sheet_layout.centers(width, height) + margin
+    radius = int(cell * 0.35)
+
+    for q, mark in enumerate(marks):
+        for c in range(sheet_layout.choices):
+            cv2.circle(page, tuple(centers[q, c].tolist()), radius, INK, 2, cv2.LINE_AA)
+        if mark >= 0:
+            # Pencil marks never fill the ring exactly
+            fill = int(radius * rng.uniform(0.8, 1.0))
+            cv2.circle(page, tuple(centers[q, mark].tolist()), fill, INK, -1, cv2.LINE_AA)
+        if rng.random() < erased:
+            other = (mark + 1 + rng.integers(0, sheet_layout.choices - 1)) % sheet_layout.choices
+            cv2.circle(page, tuple(centers[q, other].tolist()), int(radius * 0.6), PAPER - 60, -1, cv2.LINE_AA)
+
+    grid = np.float32([[0, 0], [width, 0], [0, height], [width, height]]) + margin
+    if sheet_layout.markers:
+        draw_markers(page, sheet_layout, grid, cell)
+    return page, grid
+
+
+def draw_markers(page, sheet_layout, grid, cell):
+    """Print the layout's ArUco markers diagonally outside the grid corners"""
+    dictionary = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, sheet_layout.markers["dictionary"]))
+    offset = float(sheet_layout.markers.get("offset", 0)) * cell
+    size = int(cell * float(sheet_layout.markers.get("size", 0.8)))
+    directions = np.float32([[-1, -1], [1, -1], [-1, 1], [1, 1]])
+    for marker_id, corner, direction in zip(sheet_layout.markers["ids"], grid, directions):
+        x, y = (corner + direction * offset - size / 2).astype(int)
+        page[y:y + size, x:x + size] = cv2.aruco.generateImageMarker(dictionary, int(marker_id), size)
+
+
+def photograph(page, grid, rng, perspective=0.0, rotation=0.0, blur=0.0, gradient=0.0, noise=0.0, **_):
+    """
+    Place the page on a background as a phone photo would see it: random
+    perspective and rotation, lighting gradient, blur and sensor noise.
+    Returns the BGR photo and where the grid corners ended up.
+    """
+    h, w = page.shape
+    canvas_w, canvas_h = int(w * 1.5), int(h * 1.5)
+    src = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
+    dst = src + np.float32([(canvas_w - w) / 2, (canvas_h - h) / 2])
+    dst += rng.uniform(-perspective, perspective, (4, 2)).astype(np.float32) * np.float32([w, h])
+    center = dst.mean(axis=0)
+    turn = cv2.getRotationMatrix2D(tuple(center.tolist()), rng.uniform(-rotation, rotation), 1.0)
+    dst = cv2.transform(dst.reshape(-1, 1, 2), turn).reshape(4, 2)
+
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    background = int(rng.integers(40, 120))
+    photo = cv2.warpPerspective(page, matrix, (canvas_w, canvas_h), borderValue=background).astype(np.float32)
+    corners = cv2.perspectiveTransform(grid.reshape(-1, 1, 2), matrix).reshape(4, 2)
+
+    if gradient:
+        angle = rng.uniform(0, 2 * np.pi)
+        ys, xs = np.mgrid[0:canvas_h, 0:canvas_w].astype(np.float32)
+        ramp = xs / canvas_w * np.cos(angle) + ys / canvas_h * np.sin(angle)
+        ramp = (ramp - ramp.min()) / max(float(np.ptp(ramp)), 1e-6)
+        photo *= 1.0 - gradient * ramp
+    if blur:
+        sigma = rng.uniform(0, blur)
+        if sigma > 0.3:
+            photo = cv2.GaussianBlur(photo, (0, 0), sigma)
+    if noise:
+        photo += rng.normal(0, noise, photo.shape).astype(np.float32)
+    photo = np.clip(photo, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(photo, cv2.COLOR_GRAY2BGR), corners
+
+
+def make_corpus(out_dir, layout_name=None, count=50, preset="moderate", questions=None, seed=0, quality=90):
+    """
+    Write count synthetic photos to out_dir plus truth.jsonl describing each:
+    file, layout, marked answers (-1 = blank) and the true grid corners
+    """
+    sheet_layout = layout.load_layout(layout_name)
+    params = PRESETS[preset]
+    questions = questions or sheet_layout.questions
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "truth.jsonl"), "w") as truth:
+        for i in range(count):
+            marks = random_marks(sheet_layout, questions, rng, params["blank"])
+            page, grid = render_sheet(sheet_layout, marks, rng, erased=params["erased"])
+            photo, corners = photograph(page, grid, rng, **params)
+            name = f"sheet_{i:04d}.jpg"
+            cv2.imwrite(os.path.join(out_dir, name), photo, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            truth.write(json.dumps({
+                "file": name,
+                "layout": sheet_layout.name,
+                "preset": preset,
+                "answers": marks.tolist(),
+                "corners": np.round(corners.astype(float), 1).tolist(),
+            }) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render synthetic answer-sheet photos with known answers")
+    parser.add_argument("out_dir", help="directory to write the images and truth.jsonl to")
+    parser.add_argument("--layout", help="sheet layout name")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="moderate")
+    parser.add_argument("--questions", type=int, help="marked questions (defaults to the whole layout)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_corpus(args.out_dir, args.layout, args.count, args.preset, args.questions, args.seed)
+
+
+if __name__ == "__main__":
+    main()
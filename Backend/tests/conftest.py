@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import pytest
+
+# The backend modules are flat scripts run from Backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exams  # noqa: E402
+import layout  # noqa: E402
+import scan  # noqa: E402
+import synth  # noqa: E402
+
+# A synthetic photographed sheet: its compiled layout, the marked choice per
+# question, the photo at the layout's working size (BGR and gray), where the
+# grid corners landed in it, and the full-size photo as JPEG bytes
+SheetPhoto = namedtuple("SheetPhoto", "layout marks image gray corners jpeg")
+
+# Marker squares are printed this many page pixels per cell (synth's default)
+CELL = 48
+
+
+@pytest.fixture(scope="session")
+def sheet_photo():
+    """
+    Factory of synthetic sheet photos: sheet_photo(layout=None, seed=0,
+    preset="clean", erase=None, **params) renders and photographs a sheet
+    with synth.py. erase paints over the marker at that corner index;
+    params override the preset's photo parameters.
+    """
+
+    def make(layout_name=None, seed=0, preset="clean", erase=None, **params):
+        sheet_layout = layout.load_layout(layout_name)
+        rng = np.random.default_rng(seed)
+        marks = synth.random_marks(sheet_layout, sheet_layout.questions, rng)
+        page, grid = synth.render_sheet(sheet_layout, marks, rng)
+        if erase is not None:
+            size = int(CELL * sheet_layout.markers["size"])
+            direction = np.float32([[-1, -1], [1, -1], [-1, 1], [1, 1]])[erase]
+            x, y = (grid[erase] + direction * CELL * sheet_layout.markers["offset"] - size / 2).astype(int)
+            page[y - 4:y + size + 4, x - 4:x + size + 4] = synth.PAPER
+        photo, corners = synth.photograph(page, grid, rng, **dict(synth.PRESETS[preset], **params))
+        image = scan.resize_sheet(photo, sheet_layout)
+        corners = corners * (image.shape[1] / float(photo.shape[1]))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        jpeg = cv2.imencode(".jpg", photo)[1].tobytes()
+        return SheetPhoto(sheet_layout, marks, image, gray, corners, jpeg)
+
+    return make
+
+
+@pytest.fixture
+def exam_dir(tmp_path, monkeypatch):
+    """Empty exam registry; returns a function writing <id>.json like POST /exams"""
+    monkeypatch.setattr(exams, "EXAM_DIR", str(tmp_path))
+    monkeypatch.setattr(exams, "_compiled", {})
+
+    def write(exam_id, answers, layout=None):
+        spec = {"id": exam_id, "layout": layout, "questions": len(answers), "answers": list(answers)}
+        path = tmp_path / f"{exam_id}.json"
+        previous = path.stat().st_mtime_ns if path.exists() else None
+        path.write_text(json.dumps(spec))
+        if previous is not None:
+            # Recompiled only when the mtime moves, which a fast rewrite may not do
+            os.utime(path, ns=(previous + 10**9, previous + 10**9))
+        return exams.load_exam(exam_id)
+
+    return write
@@ -0,0 +1,54 @@
+"""
+Stand-in for worker.py in the pool tests: speaks the same frames without
+loading OpenCV. op "echo" answers with its header and counts as a cache
+miss in the counters sent with every response; op "die" closes stdin right
+after reading the header, while the pool is still writing the body, and
+exits; op "garble" answers with a header that isn't JSON.
+"""
+import json
+import os
+import struct
+import sys
+
+HEADER = struct.Struct(">I")
+
+
+def write_frame(header):
+    data = header if isinstance(header, bytes) else json.dumps(header).encode("utf-8")
+    sys.stdout.buffer.write(HEADER.pack(len(data)) + data)
+    sys.stdout.buffer.flush()
+
+
+def read_exact(n):
+    data = b""
+    while len(data) < n:
+        chunk = sys.stdin.buffer.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def main():
+    write_frame({"ready": True})
+    misses = 0
+    while True:
+        prefix = read_exact(HEADER.size)
+        if prefix is None:
+            return
+        header = json.loads(read_exact(HEADER.unpack(prefix)[0]))
+        if header.get("op") == "die":
+            os.close(0)
+            sys.exit(3)
+        if header.get("size"):
+            read_exact(header["size"])
+        if header.get("op") == "garble":
+            write_frame(b'{"id": ' + str(header["id"]).encode() + b", result")
+            continue
+        misses += 1
+        cache = {"entries": 0, "hits": 0, "disk_hits": 0, "misses": misses}
+        write_frame({"id": header["id"], "result": {"echo": header.get("op")}, "cache": cache})
+
+
+if __name__ == "__main__":
+    main()
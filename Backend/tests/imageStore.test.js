@@ -0,0 +1,81 @@
+const assert = require("assert");
+const fs = require("fs");
+const os = require("os");
+const path = require("path");
+const test = require("node:test");
+
+const { ImageStore } = require("../imageStore");
+
+function response() {
+  return {
+    headers: {},
+    set(name, value) {
+      this.headers[name] = value;
+    },
+    status(code) {
+      this.code = code;
+      return this;
+    },
+    type() {
+      return this;
+    },
+    json(body) {
+      this.body = body;
+    },
+    send(body) {
+      this.body = body;
+    },
+    end() {},
+  };
+}
+
+test("images outlive the store and the least recently used go first", async () => {
+  const dir = fs.mkdtempSync(path.join(os.tmpdir(), "images-"));
+  const store = new ImageStore(dir, 10);
+  const a = store.put(Buffer.from("aaaa"));
+  const b = store.put(Buffer.from("bbbb"));
+  assert.strictEqual(store.put(Buffer.from("aaaa")), a);
+  await store.flush();
+
+  const reopened = new ImageStore(dir, 10);
+  assert.ok(reopened.has(a) && reopened.has(b));
+  // a was read last, so b is evicted to make room
+  reopened.has(a);
+  const c = reopened.put(Buffer.from("cccc"));
+  assert.ok(reopened.has(a) && reopened.has(c));
+  assert.ok(!reopened.has(b));
+  await reopened.flush();
+  assert.deepStrictEqual(fs.readdirSync(dir).sort(), [`${a}.jpg`, `${c}.jpg`].sort());
+});
+
+test("a new image is served from memory before its file is written", async () => {
+  const dir = fs.mkdtempSync(path.join(os.tmpdir(), "images-"));
+  const store = new ImageStore(dir);
+  const id = store.put(Buffer.from("pending"));
+  assert.deepStrictEqual(fs.readdirSync(dir).filter((name) => !name.endsWith(".tmp")), []);
+
+  const res = response();
+  store.send({ headers: {} }, res, id);
+  assert.strictEqual(res.body.toString(), "pending");
+  assert.strictEqual(res.headers.ETag, `"${id}"`);
+
+  await store.flush();
+  assert.deepStrictEqual(fs.readdirSync(dir), [`${id}.jpg`]);
+  assert.ok(!store.images.get(id).buffer);
+});
+
+test("an image evicted while it is being written leaves no file", async () => {
+  const dir = fs.mkdtempSync(path.join(os.tmpdir(), "images-"));
+  const store = new ImageStore(dir, 4);
+  store.put(Buffer.from("aaaa"));
+  const b = store.put(Buffer.from("bbbb"));
+  await store.flush();
+  assert.deepStrictEqual(fs.readdirSync(dir), [`${b}.jpg`]);
+});
+
+test("ids that are not image hashes are never looked up on disk", () => {
+  const store = new ImageStore(fs.mkdtempSync(path.join(os.tmpdir(), "images-")));
+  const res = response();
+  store.send({ headers: {} }, res, "../jobs/x");
+  assert.strictEqual(res.code, 404);
+});
@@ -0,0 +1,71 @@
+const assert = require("assert");
+const fs = require("fs");
+const os = require("os");
+const path = require("path");
+const test = require("node:test");
+
+const { JobQueue } = require("../jobQueue");
+
+function tempDir() {
+  return fs.mkdtempSync(path.join(os.tmpdir(), "jobs-"));
+}
+
+function finished(queue, id) {
+  return new Promise((resolve) => {
+    const onUpdate = (job) => {
+      if (job.id !== id || job.status === "queued" || job.status === "running") return;
+      queue.off("update", onUpdate);
+      resolve(job);
+    };
+    queue.on("update", onUpdate);
+  });
+}
+
+test("a job turned away by a full pool is requeued, not failed", async () => {
+  let calls = 0;
+  const queue = new JobQueue(
+    async (header, image) => {
+      if (++calls === 1) {
+        const error = new Error("Worker queue is full");
+        error.code = "QUEUE_FULL";
+        error.retryAfter = 0.05;
+        throw error;
+      }
+      return { score: image.length, exam: header.exam };
+    },
+    { dir: tempDir(), concurrency: 1 }
+  );
+  const job = queue.submit({ exam: "e1" }, Buffer.from("abcd"));
+  const done = await finished(queue, job.id);
+  assert.strictEqual(done.status, "done");
+  assert.deepStrictEqual(done.result, { score: 4, exam: "e1" });
+  assert.strictEqual(calls, 2);
+  queue.close();
+});
+
+test("queued and interrupted jobs survive a restart", async () => {
+  const dir = tempDir();
+  const first = new JobQueue(() => new Promise(() => {}), { dir, concurrency: 1 });
+  const running = first.submit({ exam: "a" }, Buffer.from("1"));
+  const queued = first.submit({ exam: "b" }, Buffer.from("22"));
+  assert.strictEqual(first.get(running.id).status, "running");
+  assert.strictEqual(first.get(queued.id).position, 1);
+  first.close();
+
+  const seen = [];
+  const second = new JobQueue(
+    async (header, image) => {
+      seen.push(header.exam);
+      return { size: image.length };
+    },
+    { dir, concurrency: 1 }
+  );
+  const results = await Promise.all([
+    finished(second, running.id),
+    finished(second, queued.id),
+  ]);
+  assert.deepStrictEqual(seen, ["a", "b"]);
+  assert.deepStrictEqual(results.map((job) => job.result.size), [1, 2]);
+  assert.ok(!fs.readdirSync(dir).some((name) => name.endsWith(".bin")));
+  second.close();
+});
@@ -0,0 +1,80 @@
+const assert = require("assert");
+const test = require("node:test");
+
+const { Registry } = require("../metrics");
+
+test("histograms expose cumulative buckets, +Inf, sum and count per series", () => {
+  const registry = new Registry();
+  const latency = registry.histogram(
+    "grade_seconds",
+    "Grading time",
+    ["route"],
+    [0.1, 1]
+  );
+  latency.observe({ route: "/grade" }, 0.05);
+  latency.observe({ route: "/grade" }, 0.5);
+  latency.observe({ route: "/grade" }, 5);
+  latency.observe({ route: "/regrade" }, 1);
+  assert.strictEqual(
+    registry.render(),
+    [
+      "# HELP grade_seconds Grading time",
+      "# TYPE grade_seconds histogram",
+      'grade_seconds_bucket{route="/grade",le="0.1"} 1',
+      'grade_seconds_bucket{route="/grade",le="1"} 2',
+      'grade_seconds_bucket{route="/grade",le="+Inf"} 3',
+      'grade_seconds_sum{route="/grade"} 5.55',
+      'grade_seconds_count{route="/grade"} 3',
+      'grade_seconds_bucket{route="/regrade",le="0.1"} 0',
+      'grade_seconds_bucket{route="/regrade",le="1"} 1',
+      'grade_seconds_bucket{route="/regrade",le="+Inf"} 1',
+      'grade_seconds_sum{route="/regrade"} 1',
+      'grade_seconds_count{route="/regrade"} 1',
+      "",
+    ].join("\n")
+  );
+});
+
+test("label values and help text are escaped", () => {
+  const registry = new Registry();
+  const errors = registry.counter(
+    "errors_total",
+    "Errors by message\nand C:\\path",
+    ["message"]
+  );
+  errors.inc({ message: 'bad "key"\nat C:\\x' });
+  errors.inc({ message: 'bad "key"\nat C:\\x' }, 2);
+  assert.strictEqual(
+    registry.render(),
+    [
+      "# HELP errors_total Errors by message\\nand C:\\\\path",
+      "# TYPE errors_total counter",
+      'errors_total{message="bad \\"key\\"\\nat C:\\\\x"} 3',
+      "",
+    ].join("\n")
+  );
+});
+
+test("metrics without labels and gauges read at scrape time", () => {
+  const registry = new Registry();
+  let depth = 3;
+  registry.counter("jobs_total", "Jobs").inc();
+  registry.gauge("queue_depth", "Queued jobs", () => depth);
+  registry.gauge("broken", "Not a number", () => undefined);
+  depth = 7;
+  assert.strictEqual(
+    registry.render(),
+    [
+      "# HELP jobs_total Jobs",
+      "# TYPE jobs_total counter",
+      "jobs_total 1",
+      "# HELP queue_depth Queued jobs",
+      "# TYPE queue_depth gauge",
+      "queue_depth 7",
+      "# HELP broken Not a number",
+      "# TYPE broken gauge",
+      "broken 0",
+      "",
+    ].join("\n")
+  );
+});
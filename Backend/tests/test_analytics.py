@@ -0,0 +1,127 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import analytics
+import exams
+import scan
+from analytics import ItemStats
+
+
+def sheets(n=200, questions=12, choices=4, seed=0):
+    """Graded sheets where abler students answer more questions right"""
+    rng = np.random.default_rng(seed)
+    ability = rng.normal(size=(n, 1))
+    difficulty = np.linspace(-1.5, 1.5, questions)
+    grading = (ability - difficulty + rng.normal(size=(n, questions)) > 0).astype(np.int64)
+    key = rng.integers(0, choices, questions)
+    wrong = (key + rng.integers(1, choices, (n, questions))) % choices
+    picks = np.where(grading == 1, key, wrong)
+    return grading, picks, key
+
+
+def test_kr20_and_point_biserial_match_direct_formulas():
+    grading, picks, key = sheets()
+    summary = ItemStats(grading.shape[1], 4)
+    summary.add(grading, picks)
+    summary = summary.summary(key)
+
+    k = grading.shape[1]
+    totals = grading.sum(axis=1)
+    p = grading.mean(axis=0)
+    kr20 = k / (k - 1) * (1 - (p * (1 - p)).sum() / totals.var())
+    assert summary["reliability"] == pytest.approx(kr20, abs=1e-4)
+    assert summary["mean"] == pytest.approx(totals.mean(), abs=1e-4)
+
+    for i, item in enumerate(summary["items"]):
+        rest = totals - grading[:, i]
+        expected = np.corrcoef(grading[:, i], rest)[0, 1]
+        assert item["difficulty"] == pytest.approx(p[i], abs=1e-4)
+        assert item["discrimination"] == pytest.approx(expected, abs=1e-4)
+        assert item["choices"][key[i]] == grading[:, i].sum()
+
+
+def test_batches_single_sheets_and_merges_agree():
+    grading, picks, key = sheets(n=60)
+    batch = ItemStats(grading.shape[1], 4)
+    batch.add(grading, picks)
+    one_by_one = ItemStats(grading.shape[1], 4)
+    for row, pick in zip(grading, picks):
+        one_by_one.add(row, pick)
+    halves = ItemStats(grading.shape[1], 4)
+    halves.add(grading[:25], picks[:25])
+    rest = ItemStats(grading.shape[1], 4)
+    rest.add(grading[25:], picks[25:])
+    halves.merge(rest)
+    restored = ItemStats.from_state(batch.state())
+
+    expected = batch.summary(key)
+    for stats in (one_by_one, halves, restored):
+        assert stats.summary(key) == expected
+
+
+def test_item_everyone_gets_right_has_no_discrimination():
+    grading, picks, key = sheets(n=50)
+    grading[:, 0] = 1
+    picks[:, 0] = key[0]
+    stats = ItemStats(grading.shape[1], 4)
+    stats.add(grading, picks)
+    item = stats.summary(key)["items"][0]
+    assert item["discrimination"] is None
+    assert item["flags"] == ["easy"]
+
+
+def measurement(picks, choices=5):
+    """Stored measurement of a sheet with one clear mark per question"""
+    fill = np.full((len(picks), choices), 0.05, np.float32)
+    fill[np.arange(len(picks)), picks] = 0.9
+    return {
+        "fill": fill,
+        "escalated": np.zeros(0, np.int64),
+        "corners": np.float32([[0, 0], [10, 0], [0, 10], [10, 10]]),
+        "registration": "contour",
+        "quality": None,
+    }
+
+
+def submit_sheet(exam_id, submission, picks, barrier=None):
+    exam = exams.load_exam(exam_id)
+    measured = measurement(picks)
+    result = scan.grade_measurement(measured, exam.questions, exam.key, exam.layout)
+    if barrier is not None:
+        barrier.wait()
+    analytics.submit(exam, submission, result, measured)
+
+
+def test_sheet_graded_by_two_workers_at_once_counts_once(exam_dir):
+    exam = exam_dir("quiz", [0, 1, 2, 3])
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(4)
+    workers = [
+        context.Process(target=submit_sheet, args=("quiz", "same-photo", [0, 1, 2, 0], barrier))
+        for _ in range(4)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(30)
+        assert process.exitcode == 0
+    submit_sheet("quiz", "other-photo", [0, 1, 0, 0])
+
+    summary = analytics.exam_summary(exam)
+    assert summary["sheets"] == 2
+    assert [item["difficulty"] for item in summary["items"]] == [1.0, 1.0, 0.5, 0.0]
+
+
+def test_regrade_rebuilds_stats_for_the_new_key(exam_dir):
+    exam_dir("quiz", [0, 1, 2, 3])
+    submit_sheet("quiz", "a", [0, 1, 2, 0])
+    submit_sheet("quiz", "b", [0, 1, 0, 0])
+    exam = exam_dir("quiz", [0, 1, 0, 0])
+
+    results = {result["submission"]: result["score"] for result in analytics.regrade(exam)}
+    assert results == {"a": 3, "b": 4}
+    summary = analytics.exam_summary(exam)
+    assert summary["sheets"] == 2
+    assert [item["difficulty"] for item in summary["items"]] == [1.0, 1.0, 0.5, 1.0]
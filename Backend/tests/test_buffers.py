@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import scan
+from buffers import Buffers, scratch
+
+
+def test_same_shape_and_dtype_reuses_the_array():
+    buffers = Buffers()
+    first = buffers.get("gray", (4, 6))
+    assert buffers.get("gray", [4, 6]) is first
+    assert buffers.get("gray", np.array([4, 6])) is first
+    assert buffers.stats() == {"buffers": 1, "bytes": 24, "allocations": 1}
+
+
+@pytest.mark.parametrize("shape, dtype", [((6, 4), np.uint8), ((4, 6), np.float32), ((4, 6, 3), np.uint8)])
+def test_shape_or_dtype_change_reallocates(shape, dtype):
+    buffers = Buffers()
+    first = buffers.get("gray", (4, 6))
+    second = buffers.get("gray", shape, dtype)
+    assert second is not first
+    assert second.shape == shape and second.dtype == dtype
+    assert buffers.get("gray", shape, dtype) is second
+    assert buffers.stats()["allocations"] == 2
+
+
+def test_names_are_separate_and_zeros_clears():
+    buffers = Buffers()
+    a = buffers.get("a", (3, 3))
+    a.fill(7)
+    assert buffers.get("b", (3, 3)) is not a
+    assert buffers.zeros("a", (3, 3)) is a
+    assert not a.any()
+
+
+@pytest.mark.parametrize("mode", ["sample", "warp"])
+def test_held_measurements_survive_the_next_sheet(sheet_photo, mode):
+    # Every measurement is cached and graded after later sheets have reused
+    # the scratch buffers, so nothing it holds may be one of them
+    first = scan.measure_sheet(sheet_photo(seed=0).image, mode=mode)
+    kept = {name: np.copy(value) for name, value in first.items() if isinstance(value, np.ndarray)}
+    held = list(scratch.arrays.values())
+
+    second = scan.measure_sheet(sheet_photo(seed=1).image, mode=mode)
+    assert not np.array_equal(first["fill"], second["fill"])
+    for name, value in kept.items():
+        np.testing.assert_array_equal(first[name], value)
+        assert not any(np.shares_memory(first[name], array) for array in held)
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from cache import MeasurementCache, content_key
+
+
+def measurement(value):
+    return {
+        "fill": np.full((3, 4), value, np.float32),
+        "escalated": np.array([1], np.int64),
+        "corners": np.zeros((4, 2), np.float32),
+        "registration": "contour",
+        "quality": {"sharpness": 120.0},
+    }
+
+
+def test_key_covers_bytes_and_every_part():
+    key = content_key(b"photo", "standard", "sample", True)
+    assert key == content_key(b"photo", "standard", "sample", True)
+    assert key != content_key(b"photo!", "standard", "sample", True)
+    assert key != content_key(b"photo", "standard-markers", "sample", True)
+    assert key != content_key(b"photo", "standard", "warp", True)
+    assert key != content_key(b"photo", "standard", "sample", False)
+    assert key != content_key(b"photo", "standard", "sample", True, "desk", 1)
+    # Parts are separated, so they cannot run into each other
+    assert content_key(b"", "ab", "c") != content_key(b"", "a", "bc")
+
+
+def test_memory_lru():
+    cache = MeasurementCache(max_entries=2)
+    cache.put("a", measurement(0.1))
+    cache.put("b", measurement(0.2))
+    assert cache.get("a") is not None
+    cache.put("c", measurement(0.3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats() == {"entries": 2, "hits": 3, "disk_hits": 0, "misses": 1}
+
+
+def test_disk_entries_are_shared_and_trimmed_by_last_use(tmp_path):
+    writer = MeasurementCache(directory=str(tmp_path), max_disk_entries=2)
+    for i, key in enumerate("abc"):
+        writer.put(key, measurement(i / 10))
+        os.utime(tmp_path / f"{key}.npz", (i, i))
+
+    reader = MeasurementCache(directory=str(tmp_path), max_disk_entries=2)
+    entry = reader.get("a")
+    assert np.allclose(entry["fill"], 0.0) and entry["quality"] == {"sharpness": 120.0}
+    assert reader.stats()["disk_hits"] == 1
+
+    # "a" is the oldest file but was just read, so "b" goes
+    reader.trim()
+    assert sorted(os.listdir(tmp_path)) == ["a.npz", "c.npz"]
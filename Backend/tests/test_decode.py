@@ -0,0 +1,109 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+import decode
+
+WIDTH, HEIGHT = 64, 40
+
+
+def exif(orientation, endian=">", ifd=8):
+    """APP1 Exif payload holding one Orientation entry, its IFD at offset 8"""
+    order = b"MM" if endian == ">" else b"II"
+    tiff = order + struct.pack(endian + "HI", 42, ifd)
+    entry = struct.pack(endian + "HHIH", 0x0112, 3, 1, orientation) + b"\x00\x00"
+    tiff += struct.pack(endian + "H", 1) + entry + b"\x00" * 4
+    return b"Exif\x00\x00" + tiff
+
+
+def app1(payload):
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def jpeg(segment=b""):
+    """A small JPEG with an optional segment inserted right after SOI"""
+    img = np.zeros((HEIGHT, WIDTH), np.uint8)
+    img[:, : WIDTH // 4] = 255  # a bright band on the left edge
+    data = cv2.imencode(".jpg", img)[1].tobytes()
+    return data[:2] + segment + data[2:]
+
+
+@pytest.mark.parametrize("endian", [">", "<"])
+@pytest.mark.parametrize("orientation", [1, 3, 6, 8])
+def test_exif_orientation_in_either_byte_order(orientation, endian):
+    assert decode._exif_orientation(exif(orientation, endian)) == orientation
+    assert decode.image_info(jpeg(app1(exif(orientation, endian)))) == (WIDTH, HEIGHT, orientation)
+
+
+@pytest.mark.parametrize(
+    "segment",
+    [
+        b"",
+        b"Exif\x00\x00",
+        b"Exif\x00\x00MM\x00*",  # TIFF header cut short
+        b"Exif\x00\x00XX\x00*\x00\x00\x00\x08",  # unknown byte order
+        b"JFIF\x00" + exif(6)[6:],  # not an Exif segment
+        exif(6, ifd=4096),  # IFD offset past the end
+        exif(6)[:-12],  # entry truncated
+        exif(42),  # out of range value
+    ],
+    ids=[
+        "empty", "no tiff", "short tiff", "byte order", "not exif", "ifd offset", "short entry", "bad value",
+    ],
+)
+def test_malformed_exif_falls_back_to_upright(segment):
+    assert decode._exif_orientation(segment) == 1
+
+
+def test_png_header():
+    data = cv2.imencode(".png", np.zeros((HEIGHT, WIDTH), np.uint8))[1].tobytes()
+    assert decode.image_info(data) == (WIDTH, HEIGHT, 1)
+    assert decode.image_info(data[:20]) is None
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"GIF89a" + b"\x00" * 32,
+        b"\xff\xd8",
+        b"\xff\xd8\xff\xe1\x00",  # segment length cut off
+        b"\xff\xd8\x00\x00\x00\x00",  # not a marker
+        b"\xff\xd8\xff\xc0\x00\x04\x08",  # SOF too short to hold the size
+        b"\xff\xd8\xff\xda\x00\x02",  # scan before any frame header
+    ],
+    ids=["empty", "gif", "soi only", "short length", "not a marker", "short sof", "scan first"],
+)
+def test_malformed_headers_return_none(data):
+    assert decode.image_info(data) is None
+
+
+def test_truncated_jpeg_body_still_reads_the_header():
+    data = jpeg(app1(exif(6)))
+    sof = data.index(b"\xff\xc0")
+    assert decode.image_info(data[: sof + 9]) == (WIDTH, HEIGHT, 6)
+    assert decode.image_info(data[: sof + 4]) is None
+
+
+def test_corrupt_exif_does_not_stop_decoding():
+    data = jpeg(app1(exif(6, ifd=4096)))
+    assert decode.image_info(data) == (WIDTH, HEIGHT, 1)
+    assert decode.decode(data, gray=True).shape == (HEIGHT, WIDTH)
+
+
+@pytest.mark.parametrize(
+    "orientation, shape, bright",
+    [
+        (1, (HEIGHT, WIDTH), "left"),
+        (3, (HEIGHT, WIDTH), "right"),
+        (6, (WIDTH, HEIGHT), "top"),
+        (8, (WIDTH, HEIGHT), "bottom"),
+    ],
+)
+def test_decode_turns_the_image_upright(orientation, shape, bright):
+    img = decode.decode(jpeg(app1(exif(orientation))), gray=True)
+    assert img.shape == shape
+    edges = {"left": img[:, 0], "right": img[:, -1], "top": img[0], "bottom": img[-1]}
+    assert max(edges, key=lambda edge: edges[edge].mean()) == bright
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import scan
+import worker
+from cache import MeasurementCache
+
+QUESTIONS = 20
+
+
+@pytest.fixture
+def graded(exam_dir, sheet_photo, monkeypatch):
+    """Three sheets graded for an exam keyed to the first sheet's marks"""
+    monkeypatch.setattr(worker, "measurements", MeasurementCache(16))
+    sheets = [sheet_photo(seed=seed) for seed in range(3)]
+    exam_dir("midterm", sheets[0].marks[:QUESTIONS].tolist())
+    results = [worker.handle_grade({"exam": "midterm", "render": False}, sheet.jpeg) for sheet in sheets]
+    return sheets, results
+
+
+def expected_score(sheet, key):
+    return int(np.count_nonzero(sheet.marks[:QUESTIONS] == np.asarray(key)))
+
+
+def test_key_correction_regrades_from_stored_fills(graded, exam_dir, monkeypatch):
+    sheets, results = graded
+    assert [result["score"] for result in results] == [
+        expected_score(sheet, sheets[0].marks[:QUESTIONS]) for sheet in sheets
+    ]
+    assert results[0]["score"] == QUESTIONS
+
+    key = sheets[1].marks[:QUESTIONS].tolist()
+    exam_dir("midterm", key)
+
+    def no_images(*args, **kwargs):
+        raise AssertionError("regrade must not touch the images")
+
+    monkeypatch.setattr(scan, "decode_image", no_images)
+    monkeypatch.setattr(scan, "measure_sheet", no_images)
+    regraded = worker.handle_regrade({"exam": "midterm"}, b"")
+    scores = {result["submission"]: result["score"] for result in regraded["results"]}
+    assert scores == {
+        result["submission"]: expected_score(sheet, key) for sheet, result in zip(sheets, results)
+    }
+    assert scores[results[1]["submission"]] == QUESTIONS
+
+    summary = worker.handle_analytics({"exam": "midterm"}, b"")
+    assert summary["sheets"] == 3
+    assert [item["key"] for item in summary["items"]] == key
+
+
+def test_regrading_the_same_photo_keeps_one_submission(graded, sheet_photo):
+    sheets, results = graded
+    again = worker.handle_grade({"exam": "midterm", "render": False}, sheets[2].jpeg)
+    assert again["submission"] == results[2]["submission"]
+    assert worker.handle_analytics({"exam": "midterm"}, b"")["sheets"] == 3
+
+
+def test_submissions_are_never_trimmed(tmp_path):
+    store = MeasurementCache(0, str(tmp_path), None)
+    measured = {
+        "fill": np.zeros((2, 5), np.float32),
+        "escalated": np.zeros(0, np.int64),
+        "corners": np.zeros((4, 2), np.float32),
+        "registration": "contour",
+        "quality": None,
+    }
+    for i in range(130):
+        store.put(f"sheet{i}", measured)
+    store.trim()
+    assert len(list(store.items())) == 130
@@ -0,0 +1,80 @@
+import copy
+
+import numpy as np
+import pytest
+
+import batch
+import layout
+
+SPEC = {
+    "name": "test-6x10",
+    "grid": {"rows": 6, "cols": 10},
+    "choices": 4,
+    "questions": 10,
+    "blocks": [{"row": 1, "col": 0, "rows": 5}, {"row": 1, "col": 5, "rows": 5}],
+}
+
+
+def with_changes(**changes):
+    spec = copy.deepcopy(SPEC)
+    spec.update(changes)
+    return spec
+
+
+def test_non_default_grid_compiles_to_index_tables():
+    sheet = layout.Layout(SPEC)
+    assert sheet.warp_size == (10 * layout.DEFAULT_CELL_PX, 6 * layout.DEFAULT_CELL_PX)
+    assert sheet.rows.tolist() == [1, 2, 3, 4, 5] * 2
+    assert sheet.cols.tolist() == [0] * 5 + [5] * 5
+    assert sheet.cell_index[6].tolist() == [2 * 10 + 5, 2 * 10 + 6, 2 * 10 + 7, 2 * 10 + 8]
+    assert not sheet.cell_index.flags.writeable
+
+    centers = sheet.centers(200, 120)
+    assert centers.shape == (10, 4, 2)
+    assert centers[6, 1].tolist() == [130, 50]
+
+    points = sheet.sample_points(2)
+    assert points.shape == (20, 8, 2)
+    # The 2x2 block of question 6, choice 1 falls inside its grid cell
+    cell_w, cell_h = sheet.cell_size(*sheet.warp_size)
+    block = points[12:14, 2:4].reshape(-1, 2)
+    assert np.all(block[:, 0] // cell_w == 6) and np.all(block[:, 1] // cell_h == 2)
+
+
+@pytest.mark.parametrize(
+    "spec, message",
+    [
+        (with_changes(questions=11), "blocks hold 10 questions, need 11"),
+        (with_changes(grid={"rows": 5, "cols": 10}), "outside the 5x10 grid"),
+        (with_changes(choices=6), "outside the 6x10 grid"),
+        (with_changes(markers={"dictionary": "DICT_4X4_50", "ids": [0, 1, 2]}), "four ids"),
+    ],
+)
+def test_malformed_specs_are_rejected(spec, message):
+    with pytest.raises(ValueError, match=message):
+        layout.Layout(spec)
+
+
+@pytest.mark.parametrize("name", ["missing-layout", "../layouts/standard"])
+def test_unknown_or_unsafe_names_are_rejected(name):
+    with pytest.raises(ValueError):
+        layout.load_layout(name)
+
+
+def test_shipped_layouts_compile():
+    for name in ("standard", "standard-markers", "compact-40x6", "wide-120x4"):
+        sheet = layout.load_layout(name)
+        assert sheet.name == name
+        assert sheet.cell_index.max() < sheet.grid_rows * sheet.grid_cols
+
+
+def test_batch_grades_with_the_given_layout(sheet_photo, tmp_path):
+    sheet = sheet_photo("compact-40x6")
+    path = tmp_path / "sheet.jpg"
+    path.write_bytes(sheet.jpeg)
+    key = sheet.marks.tolist()
+
+    batch.init_worker()
+    result = batch.grade_path(str(path), len(key), key, False, layout_name="compact-40x6")
+    assert result["score"] == len(key)
+    assert "error" in batch.grade_path(str(path), len(key), key, False, layout_name="missing-layout")
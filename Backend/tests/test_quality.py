@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+
+import quality
+import scan
+
+
+@pytest.fixture(scope="module")
+def photo(sheet_photo):
+    """Grayscale photo of a usable sheet at the working size"""
+    return sheet_photo(preset="moderate").gray
+
+
+def glare(gray):
+    spot = gray.copy()
+    height, width = spot.shape
+    cv2.circle(spot, (width // 2, height // 2), height // 4, 255, -1)
+    return spot
+
+
+SPOILED = {
+    "too_dark": lambda gray: (gray * 0.2).astype(np.uint8),
+    "too_bright": lambda gray: (gray * 0.2 + 210).astype(np.uint8),
+    "low_contrast": lambda gray: (gray * 0.12 + 100).astype(np.uint8),
+    "glare": glare,
+    "blurry": lambda gray: cv2.GaussianBlur(gray, (0, 0), 16),
+}
+
+
+def test_usable_photo_passes(photo):
+    reason, metrics = quality.check(photo)
+    assert reason is None, metrics
+    assert scan.check_quality(photo) == metrics
+
+
+@pytest.mark.parametrize("reason", sorted(SPOILED))
+def test_unusable_photo_is_rejected(photo, reason):
+    assert quality.check(SPOILED[reason](photo))[0] == reason
+    with pytest.raises(scan.ScanError) as raised:
+        scan.check_quality(SPOILED[reason](photo))
+    assert scan.error_result(raised.value) == {"error": quality.REASONS[reason], "reason": reason}
@@ -0,0 +1,48 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import layout
+import registration
+
+# Strong perspective, nothing else: filling a missing marker in as the
+# fourth corner of a parallelogram is 25-80 px off on these sheets
+PERSPECTIVE = 0.08
+
+# Seeds whose four markers are all decoded when none is erased
+SEEDS = (0, 2, 7)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_markers_register_sheet(sheet_photo, seed):
+    sheet = sheet_photo("standard-markers", seed, perspective=PERSPECTIVE)
+    corners, method = registration.register(sheet.gray, sheet.layout)
+    assert method == "markers"
+    assert np.abs(corners - sheet.corners).max() < 2
+
+
+@pytest.mark.parametrize("erase", range(4))
+@pytest.mark.parametrize("seed", SEEDS)
+def test_missing_marker_recovered(sheet_photo, seed, erase):
+    sheet = sheet_photo("standard-markers", seed, erase=erase, perspective=PERSPECTIVE)
+    centers = registration.detect_markers(sheet.gray, sheet.layout)
+    assert centers is not None
+    corners = registration.markers_to_corners(centers, sheet.layout)
+    assert np.abs(corners - sheet.corners).max() < 4
+
+
+def test_missing_marker_needs_size(sheet_photo):
+    sheet = sheet_photo("standard-markers", erase=1, perspective=PERSPECTIVE)
+    with open(os.path.join(layout.LAYOUT_DIR, "standard-markers.json")) as f:
+        spec = json.load(f)
+    del spec["markers"]["size"]
+    assert registration.detect_markers(sheet.gray, layout.Layout(spec)) is None
+
+
+def test_orientation():
+    square = np.float32([[0, 0], [10, 0], [0, 10], [10, 10]])
+    assert registration.sheet_orientation(square) == 0
+    assert registration.sheet_orientation(square[[1, 3, 0, 2]]) == 90
+    assert registration.sheet_orientation(square[[3, 2, 1, 0]]) == 180
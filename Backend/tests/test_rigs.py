@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+import rigs
+import scan
+import worker
+
+
+@pytest.fixture
+def rig_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rigs, "RIG_DIR", str(tmp_path))
+    monkeypatch.setattr(rigs, "_loaded", {})
+    return tmp_path
+
+
+def test_rig_reloads_after_recalibration(rig_dir, sheet_photo):
+    sheet = sheet_photo()
+    gray = scan.decode_image(sheet.jpeg, sheet.layout, gray=True)
+    rigs.calibrate("desk", gray, sheet.layout)
+
+    rig = rigs.load_rig("desk")
+    assert rigs.load_rig("desk") is rig
+    assert rig.version == os.stat(rig_dir / "desk.npz").st_mtime_ns
+    corners, method = rig.locate(gray)
+    assert method == "calibrated"
+    assert np.allclose(corners, rig.corners)
+
+    stat = os.stat(rig_dir / "desk.npz")
+    os.utime(rig_dir / "desk.npz", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert rigs.load_rig("desk").version == rig.version + 10**9
+
+
+def test_rig_is_part_of_the_cache_key(rig_dir, sheet_photo, monkeypatch):
+    monkeypatch.setattr(worker, "measurements", worker.MeasurementCache(16))
+    sheet = sheet_photo()
+    body, marks = sheet.jpeg, sheet.marks
+    rigs.calibrate("desk", scan.decode_image(body, sheet.layout, gray=True), sheet.layout)
+    header = {"questions": len(marks), "answers": marks.tolist(), "render": False}
+
+    plain = worker.grade_request(header, body, worker.NO_TRACE)
+    on_rig = worker.grade_request(dict(header, rig="desk"), body, worker.NO_TRACE)
+    assert plain["registration"] == "contour"
+    assert on_rig["registration"] == "calibrated"
+    assert on_rig["score"] == plain["score"] == len(marks)
+    assert len(worker.measurements.entries) == 2
+
+    # Recalibrating the rig must not reuse its old measurement
+    stat = os.stat(rig_dir / "desk.npz")
+    os.utime(rig_dir / "desk.npz", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    worker.grade_request(dict(header, rig="desk"), body, worker.NO_TRACE)
+    assert len(worker.measurements.entries) == 3
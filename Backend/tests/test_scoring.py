@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import pytest
+
+import scoring
+from layout import Layout
+
+CELL = 20
+# Two blocks of six questions, so question 0 sits on the first grid row and
+# questions 5 and 11 on the last
+SPEC = {
+    "name": "test-6x10",
+    "grid": {"rows": 6, "cols": 10},
+    "choices": 4,
+    "questions": 12,
+    "cell_px": CELL,
+    "blocks": [{"row": 0, "col": 0, "rows": 6}, {"row": 0, "col": 5, "rows": 6}],
+}
+PICKS = [1, 0, 3, 2, 1, 0, 2, 3, 0, 1, 2, 3]
+DOUBLE = 0  # also marked at choice 3
+BLANK = 11
+SHADED = (9, 10)  # marked questions under the shadow, over the blank
+
+
+@pytest.fixture(scope="module")
+def layout():
+    return Layout(SPEC)
+
+
+def draw_sheet(layout):
+    """Warped sheet with PICKS marked, one double mark, one blank and a shadow"""
+    width, height = layout.warp_size
+    # A soft shadow over the second block's rows 3-5, light enough that a
+    # local threshold still tells its paper from its marks but Otsu does not
+    gray = np.full((height, width), 255, np.float32)
+    gray[3 * CELL:, 4 * CELL + CELL // 2:] = 150
+    gray = cv2.GaussianBlur(gray, (0, 0), 6).astype(np.uint8)
+    marks = [(q, c) for q, c in enumerate(PICKS) if q != BLANK] + [(DOUBLE, 3)]
+    for q, c in marks:
+        row, col = layout.rows[q], layout.cols[q] + c
+        gray[row * CELL + 4:(row + 1) * CELL - 4, col * CELL + 4:(col + 1) * CELL - 4] = 40
+    return gray
+
+
+def test_mark_flags():
+    fill = np.array(
+        [
+            [0.05, 0.7, 0.06, 0.04],  # clean mark
+            [0.05, 0.08, 0.06, 0.04],  # blank
+            [0.05, 0.7, 0.6, 0.04],  # double mark
+            [0.5, 0.52, 0.51, 0.5],  # evenly shaded, nothing stands out
+            [0.05, 0.7, 0.3, 0.04],  # erasure well below the mark
+        ]
+    )
+    blank, multi = scoring.mark_flags(fill)
+    assert blank.tolist() == [False, True, False, True, False]
+    assert multi.tolist() == [False, False, True, False, False]
+    assert scoring.margins(fill)[0] == pytest.approx(0.64)
+
+
+@pytest.mark.parametrize("first_row, last_row", [(0, 0), (0, 2), (2, 3), (5, 5), (0, 5)])
+def test_band_matches_a_full_frame_threshold(layout, first_row, last_row):
+    gray = draw_sheet(layout)
+    block_size, c = 41, 20
+    full = cv2.adaptiveThreshold(gray, 1, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c)
+    expected = scoring.cell_fill(full, layout.grid_rows, layout.grid_cols, ones=True)[first_row:last_row + 1]
+    band = scoring.adaptive_band_cells(gray, layout.grid_rows, layout.grid_cols, first_row, last_row, block_size, c)
+    np.testing.assert_array_equal(band, expected)
+
+
+def check_tiered(fill, escalated):
+    # The double mark, the blank and the shaded questions are low margin
+    assert {DOUBLE, BLANK, *SHADED} <= set(escalated.tolist())
+    assert not set(escalated.tolist()) - {DOUBLE, BLANK, *SHADED}
+    picks = scoring.pick_answers(fill)
+    answered = [q for q in range(len(PICKS)) if q != BLANK]
+    assert picks[answered].tolist() == [PICKS[q] for q in answered]
+    blank, multi = scoring.mark_flags(fill)
+    assert np.flatnonzero(blank).tolist() == [BLANK]
+    assert np.flatnonzero(multi).tolist() == [DOUBLE]
+
+
+def test_tiered_warp_fill(layout):
+    gray = draw_sheet(layout)
+    # Otsu alone reads every shaded bubble as ink
+    otsu, _ = scoring.tiered_warp_fill(gray, layout, block_size=41, escalate_margin=-1)
+    assert np.all(scoring.margins(otsu[list(SHADED)]) == 0)
+    fill, escalated = scoring.tiered_warp_fill(gray, layout, block_size=41)
+    check_tiered(fill, escalated)
+
+
+def test_tiered_sample_fill(layout):
+    # The source image is the warped sheet itself
+    fill, escalated = scoring.tiered_sample_fill(draw_sheet(layout), np.eye(3), layout, samples=8)
+    check_tiered(fill, escalated)
+
+
+def test_tiered_sample_fill_limits_questions(layout):
+    fill, escalated = scoring.tiered_sample_fill(draw_sheet(layout), np.eye(3), layout, no_questions=4, samples=8)
+    assert fill.shape == (4, 4)
+    assert escalated.tolist() == [DOUBLE]
+    assert scoring.pick_answers(fill)[1:].tolist() == PICKS[1:4]
@@ -0,0 +1,27 @@
+import tracing
+import worker
+
+
+def test_traced_cache_hit_keeps_the_input(tmp_path, sheet_photo, monkeypatch):
+    monkeypatch.setattr(worker, "measurements", worker.MeasurementCache(16))
+    monkeypatch.setattr(worker, "traces", tracing.TraceStore(str(tmp_path), rate=1.0))
+    sheet = sheet_photo()
+    body, marks = sheet.jpeg, sheet.marks
+    header = {"questions": len(marks), "answers": marks.tolist(), "render": False}
+
+    first = worker.handle_grade(header, body)
+    second = worker.handle_grade(header, body)
+    assert first["score"] == second["score"] == len(marks)
+
+    stages, meta = tracing.load(str(tmp_path / (second["trace"] + ".npz")))
+    assert meta["cached"] is True
+    assert "gray" in stages
+    assert len(meta["corners"]) == 4
+    tracing.montage(stages, meta)
+
+
+def test_unsampled_requests_are_not_traced(tmp_path):
+    store = tracing.TraceStore(str(tmp_path), rate=0.0)
+    assert store.begin() is tracing.NO_TRACE
+    assert store.begin(force=True) is not tracing.NO_TRACE
+    assert tracing.TraceStore(None, rate=1.0).begin(force=True) is tracing.NO_TRACE
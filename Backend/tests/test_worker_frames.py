@@ -0,0 +1,61 @@
+import io
+import os
+import subprocess
+import sys
+
+import worker
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Trickle(io.RawIOBase):
+    """Stream handing out at most three bytes per read, like a slow pipe"""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        return self.data.read(min(n, 3) if n >= 0 else 3)
+
+
+def frames(*pairs):
+    out = io.BytesIO()
+    for header, body in pairs:
+        worker.write_frame(out, header, body)
+    return out.getvalue()
+
+
+def test_frames_round_trip_over_short_reads():
+    stream = Trickle(frames(({"id": 1, "op": "grade"}, b"\xff\xd8jpeg"), ({"id": 2}, b"")))
+    assert worker.read_frame(stream) == ({"id": 1, "op": "grade", "size": 6}, b"\xff\xd8jpeg")
+    assert worker.read_frame(stream) == ({"id": 2}, b"")
+    assert worker.read_frame(stream) == (None, None)
+
+
+def test_stream_closed_mid_frame_reads_as_end():
+    data = frames(({"id": 1}, b"0123456789"))
+    # Inside the length prefix, the header and the body
+    for cut in (2, 8, len(data) - 4):
+        assert worker.read_frame(io.BytesIO(data[:cut])) == (None, None)
+
+
+def test_worker_process_speaks_the_protocol():
+    requests = frames(({"id": 7, "op": "stats"}, b""), ({"id": 8, "op": "nope"}, b""))
+    proc = subprocess.run(
+        [sys.executable, "worker.py"], cwd=BACKEND, input=requests, capture_output=True, timeout=60
+    )
+    assert proc.returncode == 0, proc.stderr.decode()
+    stream = io.BytesIO(proc.stdout)
+    assert worker.read_frame(stream) == ({"ready": True}, b"")
+
+    header, body = worker.read_frame(stream)
+    assert header["id"] == 7 and body == b""
+    assert set(header["result"]["cache"]) == {"entries", "hits", "disk_hits", "misses"}
+    assert header["cache"] == header["result"]["cache"]
+
+    header, _ = worker.read_frame(stream)
+    assert header["id"] == 8 and header["result"] == {"error": "Unknown op: nope"}
+    assert worker.read_frame(stream) == (None, None)
@@ -0,0 +1,96 @@
+const assert = require("assert");
+const path = require("path");
+const test = require("node:test");
+
+const { Registry } = require("../metrics");
+const { WorkerPool, encodeFrame, FrameReader } = require("../workerPool");
+
+function fakePool(size = 1) {
+  return new WorkerPool({
+    size,
+    python: process.env.PYTHON || "python3",
+    script: path.join(__dirname, "fake_worker.py"),
+    restartDelayMs: 10,
+    timeoutMs: 5000,
+  });
+}
+
+test("frames survive arbitrary chunking", () => {
+  const frames = [];
+  const reader = new FrameReader((header, body) => frames.push([header, body.toString()]));
+  const data = Buffer.concat([
+    encodeFrame({ id: 1 }, Buffer.from("abc")),
+    encodeFrame({ id: 2 }),
+  ]);
+  for (let i = 0; i < data.length; i += 3) reader.push(data.subarray(i, i + 3));
+  assert.deepStrictEqual(frames, [
+    [{ id: 1, size: 3 }, "abc"],
+    [{ id: 2 }, ""],
+  ]);
+});
+
+test("pool survives a worker dying in the middle of a write", async () => {
+  const pool = fakePool();
+  try {
+    // Far larger than a pipe buffer, so the write is still pending when
+    // the worker closes its stdin
+    const body = Buffer.alloc(16 * 1024 * 1024);
+    await assert.rejects(pool.run({ op: "die" }, body));
+    const { result } = await pool.run({ op: "echo" }, body);
+    assert.deepStrictEqual(result, { echo: "echo" });
+  } finally {
+    pool.close();
+  }
+});
+
+test("a malformed header stops the reader", () => {
+  const frames = [];
+  const errors = [];
+  const reader = new FrameReader(
+    (header) => frames.push(header),
+    (err) => errors.push(err.message)
+  );
+  const garbled = Buffer.from("{not json");
+  const prefix = Buffer.alloc(4);
+  prefix.writeUInt32BE(garbled.length, 0);
+  reader.push(Buffer.concat([encodeFrame({ id: 1 }), prefix, garbled]));
+  reader.push(encodeFrame({ id: 2 }));
+  assert.deepStrictEqual(frames, [{ id: 1 }]);
+  assert.strictEqual(errors.length, 1);
+  assert.match(errors[0], /Malformed frame/);
+});
+
+test("a worker sending a malformed frame is restarted", async () => {
+  const pool = fakePool();
+  try {
+    await assert.rejects(pool.run({ op: "garble" }), /Malformed frame/);
+    const { result } = await pool.run({ op: "echo" });
+    assert.deepStrictEqual(result, { echo: "echo" });
+  } finally {
+    pool.close();
+  }
+});
+
+test("cache counters reported by the workers add up", async () => {
+  const pool = fakePool(2);
+  try {
+    await Promise.all([1, 2, 3].map(() => pool.run({ op: "echo" })));
+    assert.deepStrictEqual(pool.cacheStats(), {
+      entries: 0,
+      hits: 0,
+      disk_hits: 0,
+      misses: 3,
+    });
+  } finally {
+    pool.close();
+  }
+});
+
+test("collected counters render as counters", () => {
+  const registry = new Registry();
+  registry.collectedCounter("grader_cache_hits_total", "Hits", () => 7);
+  assert.strictEqual(
+    registry.render(),
+    "# HELP grader_cache_hits_total Hits\n# TYPE grader_cache_hits_total counter\ngrader_cache_hits_total 7\n"
+  );
+});
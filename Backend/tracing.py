@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# Traces kept per directory; the oldest are deleted first
+DEFAULT_MAX_TRACES = 200
+
+# Long side images are stored at; full frames are shrunk when added, which
+# keeps a trace to a few hundred KB
+TRACE_SIZE = 600
+
+# Montage tiles: long side of each tile and tiles per row
+TILE_SIZE = 360
+TILE_COLUMNS = 4
+
+
+class Trace:
+    """
+    Intermediate images and facts of one graded sheet, in the order the
+    pipeline produced them. Arrays are copied when added, because scratch
+    buffers are overwritten by the next stage or sheet; images larger than
+    TRACE_SIZE are stored shrunk.
+    """
+
+    def __init__(self, trace_id):
+        self.id = trace_id
+        self.stages = {}
+        self.meta = {}
+
+    def add(self, stage, array):
+        scale = TRACE_SIZE / float(max(array.shape[:2]))
+        if array.dtype == np.uint8 and scale < 1:
+            self.stages[stage] = cv2.resize(array, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            self.stages[stage] = np.array(array, copy=True)
+
+    def note(self, **facts):
+        self.meta.update(facts)
+
+
+class _NoTrace:
+    """Stand-in when tracing is off: nothing is copied, drawn or kept"""
+
+    id = None
+
+    def add(self, stage, array):
+        pass
+
+    def note(self, **facts):
+        pass
+
+
+NO_TRACE = _NoTrace()
+
+
+class TraceStore:
+    """
+    Bounded ring of traces on disk, one compressed .npz per sheet. A share
+    `rate` of requests is traced (0 turns sampling off); a request can also
+    ask for a trace explicitly. Without a directory nothing is ever traced.
+    """
+
+    def __init__(self, directory=None, rate=0.0, max_traces=DEFAULT_MAX_TRACES):
+        self.directory = directory
+        self.rate = rate
+        self.max_traces = max_traces
+        self.sequence = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def begin(self, force=False):
+        """A Trace for a sampled (or forced) request, NO_TRACE otherwise"""
+        if not self.directory or not (force or (self.rate and random.random() < self.rate)):
+            return NO_TRACE
+        self.sequence += 1
+        return Trace(f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.sequence}")
+
+    def save(self, trace):
+        """Write a trace and drop the oldest beyond max_traces; NO_TRACE is ignored"""
+        if trace is NO_TRACE:
+            return None
+        path = os.path.join(self.directory, trace.id + ".npz")
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, _meta=np.str_(json.dumps(trace.meta, default=_plain)), **trace.stages)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return None
+        self.trim()
+        return path
+
+    def trim(self):
+        try:
+            files = sorted(
+                (entry.stat().st_mtime, entry.path)
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(".npz")
+            )
+        except OSError:
+            return
+        for _, path in files[: max(0, len(files) - self.max_traces)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _plain(value):
+    """JSON fallback for NumPy values in trace notes"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def load(path):
+    """(stages, meta) of a saved trace, stages in capture order"""
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data["_meta"]))
+        stages = {name: data[name] for name in data.files if name != "_meta"}
+    return stages, meta
+
+
+def tile(name, array, meta):
+    """One stage as a TILE_SIZE square BGR image for the montage, aspect kept"""
+    if array.dtype != np.uint8:
+        # Fill matrices and other float data: a heat map, one block per value
+        array = cv2.applyColorMap((np.clip(array, 0, 1) * 255).astype(np.uint8), cv2.COLORMAP_VIRIDIS)
+        interpolation = cv2.INTER_NEAREST
+    else:
+        if array.max() <= 1:
+            # 0/1 masks
+            array = array * 255
+        interpolation = cv2.INTER_AREA
+    image = cv2.cvtColor(array, cv2.COLOR_GRAY2BGR) if array.ndim == 2 else array
+
+    height, width = image.shape[:2]
+    scale = TILE_SIZE / float(max(height, width))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    image = cv2.resize(image, size, interpolation=interpolation)
+    corners = meta.get("corners")
+    if name in ("gray", "detect") and corners is not None:
+        # Corners are in gray's coordinates; the detection level is gray scaled down
+        points = np.float32(corners)[[0, 1, 3, 2]] * (size[0] / float(meta.get("width", width)))
+        cv2.polylines(image, [np.int32(np.round(points)).reshape(-1, 1, 2)], True, (0, 255, 0), 2)
+
+    framed = np.full((TILE_SIZE, TILE_SIZE, 3), 64, np.uint8)
+    top, left = (TILE_SIZE - size[1]) // 2, (TILE_SIZE - size[0]) // 2
+    framed[top:top + size[1], left:left + size[0]] = image
+    return framed
+
+
+def montage(stages, meta):
+    """Grid of every traced stage with its name, built offline with debugi"""
+    import debugi
+
+    names = list(stages)
+    tiles = [tile(name, stages[name], meta) for name in names]
+    blank = np.zeros((TILE_SIZE, TILE_SIZE, 3), np.uint8)
+    rows, labels = [], []
+    for start in range(0, len(tiles), TILE_COLUMNS):
+        padding = TILE_COLUMNS - len(tiles[start:start + TILE_COLUMNS])
+        rows.append(tiles[start:start + TILE_COLUMNS] + [blank] * padding)
+        labels.append(names[start:start + TILE_COLUMNS] + [""] * padding)
+    return debugi.stackImages(rows, 1, labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect grading traces captured by the workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="list the traces in a directory, newest last")
+    listing.add_argument("directory")
+    show = commands.add_parser("montage", help="render a trace's stages as one image")
+    show.add_argument("trace", help="trace .npz file")
+    show.add_argument("-o", "--out", help="output image (default: next to the trace)")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        paths = sorted(
+            (os.path.join(args.directory, name) for name in os.listdir(args.directory) if name.endswith(".npz")),
+            key=os.path.getmtime,
+        )
+        for path in paths:
+            stages, meta = load(path)
+            summary = {k: meta.get(k) for k in ("op", "layout", "mode", "registration", "score", "error") if k in meta}
+            print(json.dumps({"trace": os.path.basename(path), "stages": list(stages), **summary}))
+        return
+
+    stages, meta = load(args.trace)
+    if not stages:
+        # Failed before the first image (e.g. an unreadable upload)
+        print(json.dumps({"error": "trace has no images", **meta}))
+        return
+    out = args.out or os.path.splitext(args.trace)[0] + ".jpg"
+    cv2.imwrite(out, montage(stages, meta))
+    print(json.dumps({"montage": out, "stages": list(stages), **meta}, default=_plain))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+import registration
+
+# Long side of the pyramid level corners are tracked on. Preview frames are
+# small already; this only caps the cost when a client sends larger ones.
+TRACK_SIZE = 480
+
+# Largest forward-backward optical-flow error, in tracking pixels, for a
+# tracked corner to be trusted
+MAX_FB_ERROR = 1.0
+
+# A tracked quad whose area changes by more than this factor between frames
+# is treated as lost and the sheet is searched for again
+MAX_AREA_CHANGE = 1.25
+
+# Corner motion, in tracking pixels, below which a frame counts as still, and
+# how many still frames in a row make the sheet stable enough to grade
+STABLE_PX = 2.0
+STABLE_FRAMES = 3
+
+LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+
+
+def quad_area(corners):
+    """Area of a TL, TR, BL, BR quad"""
+    return cv2.contourArea(np.float32(corners)[[0, 1, 3, 2]])
+
+
+def valid_quad(previous, corners):
+    """Cheap sanity check of a tracked quad: convex and about the same size"""
+    if not cv2.isContourConvex(np.float32(corners)[[0, 1, 3, 2]].reshape(-1, 1, 2)):
+        return False
+    before, after = quad_area(previous), quad_area(corners)
+    return before > 0 and 1 / MAX_AREA_CHANGE <= after / before <= MAX_AREA_CHANGE
+
+
+def track_corners(prev, gray, corners):
+    """
+    Follow the four corners from frame prev to frame gray with pyramidal
+    Lucas-Kanade flow, checked by flowing back again. Returns the new corners,
+    or None when any corner is lost or the quad no longer looks like the sheet.
+    """
+    pts = corners.reshape(-1, 1, 2).astype(np.float32)
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, pts, None, **LK_PARAMS)
+    back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev, moved, None, **LK_PARAMS)
+    if not (status.all() and back_status.all()):
+        return None
+    if np.abs(back - pts).reshape(4, 2).max() > MAX_FB_ERROR:
+        return None
+    moved = moved.reshape(4, 2)
+    return moved if valid_quad(corners, moved) else None
+
+
+class Tracker:
+    """
+    Sheet corners across the frames of one live camera session. The sheet
+    is registered once and then tracked with optical flow; the full search
+    only runs again when tracking is lost.
+    """
+
+    def __init__(self, sheet_layout):
+        self.layout = sheet_layout
+        self.prev = None
+        self.corners = None  # in tracking-level coordinates
+        self.stable = 0
+
+    def reset(self):
+        self.prev = None
+        self.corners = None
+        self.stable = 0
+
+    def update(self, gray):
+        """
+        Locate the sheet in the next grayscale frame. Returns (corners, method)
+        with corners (TL, TR, BL, BR) in gray's coordinates and method
+        "tracked" or the registration method, or (None, None) when the sheet
+        isn't in view.
+        """
+        small, scale = registration.downscale(gray, TRACK_SIZE)
+        corners, method = None, None
+        if self.corners is not None and self.prev is not None and self.prev.shape == small.shape:
+            corners = track_corners(self.prev, small, self.corners)
+            method = "tracked" if corners is not None else None
+        if corners is None:
+            found, method = registration.register(gray, self.layout)
+            corners = found * scale if found is not None else None
+
+        if corners is None:
+            self.reset()
+            return None, None
+
+        still = self.corners is not None and np.abs(corners - self.corners).max() < STABLE_PX
+        self.stable = self.stable + 1 if still else 0
+        self.prev, self.corners = small, np.float32(corners)
+        return self.corners / scale, method
+
+    @property
+    def is_stable(self):
+        return self.stable >= STABLE_FRAMES
@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+import scan
+import decode
+import analytics
+import exams
+import quality
+import rigs
+from buffers import scratch
+from cache import MeasurementCache, content_key
+from tracker import Tracker
+from tracing import NO_TRACE, TraceStore, DEFAULT_MAX_TRACES
+
+# Frame layout (both directions):
+#   4-byte big-endian length of the JSON header
+#   JSON header (utf-8)
+#   header["size"] bytes of binary body (omitted when size is 0 / missing)
+HEADER = struct.Struct(">I")
+
+
+def read_exact(stream, n):
+    """Read exactly n bytes, or return None if the stream closed first"""
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(stream):
+    """
+    Read one framed request and return (header, body), or (None, None) at
+    EOF, including a stream that closed partway through a frame
+    """
+    raw = read_exact(stream, HEADER.size)
+    if raw is None:
+        return None, None
+    (length,) = HEADER.unpack(raw)
+    data = read_exact(stream, length)
+    if data is None:
+        return None, None
+    header = json.loads(data)
+    size = int(header.get("size", 0))
+    body = read_exact(stream, size) if size else b""
+    if body is None:
+        return None, None
+    return header, body
+
+
+def write_frame(stream, header, body=b""):
+    """Write one framed response and flush it"""
+    if body:
+        header = dict(header, size=len(body))
+    data = json.dumps(header).encode("utf-8")
+    stream.write(HEADER.pack(len(data)))
+    stream.write(data)
+    if body:
+        stream.write(body)
+    stream.flush()
+
+
+# Registration + fill results per image content, shared between the workers
+# through GRADER_CACHE_DIR when it is set
+measurements = MeasurementCache(
+    int(os.environ.get("GRADER_CACHE_SIZE", 256)),
+    os.environ.get("GRADER_CACHE_DIR") or None,
+)
+
+# Intermediate images of a sampled share of grade requests (GRADER_TRACE_RATE,
+# 0 by default) or of requests asking for it, kept in GRADER_TRACE_DIR. Off
+# unless the directory is set; render the montages with tracing.py.
+traces = TraceStore(
+    os.environ.get("GRADER_TRACE_DIR") or None,
+    float(os.environ.get("GRADER_TRACE_RATE", 0)),
+    int(os.environ.get("GRADER_TRACE_MAX", DEFAULT_MAX_TRACES)),
+)
+
+
+def load_request_image(header, body, sheet_layout, gray=False):
+    """Decode the sheet image from the frame body, or read it from header["path"]"""
+    if body:
+        return scan.decode_image(body, sheet_layout, gray)
+    return scan.read_image(header.get("path", ""), sheet_layout, gray)
+
+
+# Handlers return a result dict, or (result, body) when they produce binary
+# data; the annotated JPEG travels as the raw frame body, never base64.
+
+def request_exam(header):
+    """
+    (layout, question count, key, exam) of a request: from the registered
+    exam when header["exam"] names one, otherwise from the inline fields
+    """
+    if header.get("exam") is None:
+        sheet_layout = scan.get_layout(header.get("layout"))
+        no_questions = int(header["questions"])
+        return sheet_layout, no_questions, scan.parse_answers(no_questions, header["answers"], sheet_layout), None
+    try:
+        exam = exams.load_exam(header["exam"])
+    except ValueError as e:
+        raise scan.ScanError(str(e))
+    return exam.layout, exam.questions, exam.key, exam
+
+
+def handle_grade(header, body):
+    # header["trace"] asks for this sheet to be traced, sampled or not
+    trace = traces.begin(bool(header.get("trace")))
+    if trace is NO_TRACE:
+        return grade_request(header, body, trace)
+    # Failed sheets are the ones worth looking at: keep their trace too
+    try:
+        response = grade_request(header, body, trace)
+    except Exception as e:
+        trace.note(error=str(e))
+        response = scan.error_result(e)
+    traces.save(trace)
+    (response[0] if isinstance(response, tuple) else response)["trace"] = trace.id
+    return response
+
+
+def grade_request(header, body, trace):
+    # header["timing"] asks for per-stage wall times in result["timing"]
+    timer = scan.StageTimer() if header.get("timing") else None
+    stages = timer or scan.NO_TIMER
+    sheet_layout, no_questions, ans, exam = request_exam(header)
+    render = header.get("render", True)
+    mode = header.get("scoring", "sample")
+    check = header.get("quality", True)
+    # header["rig"] names a calibrated scanning rig the photo was taken on
+    rig = rigs.load_rig(header["rig"]) if header.get("rig") else None
+    if rig is not None and rig.layout.name != sheet_layout.name:
+        raise scan.ScanError(f"Rig {rig.id} is calibrated for layout {rig.layout.name}")
+    stages.mark("setup")
+
+    # Uploads are cached by content: a resubmitted photo, or the same photo
+    # graded against a corrected key, skips decoding and registration. A rig
+    # supplies the corners, so its calibration is part of the key.
+    parts = (sheet_layout.name, mode, check) + ((rig.id, rig.version) if rig else ())
+    key = content_key(body, *parts) if body else None
+    measured = measurements.get(key) if key else None
+    stages.mark("cache")
+    trace.note(op="grade", cached=measured is not None)
+    img = None
+    if measured is None:
+        # Score-only requests never need colour, so decode straight to grayscale
+        img = load_request_image(header, body, sheet_layout, gray=not render)
+        stages.mark("decode")
+        measured = scan.measure_sheet(img, sheet_layout, mode, check, timer=stages, trace=trace, rig=rig)
+        if key:
+            measurements.put(key, measured)
+            stages.mark("cache")
+    elif trace is not NO_TRACE:
+        # A traced cache hit still shows the photo and where the sheet was found
+        gray = load_request_image(header, body, sheet_layout, gray=True)
+        trace.add("gray", gray)
+        trace.note(layout=sheet_layout.name, mode=mode, width=gray.shape[1])
+        trace.note(corners=measured["corners"], registration=measured["registration"])
+    result = scan.grade_measurement(measured, no_questions, ans, sheet_layout)
+    trace.note(score=result["score"], picks=result["picks"], grading=result["grading"])
+    # Keep the fill matrix with the exam so it can be regraded without the
+    # image; a sheet seen for the first time also goes into the item stats
+    if exam is not None and key:
+        analytics.submit(exam, key, result, measured)
+        result["submission"] = key
+    stages.mark("grade")
+    if not render:
+        return with_timing(result, timer)
+    if img is None:
+        img = load_request_image(header, body, sheet_layout)
+        stages.mark("decode")
+    overlay = scan.render_overlay(img, result, ans, sheet_layout)
+    stages.mark("overlay")
+    trace.add("overlay", overlay)
+    image = scan.encode_jpeg(overlay)
+    stages.mark("encode")
+    result["image_type"] = "jpg"
+    return with_timing(result, timer), image
+
+
+def with_timing(result, timer):
+    if timer is not None:
+        result["timing"] = timer.result()
+    return result
+
+
+def handle_render(header, body):
+    """Draw the annotated image for a result previously returned by a grade op"""
+    result = header["result"]
+    if header.get("exam") is not None:
+        sheet_layout, _, ans, _ = request_exam(header)
+    else:
+        sheet_layout = scan.get_layout(header.get("layout"))
+        ans = scan.parse_answers(len(result["grading"]), header["answers"], sheet_layout)
+    img = load_request_image(header, body, sheet_layout)
+    return {"image_type": "jpg"}, scan.encode_jpeg(scan.render_overlay(img, result, ans, sheet_layout))
+
+
+# Live camera sessions pinned to this worker, least recently used first
+MAX_SESSIONS = 32
+sessions = OrderedDict()
+
+
+def session_tracker(session, sheet_layout):
+    """Tracker of a live session, created on its first frame"""
+    tracker = sessions.get(session)
+    if tracker is None or tracker.layout is not sheet_layout:
+        tracker = sessions[session] = Tracker(sheet_layout)
+        while len(sessions) > MAX_SESSIONS:
+            sessions.popitem(last=False)
+    sessions.move_to_end(session)
+    return tracker
+
+
+def handle_track(header, body):
+    """
+    One preview frame of a live session: locate the sheet (tracking it from
+    the previous frame when possible), report framing guidance, and grade the
+    frame once the sheet has held still and the frame passes the quality check
+    """
+    graded = header.get("exam") is not None or header.get("answers") is not None
+    if graded:
+        sheet_layout, no_questions, ans, _ = request_exam(header)
+    else:
+        sheet_layout = scan.get_layout(header.get("layout"))
+    tracker = session_tracker(header["session"], sheet_layout)
+    gray = decode.decode(body, gray=True)
+    if gray is None:
+        raise scan.ScanError("Could not read frame")
+    # Previews are small; only ever shrink them to the working size
+    if max(gray.shape) > sheet_layout.source_size:
+        gray = decode.fit(gray, sheet_layout.source_size)
+
+    corners, method = tracker.update(gray)
+    reason, _ = quality.check(gray)
+    response = {
+        "found": corners is not None,
+        "corners": np.round(corners.astype(float), 1).tolist() if corners is not None else None,
+        "registration": method,
+        "stable": tracker.stable,
+        "size": [gray.shape[1], gray.shape[0]],
+        "reason": reason,
+    }
+    if corners is not None and tracker.is_stable and reason is None and graded:
+        try:
+            response["result"] = scan.analyze_sheet(
+                gray, no_questions, ans, sheet_layout, check=False, registered=(corners, method)
+            )
+        except scan.ScanError as e:
+            # Keep the framing guidance; the client just sends the next frame
+            response["result"] = scan.error_result(e)
+    return response
+
+
+def handle_regrade(header, body):
+    """
+    Regrade every sheet submitted for an exam against its current key, from
+    the stored fill matrices; no image is decoded or registered again
+    """
+    _, _, _, exam = request_exam(header)
+    if exam is None:
+        raise scan.ScanError("regrade needs an exam id")
+    # The item stats follow the new key without another pass over the sheets
+    return {"exam": exam.id, "results": analytics.regrade(exam)}
+
+
+def handle_analytics(header, body):
+    """Item analysis of every sheet graded for an exam"""
+    _, _, _, exam = request_exam(header)
+    if exam is None:
+        raise scan.ScanError("analytics needs an exam id")
+    return analytics.exam_summary(exam)
+
+
+def handle_capture(header, body):
+    """Capture profile clients should upload at for a layout"""
+    return scan.get_layout(header.get("layout")).capture_profile()
+
+
+def handle_calibrate(header, body):
+    """Calibrate header["rig"] from a reference sheet photographed on it"""
+    sheet_layout = scan.get_layout(header.get("layout"))
+    gray = load_request_image(header, body, sheet_layout, gray=True)
+    return rigs.describe(rigs.calibrate(header.get("rig"), gray, sheet_layout))
+
+
+def handle_stats(header, body):
+    """Cache and scratch buffer counters of this worker"""
+    return {"cache": measurements.stats(), "sessions": len(sessions), "scratch": scratch.stats()}
+
+
+def handle_end(header, body):
+    """Forget a live session's tracker"""
+    sessions.pop(header.get("session"), None)
+    return {"ended": True}
+
+
+HANDLERS = {
+    "grade": handle_grade,
+    "render": handle_render,
+    "track": handle_track,
+    "regrade": handle_regrade,
+    "analytics": handle_analytics,
+    "calibrate": handle_calibrate,
+    "capture": handle_capture,
+    "end": handle_end,
+    "stats": handle_stats,
+}
+
+
+def handle(header, body):
+    """
+    Dispatch one request to its handler and return (result, body), turning
+    failures into error results
+    """
+    try:
+        handler = HANDLERS.get(header.get("op", "grade"))
+        if handler is None:
+            return {"error": f"Unknown op: {header.get('op')}"}, b""
+        response = handler(header, body)
+        return response if isinstance(response, tuple) else (response, b"")
+    except Exception as e:
+        return scan.error_result(e), b""
+
+
+def main():
+    """Serve framed grading requests on stdin/stdout until stdin is closed"""
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Anything printed by library code must not corrupt the frame stream
+    sys.stdout = sys.stderr
+
+    write_frame(stdout, {"ready": True})
+    while True:
+        header, body = read_frame(stdin)
+        if header is None:
+            break
+        result, data = handle(header, body)
+        # The cache counters ride along with every response for /metrics
+        write_frame(stdout, {"id": header.get("id"), "result": result, "cache": measurements.stats()}, data)
+
+
+if __name__ == "__main__":
+    main()
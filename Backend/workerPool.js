@@ -0,0 +1,312 @@
+const { spawn } = require("child_process");
+const os = require("os");
+const path = require("path");
+const { performance } = require("perf_hooks");
+
+// Frames match worker.py: 4-byte big-endian header length, JSON header,
+// then header.size bytes of binary body.
+function encodeFrame(header, body) {
+  if (body && body.length) header = { ...header, size: body.length };
+  const json = Buffer.from(JSON.stringify(header), "utf8");
+  const prefix = Buffer.alloc(4);
+  prefix.writeUInt32BE(json.length, 0);
+  return body && body.length
+    ? Buffer.concat([prefix, json, body])
+    : Buffer.concat([prefix, json]);
+}
+
+// Calls onFrame(header, body) per complete frame. A header that isn't a
+// JSON object means the stream is out of step and can't be recovered:
+// onError gets the error and everything after it is dropped.
+class FrameReader {
+  constructor(onFrame, onError) {
+    this.onFrame = onFrame;
+    this.onError = onError;
+    this.buffer = Buffer.alloc(0);
+    this.failed = false;
+  }
+
+  push(chunk) {
+    if (this.failed) return;
+    this.buffer = Buffer.concat([this.buffer, chunk]);
+    while (this.buffer.length >= 4) {
+      const headerLength = this.buffer.readUInt32BE(0);
+      if (this.buffer.length < 4 + headerLength) return;
+      let header;
+      try {
+        header = JSON.parse(
+          this.buffer.subarray(4, 4 + headerLength).toString("utf8")
+        );
+        if (!header || typeof header !== "object") {
+          throw new Error("header is not an object");
+        }
+      } catch (err) {
+        this.failed = true;
+        this.buffer = Buffer.alloc(0);
+        this.onError(new Error(`Malformed frame from worker: ${err.message}`));
+        return;
+      }
+      const size = header.size || 0;
+      const end = 4 + headerLength + size;
+      if (this.buffer.length < end) return;
+      const body = this.buffer.subarray(4 + headerLength, end);
+      this.buffer = this.buffer.subarray(end);
+      this.onFrame(header, body);
+    }
+  }
+}
+
+class Worker {
+  constructor(pool, index) {
+    this.pool = pool;
+    this.index = index;
+    this.ready = false;
+    this.job = null;
+    this.stderr = "";
+    this.start();
+  }
+
+  start() {
+    const { python, script, cwd } = this.pool.options;
+    this.spawned = performance.now();
+    const proc = (this.proc = spawn(python, [script], { cwd }));
+    this.ready = false;
+    this.stderr = "";
+    const reader = new FrameReader(
+      (header, body) => this.onFrame(header, body),
+      // Nothing more it sends can be trusted: fail its job and restart it
+      (err) => {
+        if (proc !== this.proc) return;
+        proc.kill("SIGKILL");
+        this.onExit(null, err);
+      }
+    );
+    proc.stdout.on("data", (chunk) => reader.push(chunk));
+    proc.stderr.on("data", (data) => {
+      // Keep only the tail so a chatty worker can't grow memory unbounded
+      this.stderr = (this.stderr + data.toString()).slice(-4096);
+    });
+    // A worker that dies while a frame is being written closes the pipe
+    // under us (EPIPE): fail its job and restart it like any other exit,
+    // instead of letting the unhandled error take the server down
+    proc.stdin.on("error", (err) => {
+      if (proc !== this.proc) return;
+      proc.kill("SIGKILL");
+      this.onExit(null, err);
+    });
+    // Events of a process already replaced by a restart are ignored
+    proc.on("error", (err) => proc === this.proc && this.onExit(null, err));
+    proc.on("exit", (code, signal) => proc === this.proc && this.onExit(code || signal));
+  }
+
+  onFrame(header, body) {
+    if (header.ready) {
+      this.ready = true;
+      if (this.pool.options.onSpawn) {
+        this.pool.options.onSpawn(performance.now() - this.spawned);
+      }
+      this.pool.dispatch();
+      return;
+    }
+    // Latest cache counters of this worker process, summed for /metrics
+    if (header.cache) this.cache = header.cache;
+    const job = this.job;
+    if (!job || header.id !== job.id) return;
+    clearTimeout(job.timer);
+    this.job = null;
+    const workerMs = performance.now() - job.started;
+    this.pool.avgMs = 0.8 * this.pool.avgMs + 0.2 * workerMs;
+    job.resolve({
+      result: header.result,
+      body,
+      timing: { queueMs: job.started - job.queued, workerMs },
+    });
+    this.pool.dispatch();
+  }
+
+  run(job) {
+    this.job = job;
+    job.started = performance.now();
+    job.timer = setTimeout(() => {
+      // A stuck worker is killed; onExit rejects the job and restarts it
+      this.proc.kill("SIGKILL");
+    }, this.pool.options.timeoutMs);
+    this.proc.stdin.write(encodeFrame({ ...job.header, id: job.id }, job.body));
+  }
+
+  onExit(code, err) {
+    if (this.exited) return;
+    this.exited = true;
+    const job = this.job;
+    this.job = null;
+    this.ready = false;
+    if (job) {
+      clearTimeout(job.timer);
+      const error = new Error(
+        err ? err.message : `Worker exited (${code})`
+      );
+      error.details = this.stderr;
+      job.reject(error);
+    }
+    if (this.pool.closed) return;
+    console.error(`Grading worker ${this.index} exited (${code}), restarting`);
+    setTimeout(() => {
+      this.exited = false;
+      this.start();
+    }, this.pool.options.restartDelayMs);
+  }
+}
+
+class WorkerPool {
+  constructor(options = {}) {
+    this.options = {
+      size: os.cpus().length,
+      maxQueue: 1000,
+      timeoutMs: 60000,
+      restartDelayMs: 500,
+      python: "python",
+      script: "worker.py",
+      cwd: path.join(__dirname),
+    };
+    for (const [key, value] of Object.entries(options)) {
+      if (value !== undefined) this.options[key] = value;
+    }
+    this.queue = [];
+    this.pins = new Map();
+    this.nextId = 1;
+    // Moving average of request run time, for Retry-After estimates
+    this.avgMs = 1000;
+    this.closed = false;
+    this.workers = [];
+    for (let i = 0; i < this.options.size; i++) {
+      this.workers.push(new Worker(this, i));
+    }
+  }
+
+  // Queue a request for the next idle worker. Resolves with
+  // { result, body, timing } where result is the worker's JSON result and
+  // timing holds the queue wait and worker round trip in milliseconds.
+  // Requests sharing an affinity key always run on the same worker, so
+  // state a worker keeps per session (e.g. a corner tracker) is reused.
+  run(header, body, affinity) {
+    if (this.queue.length >= this.options.maxQueue) {
+      const error = new Error("Grading queue is full");
+      error.code = "QUEUE_FULL";
+      error.retryAfter = this.retryAfter();
+      return Promise.reject(error);
+    }
+    const worker = affinity === undefined ? null : this.pin(affinity);
+    return new Promise((resolve, reject) => {
+      this.queue.push({
+        id: this.nextId++,
+        header,
+        body,
+        worker,
+        queued: performance.now(),
+        resolve,
+        reject,
+      });
+      this.dispatch();
+    });
+  }
+
+  // Worker index an affinity key is bound to, picking the worker with the
+  // fewest bound keys the first time the key is seen
+  pin(key) {
+    if (!this.pins.has(key)) {
+      const counts = this.workers.map(() => 0);
+      for (const index of this.pins.values()) counts[index]++;
+      this.pins.set(key, counts.indexOf(Math.min(...counts)));
+    }
+    return this.pins.get(key);
+  }
+
+  unpin(key) {
+    this.pins.delete(key);
+  }
+
+  dispatch() {
+    for (const worker of this.workers) {
+      if (!this.queue.length) return;
+      if (!worker.ready || worker.job) continue;
+      const next = this.queue.findIndex(
+        (job) => job.worker === null || job.worker === worker.index
+      );
+      if (next !== -1) worker.run(this.queue.splice(next, 1)[0]);
+    }
+  }
+
+  // Seconds until the queue has drained enough to accept more work
+  retryAfter() {
+    const waves = Math.ceil(this.queue.length / this.workers.length);
+    return Math.max(1, Math.ceil((waves * this.avgMs) / 1000));
+  }
+
+  stats() {
+    return {
+      size: this.workers.length,
+      busy: this.workers.filter((w) => w.job).length,
+      queued: this.queue.length,
+      pinned: this.pins.size,
+    };
+  }
+
+  // Measurement cache counters summed over the workers, as last reported
+  // with a response. A restarted worker starts again from zero.
+  cacheStats() {
+    const total = { entries: 0, hits: 0, disk_hits: 0, misses: 0 };
+    for (const worker of this.workers) {
+      for (const key of Object.keys(total)) {
+        total[key] += (worker.cache && worker.cache[key]) || 0;
+      }
+    }
+    return total;
+  }
+
+  close() {
+    this.closed = true;
+    for (const worker of this.workers) worker.proc.stdin.end();
+  }
+}
+
+// Spawn a fresh worker for a single request (the fork-per-upload mode).
+// The worker exits once its stdin is closed after the one frame. timing
+// splits the time into interpreter start-up (spawnMs) and the request.
+function runOnce(header, body, options = {}) {
+  const python = options.python || "python";
+  const script = options.script || "worker.py";
+  const cwd = options.cwd || __dirname;
+  return new Promise((resolve, reject) => {
+    const started = performance.now();
+    let ready = started;
+    const proc = spawn(python, [script], { cwd });
+    let response = null;
+    let stderr = "";
+    const reader = new FrameReader((frame, frameBody) => {
+      if (frame.ready) {
+        ready = performance.now();
+        return;
+      }
+      response = {
+        result: frame.result,
+        body: frameBody,
+        timing: { spawnMs: ready - started, workerMs: performance.now() - ready },
+      };
+    });
+    proc.stdout.on("data", (chunk) => reader.push(chunk));
+    proc.stderr.on("data", (data) => (stderr += data.toString()));
+    proc.on("error", reject);
+    proc.on("close", (code) => {
+      if (code !== 0 || !response) {
+        const error = new Error("Processing failed");
+        error.details = stderr;
+        return reject(error);
+      }
+      resolve(response);
+    });
+    proc.stdin.on("error", () => {}); // exit is reported through "close"
+    proc.stdin.end(encodeFrame({ ...header, id: 1 }, body));
+  });
+}
+
+module.exports = { WorkerPool, runOnce, encodeFrame, FrameReader };
@@ -34,8 +34,9 @@ interface ExamResult {
   correct: number;
   total: number;
   grading: boolean[];
-  image: string;
-  image_type: string;
+  // Live results pushed over the WebSocket carry no rendered image
+  image?: string;
+  image_url?: string;
 }
 
 interface StoredExamResult {
@@ -49,7 +50,7 @@ interface StoredExamResult {
   percentage: number;
   grade: string;
   grading: boolean[];
-  image: string;
+  image?: string;
 }
 
 interface AnalysisData {
@@ -73,8 +74,44 @@ interface ImageAsset {
   height?: number;
 }
 
+interface CaptureProfile {
+  long_side: number;
+  grayscale: boolean;
+  jpeg_quality: number;
+}
+
 const { width, height } = Dimensions.get("window");
 
+const SERVER_URL = "http://192.168.8.4:3000";
+const STREAM_URL = "ws://192.168.8.4:3000/stream";
+
+// Used until the server has said what it needs (the old fixed 800x600 at 0.9)
+const DEFAULT_CAPTURE: CaptureProfile = {
+  long_side: 800,
+  grayscale: false,
+  jpeg_quality: 90,
+};
+
+// Guidance shown for the server's quality rejection reasons
+const LIVE_HINTS: Record<string, string> = {
+  blurry: "Hold steady, the image is blurry",
+  too_dark: "Too dark, find more light",
+  too_bright: "Too bright, avoid direct light",
+  low_contrast: "Low contrast, improve the lighting",
+  glare: "Glare on the sheet, tilt it away from the light",
+};
+
+interface LiveFrame {
+  found?: boolean;
+  stable?: number;
+  reason?: string | null;
+  result?: ExamResult & { error?: string };
+  error?: string;
+}
+
+const base64ToBytes = (data: string): ArrayBuffer =>
+  Uint8Array.from(atob(data), (c) => c.charCodeAt(0)).buffer;
+
 export default function App() {
   const [image, setImage] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
@@ -93,10 +130,27 @@ export default function App() {
   const [scanMode, setScanMode] = useState<"camera" | "upload">("camera");
   const [storedResults, setStoredResults] = useState<StoredExamResult[]>([]);
   const [analysisData, setAnalysisData] = useState<AnalysisData | null>(null);
+  const [liveStatus, setLiveStatus] = useState<string | null>(null);
   const cameraRef = useRef<CameraView>(null);
+  const socketRef = useRef<WebSocket | null>(null);
+  const captureRef = useRef<CaptureProfile>(DEFAULT_CAPTURE);
   const pulseAnim = useRef(new Animated.Value(1)).current;
 
-  // Function to enforce 4:3 aspect ratio
+  // Ask the server which resolution and JPEG quality the grader needs, so
+  // uploads carry no pixels it would throw away
+  const loadCaptureProfile = async () => {
+    try {
+      const response = await axios.get(`${SERVER_URL}/capture`);
+      if (response.data && !response.data.error) {
+        captureRef.current = response.data;
+      }
+    } catch (error) {
+      // Keep the defaults; grading still works, only with larger uploads
+    }
+  };
+
+  // Crop to 4:3 and downscale / compress to the server's capture profile.
+  // ImageManipulator has no grayscale action, so colour is always kept.
   const enforceAspectRatio = async (imageUri: string): Promise<string> => {
     try {
       const imageInfo = await ImageManipulator.manipulateAsync(imageUri, [], {
@@ -104,6 +158,7 @@ export default function App() {
       });
 
       const { width: imgWidth, height: imgHeight } = imageInfo;
+      const profile = captureRef.current;
       const targetRatio = 4 / 3;
       const currentRatio = imgWidth / imgHeight;
 
@@ -120,6 +175,9 @@ export default function App() {
         originY = (imgHeight - cropHeight) / 2;
       }
 
+      // The grader fits photos to long_side; never upscale to reach it
+      const targetWidth = Math.min(profile.long_side, Math.round(cropWidth));
+
       const manipulatedImage = await ImageManipulator.manipulateAsync(
         imageUri,
         [
@@ -133,13 +191,13 @@ export default function App() {
           },
           {
             resize: {
-              width: 800,
-              height: 600,
+              width: targetWidth,
+              height: Math.round((targetWidth * 3) / 4),
             },
           },
         ],
         {
-          compress: 0.9,
+          compress: profile.jpeg_quality / 100,
           format: ImageManipulator.SaveFormat.JPEG,
         }
       );
@@ -266,8 +324,8 @@ export default function App() {
     }
   };
 
-  const processImage = async (imageUri: string) => {
-    const convertedAnswers = answers
+  const answerIndexes = () =>
+    answers
       .toUpperCase()
       .split("")
       .map((ans) => {
@@ -276,6 +334,92 @@ export default function App() {
       })
       .filter((ans) => ans !== null);
 
+  // Live mode: stream small preview frames over a WebSocket, one in flight
+  // at a time. The server tracks the sheet between frames, answers each with
+  // framing guidance and grades on its own once the sheet holds still.
+  const sendLiveFrame = async () => {
+    const socket = socketRef.current;
+    if (!socket || socket.readyState !== WebSocket.OPEN || !cameraRef.current) {
+      return;
+    }
+    try {
+      const photo = await cameraRef.current.takePictureAsync({
+        quality: 0.3,
+        skipProcessing: true,
+        exif: false,
+      });
+      const frame = await ImageManipulator.manipulateAsync(
+        photo.uri,
+        [{ resize: { width: 640 } }],
+        {
+          compress: 0.6,
+          format: ImageManipulator.SaveFormat.JPEG,
+          base64: true,
+        }
+      );
+      if (frame.base64 && socketRef.current === socket) {
+        socket.send(base64ToBytes(frame.base64));
+      }
+    } catch (error) {
+      stopLiveScan();
+      setLiveStatus(null);
+    }
+  };
+
+  const onLiveFrame = (frame: LiveFrame) => {
+    if (frame.error) {
+      stopLiveScan();
+      setLiveStatus(null);
+      Alert.alert("Live Scan Error", frame.error);
+      return;
+    }
+    if (frame.result && !frame.result.error) {
+      stopLiveScan();
+      setLiveStatus(null);
+      setResult(frame.result);
+      return;
+    }
+    if (!frame.found) setLiveStatus("Looking for the answer sheet…");
+    else if (frame.reason) setLiveStatus(LIVE_HINTS[frame.reason] || frame.reason);
+    else setLiveStatus("Hold still…");
+    sendLiveFrame();
+  };
+
+  const startLiveScan = () => {
+    setResult(null);
+    setLiveStatus("Connecting…");
+    const socket = new WebSocket(STREAM_URL);
+    socketRef.current = socket;
+    socket.onopen = () =>
+      socket.send(JSON.stringify({ questions, answers: answerIndexes() }));
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.ready) sendLiveFrame();
+      else onLiveFrame(message);
+    };
+    socket.onerror = () => {
+      stopLiveScan();
+      setLiveStatus(null);
+      Alert.alert("Error", "Live scanning is not available");
+    };
+    socket.onclose = () => {
+      // Closed by the server rather than by stopLiveScan
+      if (socketRef.current === socket) {
+        socketRef.current = null;
+        setLiveStatus(null);
+      }
+    };
+  };
+
+  const stopLiveScan = () => {
+    const socket = socketRef.current;
+    socketRef.current = null;
+    if (socket) socket.close();
+  };
+
+  const processImage = async (imageUri: string) => {
+    const convertedAnswers = answerIndexes();
+
     const formData = new FormData();
     formData.append("image", {
       uri: imageUri,
@@ -287,7 +431,7 @@ export default function App() {
 
     try {
       const response = await axios.post(
-        "http://192.168.8.4:3000/process-image",
+        `${SERVER_URL}/process-image`,
         formData,
         {
           headers: { "Content-Type": "multipart/form-data" },
@@ -338,6 +482,8 @@ export default function App() {
   };
 
   const goBackToSetup = () => {
+    stopLiveScan();
+    setLiveStatus(null);
     setShowCamera(false);
     setShowManualUpload(false);
     setShowSetup(true);
@@ -557,9 +703,10 @@ export default function App() {
     );
   };
 
-  // Load stored results on component mount
+  // Load stored results and the capture profile on component mount
   useEffect(() => {
     loadStoredResults();
+    loadCaptureProfile();
   }, []);
 
   // Save result when new result is available
@@ -624,11 +771,13 @@ export default function App() {
                 {percentage.toFixed(1)}% • {grade}
               </Text>
             </View>
-            <Image
-              source={{ uri: result.image }}
-              style={{ width: 100, height: 100 }}
-              resizeMode="contain"
-            />
+            {result.image && (
+              <Image
+                source={{ uri: result.image }}
+                style={{ width: 100, height: 100 }}
+                resizeMode="contain"
+              />
+            )}
           </View>
 
           <View style={styles.briefButtonsContainer}>
@@ -816,7 +965,7 @@ export default function App() {
           </LinearGradient>
         </View>
 
-        {result && (
+        {result?.image && (
           <ImageView
             images={[{ uri: result.image }]}
             imageIndex={0}
@@ -1027,7 +1176,12 @@ export default function App() {
               pictureSize="high"
             />
             {/* Overlays positioned absolutely on top of camera */}
-            {showGuide && !result && renderCameraGuide()}
+            {showGuide && !result && !liveStatus && renderCameraGuide()}
+            {liveStatus && !result && (
+              <View style={styles.liveStatusContainer}>
+                <Text style={styles.liveStatusText}>{liveStatus}</Text>
+              </View>
+            )}
             {result && renderBriefResults()}
           </View>
 
@@ -1041,7 +1195,7 @@ export default function App() {
                     loading && styles.captureButtonDisabled,
                   ]}
                   onPress={takePicture}
-                  disabled={loading}
+                  disabled={loading || !!liveStatus}
                 >
                   {loading ? (
                     <ActivityIndicator color="#fff" size="large" />
@@ -1053,6 +1207,24 @@ export default function App() {
                   )}
                 </TouchableOpacity>
               )}
+              {!result && (
+                <TouchableOpacity
+                  style={styles.liveButton}
+                  onPress={() => {
+                    if (liveStatus) {
+                      stopLiveScan();
+                      setLiveStatus(null);
+                    } else {
+                      startLiveScan();
+                    }
+                  }}
+                  disabled={loading}
+                >
+                  <Text style={styles.liveButtonText}>
+                    {liveStatus ? "Stop Live" : "Live Scan"}
+                  </Text>
+                </TouchableOpacity>
+              )}
             </View>
           </View>
         </View>
@@ -1459,6 +1631,35 @@ const styles = StyleSheet.create({
     height: 64,
     borderRadius: 32,
   },
+  liveButton: {
+    marginTop: 16,
+    paddingHorizontal: 20,
+    paddingVertical: 10,
+    borderRadius: 20,
+    backgroundColor: "rgba(0, 0, 0, 0.6)",
+    borderWidth: 1,
+    borderColor: "rgba(255, 255, 255, 0.3)",
+  },
+  liveButtonText: {
+    color: "white",
+    fontSize: 14,
+    fontWeight: "600",
+  },
+  liveStatusContainer: {
+    position: "absolute",
+    bottom: 24,
+    alignSelf: "center",
+    backgroundColor: "rgba(0, 0, 0, 0.6)",
+    paddingHorizontal: 20,
+    paddingVertical: 12,
+    borderRadius: 25,
+  },
+  liveStatusText: {
+    color: "white",
+    fontSize: 16,
+    fontWeight: "600",
+    textAlign: "center",
+  },
   // Manual Upload styles
   uploadContainer: {
     flex: 1,